@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Request, Form, HTTPException, Depends, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
@@ -45,6 +46,9 @@ templates = Jinja2Templates(directory="templates")
 # URL del Gateway
 GATEWAY_URL = os.getenv('GATEWAY_URL', 'http://gateway:8000')
 
+# Ventana (minutos) del modo "Resumen por correo" de las notificaciones
+DIGEST_MINUTES = int(os.getenv('DIGEST_MINUTES', '60'))
+
 # --- HELPERS ---
 
 def get_frontend_headers() -> dict:
@@ -249,41 +253,60 @@ async def process_import_calendar(
     data = {
         "url": url_ical,
         "titulo_importado": titulo,
-        "organizador": user.get("name", "Usuario Importador")
+        "organizador": user.get("name", "Usuario Importador"),
+        "email_organizador": user.get("email")
     }
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
+    async with httpx.AsyncClient() as client:
         try:
+            # La importación se encola en el servicio externo; aquí solo esperamos el ID del trabajo
             response = await client.post(
                 f"{GATEWAY_URL}/external/import/ical",
                 json=data,
                 headers=get_frontend_headers()
             )
             
-            if response.status_code == 200:
-                result = response.json()
-                count = result.get('events_imported', 0)
-                return RedirectResponse(
-                    url=f"/?msg=Importación exitosa: {count} eventos creados&cat=success", 
-                    status_code=303
-                )
+            if response.status_code == 202:
+                job_id = response.json()["job_id"]
+                return RedirectResponse(url=f"/calendar/import/{job_id}", status_code=303)
             else:
                 error_detail = response.json().get('detail', response.text)
                 return RedirectResponse(
                     url=f"/calendar/import?msg=Error: {error_detail}&cat=danger", 
                     status_code=303
                 )
-        except httpx.ReadTimeout: 
-            return RedirectResponse(
-                url=f"/calendar/import?msg=El servidor está tardando demasiado. El calendario se creará en segundo plano.&cat=warning", 
-                status_code=303
-            )
         except httpx.RequestError:
             return RedirectResponse(
                 url=f"/calendar/import?msg=Error de conexión con el servicio de importación&cat=danger", 
                 status_code=303
             )
 
+@app.get("/calendar/import/{job_id}", response_class=HTMLResponse)
+async def import_status(job_id: str, request: Request):
+    """Progreso de una importación (la página se recarga sola mientras no termina)."""
+    user = get_current_user(request)
+    if not user:
+        return RedirectResponse("/login", status_code=303)
+
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.get(
+                f"{GATEWAY_URL}/external/import/jobs/{job_id}",
+                headers=get_frontend_headers()
+            )
+        except httpx.RequestError:
+            return RedirectResponse(url="/?msg=Error de conexión con el servicio de importación&cat=danger", status_code=303)
+    if response.status_code != 200:
+        return RedirectResponse(url="/?msg=Importación no encontrada&cat=danger", status_code=303)
+
+    return templates.TemplateResponse("import_status.html", {
+        "request": request,
+        "job": response.json(),
+        "messages": get_messages(request),
+        "user": user,
+        "is_admin": is_admin(request)
+    })
+
 # 3. DETALLE DE CALENDARIO
 @app.get("/calendar/{id}", response_class=HTMLResponse)
 async def calendar_detail(id: str, request: Request):
@@ -317,6 +340,17 @@ async def calendar_detail(id: str, request: Request):
             )
             events = events_res.json() if events_res.status_code == 200 else []
             
+            # Número de comentarios de todos los eventos con una sola petición
+            comment_counts = {}
+            if events:
+                counts_res = await client.post(
+                    f"{GATEWAY_URL}/comment/comments/counts",
+                    json={"idsEvento": list(dict.fromkeys(e["_id"] for e in events))},
+                    headers=get_frontend_headers()
+                )
+                if counts_res.status_code == 200:
+                    comment_counts = counts_res.json()["eventos"]
+            
             sub_res = await client.get(
                 f"{GATEWAY_URL}/calendar/calendars/{id}/subcalendars",
                 headers=get_frontend_headers()
@@ -339,6 +373,7 @@ async def calendar_detail(id: str, request: Request):
                 "request": request,
                 "calendar": calendar,
                 "events": events,
+                "comment_counts": comment_counts,
                 "subcalendars": subcalendars,
                 "messages": get_messages(request),
                 "user": user,
@@ -414,50 +449,126 @@ async def create_event(
     latitud: Optional[float] = Form(None),
     longitud: Optional[float] = Form(None)
 ):
-    if not get_current_user(request):
+    user = get_current_user(request)
+    if not user:
         return RedirectResponse("/login", status_code=303)
 
-    # Preparar los datos del formulario
+    # El servicio de eventos recibe JSON; los adjuntos se suben después a /events/{id}/attachments
     data = {
         'idCalendario': calendar_id,
         'titulo': titulo,
         'horaComienzo': horaComienzo,
-        'duracionMinutos': str(duracionMinutos),
+        'duracionMinutos': duracionMinutos,
         'lugar': lugar,
         'organizador': organizador,
+        'emailOrganizador': user.get("email"),
     }
     
-    if latitud is not None:
-        data['latitud'] = str(latitud)
-    if longitud is not None:
-        data['longitud'] = str(longitud)
+    if latitud is not None and longitud is not None:
+        data['contenidoAdjunto'] = {'mapa': {'latitud': latitud, 'longitud': longitud}}
     
-    # Preparar archivos de imagen
-    files = []
-    if imagenes:
-        for imagen in imagenes[:3]:
-            content = await imagen.read()
-            if content:  # Solo si hay contenido
-                files.append(('imagenes', (imagen.filename, content, imagen.content_type)))
+    # Los ficheros se reenvían como objetos de fichero: httpx los envía por trozos sin leerlos enteros
+    files = [
+        ('imagenes', (imagen.filename, imagen.file, imagen.content_type))
+        for imagen in imagenes[:3] if imagen.filename
+    ]
     
     async with httpx.AsyncClient(timeout=30.0) as client:
         try:
             response = await client.post(
                 f"{GATEWAY_URL}/event/events/",
-                data=data,
-                files=files if files else None,
+                json=data,
                 headers=get_frontend_headers()
             )
             
-            if response.status_code == 201:
-                return RedirectResponse(url=f"/calendar/{calendar_id}?msg=Evento creado&cat=success", status_code=303)
-            else:
+            if response.status_code != 201:
                 return RedirectResponse(url=f"/event/new/{calendar_id}?msg=Error: {response.text}&cat=danger", status_code=303)
+            
+            if files:
+                event_id = response.json()["_id"]
+                upload = await client.post(
+                    f"{GATEWAY_URL}/event/events/{event_id}/attachments",
+                    files=files,
+                    headers=get_frontend_headers()
+                )
+                if upload.status_code != 200:
+                    return RedirectResponse(url=f"/event/{event_id}?msg=Evento creado, pero no se pudieron subir las imágenes: {upload.text}&cat=warning", status_code=303)
+            
+            return RedirectResponse(url=f"/calendar/{calendar_id}?msg=Evento creado&cat=success", status_code=303)
         except httpx.RequestError as e:
             return RedirectResponse(url=f"/event/new/{calendar_id}?msg=Error de conexión: {str(e)}&cat=danger", status_code=303)
 
+
+@app.get("/event/events/attachments/{path:path}")
+async def event_attachment(path: str, request: Request):
+    """
+    Sirve los adjuntos de los eventos a través del gateway (las URLs guardadas en
+    contenidoAdjunto apuntan a esta ruta). Se reenvían Range e If-None-Match y la
+    respuesta se transmite en streaming.
+    """
+    headers = get_frontend_headers()
+    for cabecera in ("range", "if-range", "if-none-match"):
+        if cabecera in request.headers:
+            headers[cabecera] = request.headers[cabecera]
+    
+    client = httpx.AsyncClient(timeout=30.0)
+    try:
+        upstream = await client.send(
+            client.build_request("GET", f"{GATEWAY_URL}/event/events/attachments/{path}", headers=headers),
+            stream=True
+        )
+    except httpx.RequestError:
+        await client.aclose()
+        return Response(status_code=502)
+    
+    async def cerrar():
+        await upstream.aclose()
+        await client.aclose()
+    
+    reenviar = {"content-type", "content-length", "content-range", "accept-ranges", "etag", "cache-control", "last-modified", "content-disposition"}
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers={k: v for k, v in upstream.headers.items() if k.lower() in reenviar},
+        background=BackgroundTask(cerrar)
+    )
+
+async def _proxy_sse(request: Request, url: str, params: dict):
+    """
+    Reenvía una conexión SSE del gateway al navegador (EventSource no puede mandar
+    las cabeceras del frontend). Se transmite trozo a trozo y se pasa Last-Event-ID
+    para que la reconexión continúe donde se quedó.
+    """
+    headers = {**get_frontend_headers(), "accept": "text/event-stream"}
+    if "last-event-id" in request.headers:
+        headers["last-event-id"] = request.headers["last-event-id"]
+
+    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+    try:
+        upstream = await client.send(client.build_request("GET", url, params=params, headers=headers), stream=True)
+    except httpx.RequestError:
+        await client.aclose()
+        return Response(status_code=502)
+
+    async def cerrar():
+        await upstream.aclose()
+        await client.aclose()
+
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(cerrar)
+    )
+
+@app.get("/event/{id}/comments/stream")
+async def event_comments_stream(id: str, request: Request):
+    """Comentarios nuevos del evento en vivo para la página de detalle."""
+    return await _proxy_sse(request, f"{GATEWAY_URL}/comment/comments/stream", {"idEvento": id})
+
 @app.get("/event/{id}", response_class=HTMLResponse)
-async def event_detail(id: str, request: Request):
+async def event_detail(id: str, request: Request, cursor: Optional[str] = None):
     user = get_current_user(request)
     
     async with httpx.AsyncClient() as client:
@@ -470,12 +581,18 @@ async def event_detail(id: str, request: Request):
                 return RedirectResponse(url="/?msg=Evento no encontrado&cat=danger", status_code=303)
             event = event_res.json()
             
+            # Página de comentarios (los más recientes primero)
+            params = {"idEvento": id}
+            if cursor:
+                params["cursor"] = cursor
             comments_res = await client.get(
                 f"{GATEWAY_URL}/comment/comments/",
-                params={"idEvento": id},
+                params=params,
                 headers=get_frontend_headers()
             )
-            comments = comments_res.json() if comments_res.status_code == 200 else []
+            pagina = comments_res.json() if comments_res.status_code == 200 else {}
+            comments = pagina.get("comentarios", [])
+            siguiente = pagina.get("siguiente")
             
             # Determinar si puede editar (es el organizador O es admin)
             can_edit = False
@@ -487,6 +604,7 @@ async def event_detail(id: str, request: Request):
                 "request": request,
                 "event": event,
                 "comments": comments,
+                "siguiente": siguiente,
                 "messages": get_messages(request),
                 "user": user,
                 "is_admin": is_admin(request),
@@ -674,7 +792,10 @@ async def settings_page(request: Request):
             # Si en gateway es /comment -> servicio /comments, entonces la url es correcta.
             
             if res.status_code == 200:
-                current_pref = res.json().get("preference", "email")
+                prefs = res.json()
+                current_pref = prefs.get("preference", "email")
+                if current_pref == "email" and prefs.get("digest_minutes", 0) > 0:
+                    current_pref = "digest"
         except httpx.RequestError:
             print("⚠️ Backend no disponible para preferencias")
 
@@ -693,7 +814,12 @@ async def update_settings(request: Request, notif_option: str = Form(...)):
 
     async with httpx.AsyncClient() as client:
         try:
-            payload = {"email": user["email"], "preference": notif_option}
+            # "digest" es el modo email con una ventana de resumen (0 = un correo por comentario)
+            payload = {
+                "email": user["email"],
+                "preference": "email" if notif_option == "digest" else notif_option,
+                "digest_minutes": DIGEST_MINUTES if notif_option == "digest" else 0,
+            }
             
             # Enviamos la nueva preferencia al backend
             await client.post(
@@ -709,24 +835,30 @@ async def update_settings(request: Request, notif_option: str = Form(...)):
 
 
 @app.get("/notifications", response_class=HTMLResponse)
-async def notifications_page(request: Request):
+async def notifications_page(request: Request, cursor: Optional[str] = None):
     user = get_current_user(request)
     if not user:
         return RedirectResponse("/login", status_code=303)
 
     notificaciones = []
+    siguiente = None
     
-    # Llamamos al Backend para pedir la lista real de Mongo
+    # Llamamos al Backend para pedir la página pedida de la bandeja
     async with httpx.AsyncClient() as client:
         try:
             # Petición al Gateway -> Servicio Comentarios -> Mis Notificaciones
+            params = {"email": user["email"]}
+            if cursor:
+                params["cursor"] = cursor
             response = await client.get(
                 f"{GATEWAY_URL}/comment/comments/notifications",
-                params={"email": user["email"]},
+                params=params,
                 headers=get_frontend_headers()
             )
             if response.status_code == 200:
-                notificaciones = response.json()
+                pagina = response.json()
+                notificaciones = pagina["notificaciones"]
+                siguiente = pagina["siguiente"]
         except httpx.RequestError:
             print("⚠️ Error conectando con el servicio de notificaciones")
 
@@ -735,8 +867,55 @@ async def notifications_page(request: Request):
         "request": request,
         "user": user,
         "notificaciones": notificaciones, 
+        "siguiente": siguiente,
         "is_admin": is_admin(request)
     })
+
+@app.post("/notifications/read")
+async def mark_notifications_read(request: Request):
+    user = get_current_user(request)
+    if not user:
+        return RedirectResponse("/login", status_code=303)
+
+    async with httpx.AsyncClient() as client:
+        try:
+            await client.post(
+                f"{GATEWAY_URL}/comment/comments/notifications/read",
+                json={"email": user["email"]},
+                headers=get_frontend_headers()
+            )
+        except httpx.RequestError:
+            return RedirectResponse("/notifications?msg=Error de conexión&cat=danger", status_code=303)
+    return RedirectResponse("/notifications", status_code=303)
+
+@app.get("/notifications/stream")
+async def notifications_stream(request: Request):
+    """Notificaciones y contador de no leídas en vivo (campana y página de notificaciones)."""
+    user = get_current_user(request)
+    if not user:
+        return Response(status_code=204)  # 204: el navegador no vuelve a intentarlo
+    return await _proxy_sse(request, f"{GATEWAY_URL}/comment/comments/notifications/stream", {"email": user["email"]})
+
+@app.get("/notifications/unread-count")
+async def unread_count(request: Request):
+    """Contador de la campana (lo pide base.html): una sola lectura en el servicio de comentarios."""
+    user = get_current_user(request)
+    if not user:
+        return JSONResponse({"no_leidas": 0})
+
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.get(
+                f"{GATEWAY_URL}/comment/comments/notifications/unread-count",
+                params={"email": user["email"]},
+                headers=get_frontend_headers()
+            )
+            if response.status_code == 200:
+                return JSONResponse(response.json())
+        except httpx.RequestError:
+            pass
+    return JSONResponse({"no_leidas": 0})
+
 @app.get("/token", tags=["Auth"])
 async def get_token(request: Request):
     """
@@ -1,4 +1,6 @@
 from fastapi import FastAPI, Request, HTTPException, Response, Depends
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 import os
@@ -32,6 +34,10 @@ SERVICES = {
     "external": os.getenv("EXTERNAL_SERVICE_URL", "http://external_service:8000"),
 }
 
+# Tiempo máximo de espera de la respuesta a una subida de importación (CSV/NDJSON), que
+# no contesta hasta haber insertado todas las filas
+IMPORT_UPLOAD_TIMEOUT = float(os.getenv("IMPORT_UPLOAD_TIMEOUT", "300"))
+
 # Log de configuración al iniciar
 logger.info(f"🚀 Gateway iniciado con servicios: {SERVICES}")
 
@@ -108,8 +114,6 @@ async def _proxy_request(service: str, path: str, request: Request):
 
     service_base_url = SERVICES[service]
     
-    body = await request.body()
-    
     # Construir la URL completa, preservando la barra final si existe
     # Usar request.url.path para obtener la ruta original completa
     original_path = str(request.url.path)
@@ -121,6 +125,10 @@ async def _proxy_request(service: str, path: str, request: Request):
         remaining_path = path
     
     target_url = f"{service_base_url}/{remaining_path}"
+
+    # Las subidas de importación tabular se reenvían según llegan, sin cargarlas en memoria
+    es_subida = service == "external" and remaining_path.startswith("import/tabular")
+    body = request.stream() if es_subida else await request.body()
     
     logger.info(f"🔄 Proxy request: {request.method} {target_url}")
     
@@ -131,24 +139,60 @@ async def _proxy_request(service: str, path: str, request: Request):
         if key.lower() not in headers_to_exclude
     }
     
+    # Las conexiones SSE (Accept: text/event-stream) pueden pasar mucho tiempo sin datos
+    # entre latidos: sin límite de lectura
+    es_stream = "text/event-stream" in request.headers.get("accept", "")
+    if es_stream:
+        timeout = httpx.Timeout(30.0, read=None)
+    elif es_subida:
+        timeout = httpx.Timeout(30.0, read=IMPORT_UPLOAD_TIMEOUT)
+    else:
+        timeout = httpx.Timeout(30.0)
+
     # Cliente sin base_url, usar URLs completas
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            response = await client.request(
+    client = httpx.AsyncClient(timeout=timeout)
+    try:
+        response = await client.send(
+            client.build_request(
                 method=request.method,
                 url=target_url,
                 headers=filtered_headers,
                 params=request.query_params,
                 content=body,
-                follow_redirects=True,
-            )
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-            )
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=500, detail=f"Error al conectar con {service}: {str(e)}")
+            ),
+            stream=True,
+            follow_redirects=True,
+        )
+    except httpx.RequestError as e:
+        await client.aclose()
+        raise HTTPException(status_code=500, detail=f"Error al conectar con {service}: {str(e)}")
+
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        # Se reenvía cada trozo según llega (sin acumular la respuesta en memoria)
+        async def cerrar():
+            await response.aclose()
+            await client.aclose()
+
+        headers_to_drop = {"content-length", "transfer-encoding", "connection"}
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in headers_to_drop},
+            background=BackgroundTask(cerrar),
+        )
+
+    try:
+        await response.aread()
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f"Error al conectar con {service}: {str(e)}")
+    finally:
+        await response.aclose()
+        await client.aclose()
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        headers=dict(response.headers),
+    )
 
 # --- Rutas Explícitas para cada Microservicio ---
 
@@ -223,7 +267,9 @@ async def comment_proxy(
     
     return await _proxy_request("comment", path, request)
 
+@app.get("/external/{path:path}", tags=["External Import"])
 @app.post("/external/{path:path}", tags=["External Import"])
+@app.delete("/external/{path:path}", tags=["External Import"])
 async def external_proxy(
     path: str,
     request: Request,
@@ -0,0 +1,60 @@
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+import os
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+uri = os.getenv('MONGODB_URI')
+
+# --- Conexión a MongoDB ---
+client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
+db = client['KalendasDB']
+
+try:
+    calendarios_collection = db['calendarios']
+    eventos_collection = db['eventos']
+
+    # 1. Ascendencia de cada calendario (del padre a la raíz) a partir de idCalendarioPadre
+    padres = {
+        cal["_id"]: cal.get("idCalendarioPadre")
+        for cal in calendarios_collection.find({}, {"idCalendarioPadre": 1})
+    }
+
+    def ancestros_de(calendar_id):
+        ancestros = []
+        padre = padres.get(calendar_id)
+        while padre is not None and padre not in ancestros and padre != calendar_id:
+            ancestros.append(padre)
+            padre = padres.get(padre)
+        return ancestros
+
+    ancestros = {calendar_id: ancestros_de(calendar_id) for calendar_id in padres}
+
+    print("\nRecalculando 'ancestros' de los calendarios...")
+    if ancestros:
+        result = calendarios_collection.bulk_write(
+            [UpdateOne({"_id": cid}, {"$set": {"ancestros": anc}}) for cid, anc in ancestros.items()],
+            ordered=False
+        )
+        print(f"✅ {result.modified_count} calendarios actualizados.")
+
+    # 2. Ascendencia de los eventos: una actualización por calendario
+    print("\nRecalculando 'ancestrosCalendario' de los eventos...")
+    total = 0
+    for calendar_id in eventos_collection.distinct("idCalendario"):
+        result = eventos_collection.update_many(
+            {"idCalendario": calendar_id},
+            {"$set": {"ancestrosCalendario": [calendar_id] + ancestros.get(calendar_id, [])}}
+        )
+        total += result.modified_count
+    print(f"✅ {total} eventos actualizados.")
+
+except Exception as e:
+    print(f"❌ Error durante la migración: {e}")
+
+finally:
+    client.close()
+    print("\nConexión a MongoDB cerrada.")
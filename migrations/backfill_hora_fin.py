@@ -0,0 +1,32 @@
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+import os
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+uri = os.getenv('MONGODB_URI')
+
+# --- Conexión a MongoDB ---
+client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
+db = client['KalendasDB']
+
+try:
+    eventos_collection = db['eventos']
+
+    # Calculamos horaFin = horaComienzo + duracionMinutos en el propio servidor
+    # (pipeline de actualización), sin traer los documentos a Python.
+    print("\nRellenando 'horaFin' en los eventos que no lo tienen...")
+    result = eventos_collection.update_many(
+        {"horaFin": {"$exists": False}},
+        [{"$set": {"horaFin": {"$add": ["$horaComienzo", {"$multiply": ["$duracionMinutos", 60 * 1000]}]}}}]
+    )
+    print(f"✅ {result.modified_count} eventos actualizados.")
+
+except Exception as e:
+    print(f"❌ Error durante la migración: {e}")
+
+finally:
+    client.close()
+    print("\nConexión a MongoDB cerrada.")
@@ -0,0 +1,34 @@
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+import os
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+uri = os.getenv('MONGODB_URI')
+
+# --- Conexión a MongoDB ---
+client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
+db = client['KalendasDB']
+
+try:
+    # El contador 'no_leidas' de cada usuario se mantiene al guardar y al marcar
+    # notificaciones; para los datos anteriores se recalcula a partir de la bandeja.
+    print("\nRecalculando 'no_leidas' a partir de las notificaciones sin leer...")
+    db['users'].update_many({}, {"$set": {"no_leidas": 0}})
+    pendientes = db['notificaciones'].aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_email", "no_leidas": {"$sum": 1}}},
+    ])
+    for grupo in pendientes:
+        db['users'].update_one({"email": grupo["_id"]}, {"$set": {"no_leidas": grupo["no_leidas"]}}, upsert=True)
+    total = db['users'].count_documents({"no_leidas": {"$gt": 0}})
+    print(f"✅ {total} usuarios con notificaciones pendientes de leer.")
+
+except Exception as e:
+    print(f"❌ Error durante la migración: {e}")
+
+finally:
+    client.close()
+    print("\nConexión a MongoDB cerrada.")
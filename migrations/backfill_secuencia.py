@@ -0,0 +1,37 @@
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+import os
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+uri = os.getenv('MONGODB_URI')
+
+# --- Conexión a MongoDB ---
+client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
+db = client['KalendasDB']
+
+try:
+    secuencias_collection = db['secuencias']
+
+    # Los documentos sin 'secuencia' no aparecerían nunca en /changes. Se les asigna
+    # un mismo número nuevo a todos (el orden entre ellos lo decide el _id del token).
+    for coleccion, contador in [("eventos", "eventos"), ("calendarios", "calendarios")]:
+        print(f"\nAsignando 'secuencia' a los documentos de '{coleccion}'...")
+        secuencia = secuencias_collection.find_one_and_update(
+            {"_id": contador},
+            {"$inc": {"valor": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )["valor"]
+        result = db[coleccion].update_many({"secuencia": {"$exists": False}}, {"$set": {"secuencia": secuencia}})
+        print(f"✅ {result.modified_count} documentos de '{coleccion}' con secuencia {secuencia}.")
+
+except Exception as e:
+    print(f"❌ Error durante la migración: {e}")
+
+finally:
+    client.close()
+    print("\nConexión a MongoDB cerrada.")
@@ -0,0 +1,35 @@
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+import os
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+uri = os.getenv('MONGODB_URI')
+
+# --- Conexión a MongoDB ---
+client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
+db = client['KalendasDB']
+
+try:
+    eventos_collection = db['eventos']
+
+    # Punto GeoJSON [longitud, latitud] a partir de contenidoAdjunto.mapa,
+    # calculado en el servidor con un pipeline de actualización.
+    print("\nRellenando 'ubicacion' a partir de contenidoAdjunto.mapa...")
+    result = eventos_collection.update_many(
+        {"contenidoAdjunto.mapa.latitud": {"$type": "number"}, "ubicacion": {"$exists": False}},
+        [{"$set": {"ubicacion": {
+            "type": "Point",
+            "coordinates": ["$contenidoAdjunto.mapa.longitud", "$contenidoAdjunto.mapa.latitud"],
+        }}}]
+    )
+    print(f"✅ {result.modified_count} eventos con ubicación.")
+
+except Exception as e:
+    print(f"❌ Error durante la migración: {e}")
+
+finally:
+    client.close()
+    print("\nConexión a MongoDB cerrada.")
@@ -22,6 +22,9 @@ try:
     db.drop_collection('eventos')
     db.drop_collection('comentarios')
     db.drop_collection('notificaciones')
+    db.drop_collection('secuencias')
+    db.drop_collection('calendarios_eliminados')
+    db.drop_collection('eventos_eliminados')
     print("🧹 Colecciones 'calendarios', 'eventos' y 'comentarios' eliminadas.")
 
     # Obtenemos las colecciones (se crearán automáticamente al insertar datos)
@@ -45,7 +48,9 @@ try:
             "organizador": "Ayuntamiento Central",
             "palabras_clave": ["ciudad", "eventos", "público"],
             "es_publico": True,
-            "idCalendarioPadre": None
+            "idCalendarioPadre": None,
+            "ancestros": [],
+            "secuencia": 1
         },
         {
             "_id": sub_calendario_id,
@@ -53,7 +58,9 @@ try:
             "organizador": "Concejalía de Deportes",
             "palabras_clave": ["deporte", "competición"],
             "es_publico": True,
-            "idCalendarioPadre": calendario_principal_id
+            "idCalendarioPadre": calendario_principal_id,
+            "ancestros": [calendario_principal_id],
+            "secuencia": 2
         },
         {
             "_id": otro_calendario_id,
@@ -61,7 +68,9 @@ try:
             "organizador": "Centro Cultural Independiente",
             "palabras_clave": ["cultura", "exposición", "música"],
             "es_publico": False,
-            "idCalendarioPadre": None
+            "idCalendarioPadre": None,
+            "ancestros": [],
+            "secuencia": 3
         }
     ])
     print("✅ 3 calendarios de ejemplo insertados.")
@@ -74,30 +83,40 @@ try:
         {
             "_id": evento_maraton_id,
             "idCalendario": sub_calendario_id,
+            "ancestrosCalendario": [sub_calendario_id, calendario_principal_id],
             "titulo": "Maratón de la Ciudad",
             "horaComienzo": datetime(2025, 11, 15, 9, 0, 0),
             "duracionMinutos": 240,
+            "horaFin": datetime(2025, 11, 15, 13, 0, 0),
             "lugar": "Salida desde el Estadio Municipal",
             "organizador": "Concejalía de Deportes",
             "emailOrganizador": "gbcarlos1863@gmail.com",
             "contenidoAdjunto": {
                 "imagenes": [], "archivos": [], "mapa": {"latitud": 36.7213, "longitud": -4.4214}
-            }
+            },
+            "ubicacion": {"type": "Point", "coordinates": [-4.4214, 36.7213]},
+            "secuencia": 1
         },
         {
             "_id": evento_noche_blanco_id,
             "idCalendario": calendario_principal_id,
+            "ancestrosCalendario": [calendario_principal_id],
             "titulo": "Noche en Blanco",
             "horaComienzo": datetime(2025, 10, 26, 20, 0, 0),
             "duracionMinutos": 360,
+            "horaFin": datetime(2025, 10, 27, 2, 0, 0),
             "lugar": "Varios lugares en el centro",
             "organizador": "Ayuntamiento Central",
             "emailOrganizador": "gbcarlos1863@gmail.com",
-            "contenidoAdjunto": {"imagenes": ["https://ejemplo.com/noche_en_blanco.jpg"], "archivos": [], "mapa": None}
+            "contenidoAdjunto": {"imagenes": ["https://ejemplo.com/noche_en_blanco.jpg"], "archivos": [], "mapa": None},
+            "secuencia": 2
         }
     ])
     print("✅ 2 eventos de ejemplo insertados.")
 
+    # Contadores de la sincronización incremental (último número de secuencia usado)
+    db['secuencias'].insert_many([{"_id": "calendarios", "valor": 3}, {"_id": "eventos", "valor": 2}])
+
     # 3. Insertar Comentarios
     comentarios_collection.insert_many([
         {
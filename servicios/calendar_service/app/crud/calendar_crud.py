@@ -1,13 +1,18 @@
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
 from uuid import UUID
-from pymongo import ReturnDocument
+from datetime import datetime
+from pymongo import ReturnDocument, ASCENDING
 
 # Importaciones de tu proyecto
 from .. import database
 from ..model.calendar_models import CalendarCreate, CalendarInDB 
+from ..sync_utils import secuencias_reservadas, tope_visible
 
 # Alias para la colección de MongoDB (simplifica el código)
 CalendarCollection = database.calendarios_collection 
+SequenceCollection = database.secuencias_collection
+TombstoneCollection = database.calendarios_eliminados_collection
 
 class CalendarCRUD:
     """
@@ -63,3 +68,72 @@ class CalendarCRUD:
         return [CalendarInDB.model_validate(calendar) for calendar in calendar_list]
 
 
+    @asynccontextmanager
+    async def reserve_sequence(self) -> AsyncIterator[int]:
+        """
+        Reserva el siguiente número de secuencia (solo crece; base de la sincronización
+        incremental). La escritura que lo usa se hace dentro del bloque: hasta salir de él,
+        /calendars/changes no entrega nada a partir de ese número.
+        """
+        with secuencias_reservadas(SequenceCollection, "calendarios") as secuencia:
+            yield secuencia
+
+
+    async def sequence_limit(self) -> Optional[int]:
+        """Primera secuencia que /calendars/changes aún no puede entregar (ver sync_utils.tope_visible)."""
+        return tope_visible(SequenceCollection, "calendarios")
+
+
+    async def add_tombstone(self, calendar_id: UUID, secuencia: int):
+        """Deja una marca de borrado (caduca sola por el índice TTL)."""
+        TombstoneCollection.replace_one(
+            {"_id": calendar_id},
+            {"_id": calendar_id, "secuencia": secuencia, "eliminadoEn": datetime.utcnow()},
+            upsert=True
+        )
+
+
+    async def list_changes(self, filters: dict, limit: int) -> List[dict]:
+        """Calendarios modificados que cumplen el filtro, en orden (secuencia, _id)."""
+        cursor = CalendarCollection.find(filters).sort([("secuencia", ASCENDING), ("_id", ASCENDING)]).limit(limit)
+        return list(cursor)
+
+
+    async def list_tombstones(self, filters: dict, limit: int) -> List[dict]:
+        """Marcas de borrado que cumplen el filtro, en orden (secuencia, _id)."""
+        cursor = TombstoneCollection.find(filters).sort([("secuencia", ASCENDING), ("_id", ASCENDING)]).limit(limit)
+        return list(cursor)
+
+
+    async def replace_ancestry(self, calendar_id: UUID, new_ancestors: List[UUID], secuencia: int) -> int:
+        """
+        Sustituye, en todos los descendientes del calendario, la parte de 'ancestros'
+        que queda por encima de él por la nueva lista (se usa al cambiar de padre).
+        """
+        posicion = {"$indexOfArray": ["$ancestros", calendar_id]}
+        result = CalendarCollection.update_many(
+            {"ancestros": calendar_id},
+            [{"$set": {
+                "ancestros": {"$concatArrays": [
+                    {"$slice": ["$ancestros", {"$add": [posicion, 1]}]},
+                    new_ancestors,
+                ]},
+                "secuencia": secuencia,
+            }}]
+        )
+        return result.modified_count
+
+
+    async def detach_descendants(self, calendar_id: UUID, secuencia: int) -> int:
+        """Quita el calendario (y lo que hay por encima) de los 'ancestros' de sus descendientes."""
+        posicion = {"$indexOfArray": ["$ancestros", calendar_id]}
+        result = CalendarCollection.update_many(
+            {"ancestros": calendar_id},
+            [{"$set": {
+                "ancestros": {"$cond": [
+                    {"$eq": [posicion, 0]}, [], {"$slice": ["$ancestros", posicion]}
+                ]},
+                "secuencia": secuencia,
+            }}]
+        )
+        return result.modified_count
@@ -1,13 +1,31 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo import ASCENDING
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 
+from .sync_utils import TOMBSTONE_TTL_SECONDS
 
 load_dotenv()
 
 uri = os.getenv('MONGODB_URI')
 client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
 db = client['KalendasDB']
-calendarios_collection = db['calendarios']
\ No newline at end of file
+calendarios_collection = db['calendarios']
+# Sincronización incremental: contador de secuencia y marcas de borrado con caducidad
+secuencias_collection = db['secuencias']
+calendarios_eliminados_collection = db['calendarios_eliminados']
+
+
+def ensure_indexes():
+    """Crea (si no existen) los índices que usan las consultas del servicio."""
+    calendarios_collection.create_index([("idCalendarioPadre", ASCENDING)], name="calendario_padre")
+    # Multikey: todos los descendientes de un calendario con una sola consulta
+    calendarios_collection.create_index([("ancestros", ASCENDING)], name="ancestros")
+    # Sincronización incremental: cambios y borrados en orden (secuencia, _id)
+    calendarios_collection.create_index([("secuencia", ASCENDING), ("_id", ASCENDING)], name="secuencia_id")
+    calendarios_eliminados_collection.create_index([("secuencia", ASCENDING), ("_id", ASCENDING)], name="secuencia_id")
+    calendarios_eliminados_collection.create_index(
+        [("eliminadoEn", ASCENDING)], name="caducidad", expireAfterSeconds=TOMBSTONE_TTL_SECONDS
+    )
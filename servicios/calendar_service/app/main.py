@@ -1,11 +1,21 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .router import calendars
+from . import database
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Aseguramos los índices de MongoDB al arrancar el servicio.
+    database.ensure_indexes()
+    yield
 
 
 app = FastAPI(
     title="API de Kalendas",
     description="API para la gestión de calendarios y eventos.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.include_router(calendars.router)
@@ -17,6 +17,10 @@ class CalendarCreate(CalendarBase):
 # Modelo para RESPUESTA (lo que devolvemos desde la API)
 class CalendarInDB(CalendarBase):
     id: UUID = Field(..., alias="_id")
+    # IDs de los calendarios antecesores, del padre a la raíz (lo mantiene el servicio)
+    ancestros: List[UUID] = []
+    # Número de secuencia de la última modificación (sincronización incremental)
+    secuencia: Optional[int] = None
 
     # Configuración para Pydantic v2
     model_config = ConfigDict(
@@ -28,7 +32,18 @@ class CalendarInDB(CalendarBase):
                 "organizador": "Ayuntamiento Central",
                 "palabras_clave": ["cultura", "ciudad"],
                 "es_publico": True,
-                "id_calendario_padre": None
+                "id_calendario_padre": None,
+                "ancestros": []
             }
         }
-    )
\ No newline at end of file
+    )
+
+
+# Modelo para la sincronización incremental (GET /calendars/changes)
+class CalendarChanges(BaseModel):
+    cambios: List[CalendarInDB]
+    eliminados: List[UUID]
+    token: str
+    hay_mas: bool = Field(..., alias="hayMas")
+
+    model_config = ConfigDict(populate_by_name=True)
@@ -4,7 +4,8 @@ from uuid import UUID
 
 from ..service.calendarService import CalendarService 
 from ..dependencies import get_calendar_service 
-from ..model.calendar_models import CalendarCreate, CalendarInDB
+from ..model.calendar_models import CalendarCreate, CalendarInDB, CalendarChanges
+from ..sync_utils import TokenCaducado
 
 router = APIRouter(
     prefix="/calendars",
@@ -67,6 +68,30 @@ async def list_calendars(
     )
 
 
+# 2.1 GET /calendars/changes : Sincronización incremental
+@router.get(
+    "/changes",
+    response_model=CalendarChanges,
+    response_description="Calendarios modificados y eliminados desde el token indicado",
+)
+async def get_calendar_changes(
+    calendar_service: CalendarServiceDep,
+    since: Optional[str] = Query(None, description="Token devuelto por la llamada anterior (vacío = sincronización completa)"),
+    limit: int = Query(500, ge=1, le=5000, description="Número máximo de cambios por página"),
+):
+    """
+    Devuelve solo lo que ha cambiado desde el token: calendarios creados o modificados y los IDs
+    de los eliminados. Si hayMas es true, hay que volver a llamar con el nuevo token.
+    Responde 410 si el token es más antiguo que la retención de borrados.
+    """
+    try:
+        return await calendar_service.get_changes(since, limit)
+    except TokenCaducado:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Token caducado: es necesaria una sincronización completa")
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Token de sincronización no válido")
+
+
 # 3. GET /calendars/{id} : Obtener un calendario específico por su ID
 @router.get(
     "/{id}",
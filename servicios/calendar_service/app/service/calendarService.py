@@ -1,10 +1,17 @@
 from typing import List, Optional
 from uuid import UUID, uuid4
 from datetime import datetime
+import os
+import httpx
+from fastapi import HTTPException, status
 
 # Importaciones de tu proyecto
-from ..model.calendar_models import CalendarCreate, CalendarInDB
+from ..model.calendar_models import CalendarCreate, CalendarInDB, CalendarChanges
 from ..crud.calendar_crud import CalendarCRUD  # Usamos el CRUD inyectado
+from ..sync_utils import encode_token, decode_token, hasta_tope, posterior_a, orden
+
+# URL del servicio de eventos (los eventos guardan la ascendencia de su calendario)
+EVENT_SERVICE_URL = os.getenv("EVENT_SERVICE_URL", "http://event_service:8000")
 
 class CalendarService:
     """
@@ -21,10 +28,13 @@ class CalendarService:
         """
         calendar_dict = calendar.model_dump(by_alias=True)
         calendar_dict["_id"] = uuid4() 
+        calendar_dict["ancestros"] = await self._compute_ancestors(calendar.id_calendario_padre)
         
         # Aquí se podría poner lógica de negocio avanzada (ej. validaciones, notificaciones)
         
-        return await self.crud.create(calendar_dict)
+        async with self.crud.reserve_sequence() as secuencia:
+            calendar_dict["secuencia"] = secuencia
+            return await self.crud.create(calendar_dict)
 
 
     async def get_calendar_by_id(self, calendar_id: UUID) -> Optional[CalendarInDB]:
@@ -57,17 +67,105 @@ class CalendarService:
 
 
     async def update_calendar(self, calendar_id: UUID, calendar_update: CalendarCreate) -> Optional[CalendarInDB]:
-        """Actualiza un calendario."""
+        """
+        Actualiza un calendario. Si cambia de padre, recalcula su ascendencia, la de
+        sus descendientes y la propaga a los eventos del subárbol.
+        """
+        current = await self.crud.get_by_id(calendar_id)
+        if not current:
+            return None
+
         update_data = calendar_update.model_dump(by_alias=True, exclude_unset=True)
-        return await self.crud.update(calendar_id, update_data)
+        new_parent = calendar_update.id_calendario_padre
+        reparented = "idCalendarioPadre" in update_data and new_parent != current.id_calendario_padre
+
+        if reparented:
+            new_ancestors = await self._compute_ancestors(new_parent)
+            if calendar_id == new_parent or calendar_id in new_ancestors:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Un calendario no puede colgar de sí mismo ni de uno de sus subcalendarios"
+                )
+            update_data["ancestros"] = new_ancestors
+
+        async with self.crud.reserve_sequence() as secuencia:
+            update_data["secuencia"] = secuencia
+            updated = await self.crud.update(calendar_id, update_data)
+
+        if reparented:
+            async with self.crud.reserve_sequence() as secuencia:
+                await self.crud.replace_ancestry(calendar_id, new_ancestors, secuencia)
+            await self._notify_event_service("PUT", calendar_id, {"ancestros": [str(a) for a in new_ancestors]})
+
+        return updated
 
 
     async def delete_calendar(self, calendar_id: UUID) -> bool:
-        """Elimina un calendario y devuelve si la operación fue exitosa."""
+        """
+        Elimina un calendario y devuelve si la operación fue exitosa. Sus descendientes
+        (y sus eventos) dejan de tenerlo, a él y a sus antecesores, como ancestros.
+        """
         deleted_count = await self.crud.delete(calendar_id)
+        if deleted_count > 0:
+            async with self.crud.reserve_sequence() as secuencia:
+                await self.crud.add_tombstone(calendar_id, secuencia)
+            async with self.crud.reserve_sequence() as secuencia:
+                await self.crud.detach_descendants(calendar_id, secuencia)
+            await self._notify_event_service("DELETE", calendar_id)
         return deleted_count > 0
     
 
+    async def get_changes(self, token: Optional[str], limit: int = 500) -> CalendarChanges:
+        """
+        Devuelve los calendarios modificados y borrados después de la posición del token,
+        en orden (secuencia, _id), y un token nuevo para la siguiente llamada.
+        Lanza ValueError si el token no es válido y TokenCaducado si ha caducado.
+        """
+        secuencia, ultimo_id = decode_token(token)
+        # Nada a partir de una escritura que aún no se ha guardado: el token la saltaría
+        filtro = hasta_tope(posterior_a(secuencia, ultimo_id), await self.crud.sequence_limit())
+
+        # Se pide uno de más a cada colección para saber si quedan cambios pendientes
+        cambios = [(doc, False) for doc in await self.crud.list_changes(filtro, limit + 1)]
+        borrados = [(doc, True) for doc in await self.crud.list_tombstones(filtro, limit + 1)]
+        fusion = sorted(cambios + borrados, key=lambda par: orden(par[0]))
+        pagina = fusion[:limit]
+
+        if pagina:
+            ultimo = pagina[-1][0]
+            secuencia, ultimo_id = ultimo["secuencia"], ultimo["_id"]
+
+        return CalendarChanges(
+            cambios=[CalendarInDB.model_validate(doc) for doc, borrado in pagina if not borrado],
+            eliminados=[doc["_id"] for doc, borrado in pagina if borrado],
+            token=encode_token(secuencia, ultimo_id),
+            hay_mas=len(fusion) > limit,
+        )
+
+
+    async def _compute_ancestors(self, parent_id: Optional[UUID]) -> List[UUID]:
+        """Devuelve la lista de antecesores (padre primero) de un calendario hijo de parent_id."""
+        if parent_id is None:
+            return []
+        parent = await self.crud.get_by_id(parent_id)
+        if not parent:
+            return [parent_id]
+        return [parent.id] + parent.ancestros
+
+
+    async def _notify_event_service(self, method: str, calendar_id: UUID, payload: Optional[dict] = None):
+        """Propaga un cambio de ascendencia al servicio de eventos (si falla, no aborta la operación)."""
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.request(
+                    method, f"{EVENT_SERVICE_URL}/events/calendar/{calendar_id}/ancestry", json=payload
+                )
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            # Se puede reparar después con migrations/backfill_ancestros.py
+            print(f"⚠️ No se pudo propagar la ascendencia del calendario {calendar_id} a los eventos: {e}")
+
+
     async def get_subcalendars(self, parent_id: UUID) -> List[CalendarInDB]:
         """Obtiene los subcalendarios de un calendario padre."""
         return await self.crud.get_subcalendars(parent_id)
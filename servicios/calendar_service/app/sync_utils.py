@@ -0,0 +1,120 @@
+import base64
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, Tuple
+from uuid import UUID
+
+from pymongo import ReturnDocument
+
+# Tiempo que se conservan las marcas de borrado (y por tanto la validez de un token)
+TOMBSTONE_TTL_SECONDS = int(os.getenv("TOMBSTONE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Tiempo máximo que una escritura tiene reservada su secuencia sin guardarla: pasado este
+# plazo (p. ej. el proceso murió) deja de frenar a los lectores de cambios
+SEQUENCE_LEASE_SECONDS = int(os.getenv("SEQUENCE_LEASE_SECONDS", "60"))
+
+
+class TokenCaducado(Exception):
+    """El token es anterior a la retención de borrados: el cliente debe resincronizar completo."""
+
+
+def encode_token(secuencia: int, ultimo_id: Optional[UUID]) -> str:
+    """Token opaco: última posición (secuencia, _id) entregada y momento de emisión."""
+    crudo = f"{secuencia}|{ultimo_id or ''}|{int(time.time())}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def decode_token(token: Optional[str]) -> Tuple[int, Optional[UUID]]:
+    """
+    Devuelve la posición (secuencia, _id) codificada en el token. Sin token se empieza
+    desde el principio. Lanza ValueError si el token no es válido y TokenCaducado si
+    es más antiguo que la retención de marcas de borrado.
+    """
+    if not token:
+        return 0, None
+    relleno = "=" * (-len(token) % 4)
+    secuencia, ultimo_id, emitido = base64.urlsafe_b64decode(token + relleno).decode().split("|")
+    if time.time() - int(emitido) > TOMBSTONE_TTL_SECONDS:
+        raise TokenCaducado()
+    return int(secuencia), UUID(ultimo_id) if ultimo_id else None
+
+
+def posterior_a(secuencia: int, ultimo_id: Optional[UUID]) -> dict:
+    """Filtro de MongoDB para los documentos posteriores a la posición (secuencia, _id)."""
+    if ultimo_id is None:
+        return {"secuencia": {"$gt": secuencia}}
+    return {"$or": [
+        {"secuencia": {"$gt": secuencia}},
+        {"secuencia": secuencia, "_id": {"$gt": ultimo_id}},
+    ]}
+
+
+def orden(doc: dict) -> Tuple[int, bytes]:
+    """Clave de orden en Python equivalente al índice (secuencia, _id) de MongoDB."""
+    return doc["secuencia"], doc["_id"].bytes
+
+
+def reservar_secuencias(coleccion, contador: str, cantidad: int = 1) -> int:
+    """
+    Reserva 'cantidad' números consecutivos del contador y devuelve el último. En la misma
+    operación atómica anota la reserva como en curso (enCurso) hasta liberar_secuencias:
+    los números se asignan antes de guardar la escritura, así que otra posterior puede
+    guardarse antes y un lector no debe pasar de la más antigua que sigue en curso.
+    """
+    ahora = datetime.utcnow()
+    contador_doc = coleccion.find_one_and_update(
+        {"_id": contador},
+        [
+            {"$set": {
+                "valor": {"$add": [{"$ifNull": ["$valor", 0]}, cantidad]},
+                # De paso se descartan las reservas caducadas
+                "enCurso": {"$filter": {
+                    "input": {"$ifNull": ["$enCurso", []]}, "cond": {"$gt": ["$$this.caducaEn", ahora]},
+                }},
+            }},
+            {"$set": {"enCurso": {"$concatArrays": ["$enCurso", [{
+                "desde": {"$subtract": ["$valor", cantidad - 1]},
+                "hasta": "$valor",
+                "caducaEn": ahora + timedelta(seconds=SEQUENCE_LEASE_SECONDS),
+            }]]}}},
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return contador_doc["valor"]
+
+
+def liberar_secuencias(coleccion, contador: str, ultima: int):
+    """Da por guardada (o abandonada) la reserva que terminaba en 'ultima'."""
+    coleccion.update_one({"_id": contador}, {"$pull": {"enCurso": {"hasta": ultima}}})
+
+
+@contextmanager
+def secuencias_reservadas(coleccion, contador: str, cantidad: int = 1) -> Iterator[int]:
+    """Reserva secuencias para una escritura y las libera al terminar (también si falla)."""
+    ultima = reservar_secuencias(coleccion, contador, cantidad)
+    try:
+        yield ultima
+    finally:
+        liberar_secuencias(coleccion, contador, ultima)
+
+
+def tope_visible(coleccion, contador: str) -> Optional[int]:
+    """
+    Primera secuencia que un lector de cambios todavía no puede entregar: la más antigua
+    de las reservas en curso, o la siguiente a la última asignada. None si no hay contador.
+    """
+    contador_doc = coleccion.find_one({"_id": contador})
+    if contador_doc is None:
+        return None
+    ahora = datetime.utcnow()
+    en_curso = [r["desde"] for r in contador_doc.get("enCurso", []) if r["caducaEn"] > ahora]
+    return min(en_curso + [contador_doc["valor"] + 1])
+
+
+def hasta_tope(filtro: dict, tope: Optional[int]) -> dict:
+    """Añade al filtro de cambios el límite de tope_visible."""
+    if tope is None:
+        return filtro
+    return {"$and": [filtro, {"secuencia": {"$lt": tope}}]}
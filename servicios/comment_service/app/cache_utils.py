@@ -0,0 +1,76 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# Metadatos de eventos (título, email del organizador) y preferencias de usuario
+EVENT_CACHE_TTL_SECONDS = float(os.getenv("EVENT_CACHE_TTL_SECONDS", "300"))
+EVENT_CACHE_SIZE = int(os.getenv("EVENT_CACHE_SIZE", "1000"))
+PREFERENCE_CACHE_TTL_SECONDS = float(os.getenv("PREFERENCE_CACHE_TTL_SECONDS", "300"))
+PREFERENCE_CACHE_SIZE = int(os.getenv("PREFERENCE_CACHE_SIZE", "1000"))
+
+
+class TTLCache:
+    """
+    Caché en proceso acotada por tamaño (LRU) y por tiempo de vida.
+
+    get_or_load agrupa las cargas simultáneas de la misma clave: si llegan cien
+    comentarios a la vez sobre un evento, solo el primero hace la consulta y el
+    resto espera su resultado.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._datos: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._en_vuelo: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entrada = self._datos.get(key)
+        if entrada is None:
+            return None
+        expira, valor = entrada
+        if expira < time.monotonic():
+            del self._datos[key]
+            return None
+        self._datos.move_to_end(key)
+        return valor
+
+    def set(self, key: Hashable, valor: Any):
+        self._datos[key] = (time.monotonic() + self.ttl, valor)
+        self._datos.move_to_end(key)
+        while len(self._datos) > self.maxsize:
+            self._datos.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Descarta la clave; una carga en curso ya no guardará su resultado."""
+        self._datos.pop(key, None)
+        self._en_vuelo.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        valor = self.get(key)
+        if valor is not None:
+            return valor
+
+        en_vuelo = self._en_vuelo.get(key)
+        if en_vuelo is not None:
+            return await asyncio.shield(en_vuelo)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[key] = futuro
+        try:
+            valor = await loader()
+        except BaseException as e:
+            futuro.set_exception(e)
+            futuro.exception()  # marcada como recuperada aunque nadie más esperase
+            raise
+        finally:
+            vigente = self._en_vuelo.get(key) is futuro
+            if vigente:
+                del self._en_vuelo[key]
+
+        if vigente and valor is not None:
+            self.set(key, valor)
+        futuro.set_result(valor)
+        return valor
@@ -1,7 +1,9 @@
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
 from dotenv import load_dotenv
 
+from .outbox import OUTBOX_RETENTION_SECONDS
+
 load_dotenv()
 
 # Recuperamos la URI del entorno
@@ -11,4 +13,38 @@ MONGO_URI = os.getenv("MONGODB_URI")
 client = MongoClient(MONGO_URI, uuidRepresentation='standard')
 
 # Exportamos el objeto de base de datos completo 'db'
-db = client['KalendasDB']
\ No newline at end of file
+db = client['KalendasDB']
+
+
+def ensure_indexes():
+    """Crea (si no existen) los índices de la bandeja de salida, los resúmenes, las notificaciones y los comentarios."""
+    # Reserva de la siguiente tarea pendiente por fecha de próximo intento
+    db["outbox"].create_index([("estado", ASCENDING), ("proximoIntento", ASCENDING)], name="estado_proximo_intento")
+    # Las tareas completadas se borran solas (las muertas se conservan para revisarlas)
+    db["outbox"].create_index(
+        [("completadaEn", ASCENDING)], name="caducidad", expireAfterSeconds=OUTBOX_RETENTION_SECONDS
+    )
+    # Resúmenes: los vencidos se buscan por fecha de envío; como mucho uno pendiente por organizador
+    db["resumenes"].create_index([("estado", ASCENDING), ("enviarEn", ASCENDING)], name="estado_enviar_en")
+    db["resumenes"].create_index(
+        [("destinatario", ASCENDING)], name="pendiente_por_destinatario",
+        unique=True, partialFilterExpression={"estado": "pendiente"}
+    )
+    # Bandeja de notificaciones paginada por cursor (created_at, _id) de la más reciente a la más antigua
+    db["notificaciones"].create_index(
+        [("user_email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="bandeja_usuario"
+    )
+    # Hilos de comentarios paginados de más reciente a más antiguo, y recuentos por evento/calendario
+    db["comentarios"].create_index(
+        [("idEvento", ASCENDING), ("fechaCreacion", DESCENDING), ("_id", DESCENDING)], name="comentarios_evento"
+    )
+    db["comentarios"].create_index(
+        [("idCalendario", ASCENDING), ("fechaCreacion", DESCENDING), ("_id", DESCENDING)], name="comentarios_calendario"
+    )
+    # Comentarios cuya notificación aún no ha pasado a la bandeja de salida
+    db["comentarios"].create_index(
+        [("fechaCreacion", ASCENDING)], name="notificacion_pendiente",
+        partialFilterExpression={"notificacionPendiente": {"$exists": True}}
+    )
+    # Preferencias y contador de no leídas se leen siempre por email
+    db["users"].create_index([("email", ASCENDING)], name="email")
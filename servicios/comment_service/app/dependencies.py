@@ -1,5 +1,24 @@
+import httpx
+
 from app.service.commentsService import CommentsService
 from app.database import db 
+from app.email_utils import crear_transporte
+from app.pubsub import Broker
+from app.cache_utils import (
+    TTLCache, EVENT_CACHE_SIZE, EVENT_CACHE_TTL_SECONDS, PREFERENCE_CACHE_SIZE, PREFERENCE_CACHE_TTL_SECONDS
+)
+
+# Cliente HTTP compartido (pool de conexiones) para el servicio de eventos y la API de correo
+HTTP_CLIENT = httpx.AsyncClient(timeout=10.0, limits=httpx.Limits(max_connections=50, max_keepalive_connections=10))
+EMAIL_TRANSPORT = crear_transporte(HTTP_CLIENT)
+# Cachés en proceso de metadatos de eventos y de preferencias de usuario (viven mientras vive el proceso)
+EVENT_CACHE = TTLCache(EVENT_CACHE_SIZE, EVENT_CACHE_TTL_SECONDS)
+PREFERENCE_CACHE = TTLCache(PREFERENCE_CACHE_SIZE, PREFERENCE_CACHE_TTL_SECONDS)
+# Pub/sub de las conexiones SSE: uno por proceso, compartido por todas las peticiones y los workers
+BROKER = Broker()
 
 def get_comments_service() -> CommentsService:
-    return CommentsService(db=db) # Pasa 'db', NO 'crud'
\ No newline at end of file
+    return CommentsService(
+        db=db, http_client=HTTP_CLIENT, email_transport=EMAIL_TRANSPORT,
+        event_cache=EVENT_CACHE, preference_cache=PREFERENCE_CACHE, broker=BROKER
+    ) # Pasa 'db', NO 'crud'
@@ -1,48 +1,118 @@
 import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from dataclasses import dataclass
+from html import escape
+from typing import Dict, List
 
-def enviar_notificacion_email(destinatario: str, nombre_evento: str, contenido_comentario: str):
-    """
-    Función auxiliar para enviar correos usando la API de SendGrid.
-    Se conecta al archivo .env para leer las claves.
+import httpx
+
+# Transporte de correo: "sendgrid" (API HTTP) o "log" (no envía nada; para desarrollo y tests)
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT", "sendgrid")
+# URL de la API de SendGrid. Se puede apuntar a un servidor HTTP local que la imite.
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+
+
+class ErrorPermanente(Exception):
+    """Fallo que no se arregla reintentando (credenciales, destinatario no válido...)."""
+
+
+class ErrorTransitorio(Exception):
+    """Fallo que puede arreglarse reintentando más tarde (red, 429, 5xx...)."""
+
+
+@dataclass
+class Email:
+    destinatario: str
+    asunto: str
+    html: str
+
+
+def email_nuevo_comentario(destinatario: str, autor: str, titulo_evento: str, contenido: str) -> Email:
+    """Correo que recibe el organizador cuando comentan en su evento."""
+    return Email(
+        destinatario=destinatario,
+        asunto=f"Nuevo comentario en: {titulo_evento}",
+        html=f'''
+            <h3>¡Tienes un nuevo comentario!</h3>
+            <p><strong>{escape(autor)}</strong> ha comentado en tu evento <em>"{escape(titulo_evento)}"</em>:</p>
+            <blockquote style="background: #f8f9fa; padding: 15px; border-left: 4px solid #0d6efd;">
+                "{escape(contenido)}"
+            </blockquote>
+        ''',
+    )
+
+
+def email_resumen(destinatario: str, comentarios: List[dict], total: int) -> Email:
+    """Un solo correo con los comentarios acumulados en la ventana, agrupados por evento."""
+    por_evento: Dict[str, List[dict]] = {}
+    for comentario in comentarios:
+        por_evento.setdefault(str(comentario["idEvento"]), []).append(comentario)
+
+    bloques = []
+    for lista in por_evento.values():
+        titulo = lista[0]["tituloEvento"]
+        items = "".join(
+            f"<li><strong>{escape(c['autor'])}</strong>: {escape(c['contenido'])}</li>" for c in lista
+        )
+        bloques.append(f"<h4>{escape(titulo)} ({len(lista)})</h4><ul>{items}</ul>")
+    if total > len(comentarios):
+        bloques.append(f"<p>...y {total - len(comentarios)} comentarios más.</p>")
+
+    return Email(
+        destinatario=destinatario,
+        asunto=f"Resumen: {total} comentarios nuevos en tus eventos",
+        html=f"<h3>Resumen de actividad en tus eventos</h3>{''.join(bloques)}",
+    )
+
+
+class SendGridTransport:
     """
-    api_key = os.environ.get('SENDGRID_API_KEY')
-    remitente = os.environ.get('EMAIL_REMITENTE')
-
-    # Validación básica de seguridad
-    if not api_key or not remitente:
-        print("⚠️ ALERTA: Faltan SENDGRID_API_KEY o EMAIL_REMITENTE en el archivo .env")
-        return False
-
-    # Diseño del correo (HTML)
-    cuerpo_html = f"""
-    <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #eee; border-radius: 10px;">
-        <h2 style="color: #0d6efd;">🔔 Nueva actividad en tu evento</h2>
-        <p>Hola, el evento <strong>{nombre_evento}</strong> ha recibido un nuevo comentario:</p>
-        
-        <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid #0d6efd; margin: 20px 0;">
-            <p style="margin: 0; font-style: italic; color: #555;">"{contenido_comentario}"</p>
-        </div>
-        
-        <p style="font-size: 12px; color: #888;">
-            Has recibido esto porque eres el organizador de este evento en Kalendas.
-        </p>
-    </div>
+    Envía correos con la API HTTP de SendGrid usando un cliente httpx asíncrono
+    compartido (conexiones reutilizadas, sin bloquear el event loop).
     """
 
-    mensaje = Mail(
-        from_email=remitente,
-        to_emails=destinatario,
-        subject=f'Nuevo comentario en: {nombre_evento}',
-        html_content=cuerpo_html
-    )
+    def __init__(self, client: httpx.AsyncClient, api_url: str = SENDGRID_API_URL):
+        self.client = client
+        self.api_url = api_url
+
+    async def send(self, email: Email):
+        api_key = os.getenv("SENDGRID_API_KEY")
+        remitente = os.getenv("EMAIL_REMITENTE")
+        if not api_key or not remitente:
+            raise ErrorPermanente("Faltan credenciales: revisa EMAIL_REMITENTE y SENDGRID_API_KEY en el .env")
+
+        payload = {
+            "personalizations": [{"to": [{"email": email.destinatario}]}],
+            "from": {"email": remitente},
+            "subject": email.asunto,
+            "content": [{"type": "text/html", "value": email.html}],
+        }
+        try:
+            response = await self.client.post(
+                self.api_url, json=payload, headers={"Authorization": f"Bearer {api_key}"}
+            )
+        except httpx.RequestError as e:
+            raise ErrorTransitorio(f"No se pudo conectar con SendGrid: {e}")
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ErrorTransitorio(f"SendGrid respondió {response.status_code}")
+        if response.status_code >= 400:
+            raise ErrorPermanente(f"SendGrid rechazó el correo ({response.status_code}): {response.text}")
+        print(f"📧 [SendGrid] Correo enviado a {email.destinatario}. Status: {response.status_code}")
+
+
+class LogTransport:
+    """Transporte de pruebas: no envía nada, solo guarda y muestra los correos."""
+
+    def __init__(self):
+        self.enviados: List[Email] = []
+
+    async def send(self, email: Email):
+        self.enviados.append(email)
+        print(f"📧 [log] Para: {email.destinatario} | Asunto: {email.asunto}")
+
 
-    try:
-        sg = SendGridAPIClient(api_key)
-        respuesta = sg.send(mensaje)
-        print(f"📧 [SendGrid] Correo enviado a {destinatario}. Status: {respuesta.status_code}")
-        return True
-    except Exception as e:
-        print(f"❌ [SendGrid] Error enviando correo: {str(e)}")
-        return False
\ No newline at end of file
+def crear_transporte(client: httpx.AsyncClient):
+    """Devuelve el transporte configurado en EMAIL_TRANSPORT."""
+    if EMAIL_TRANSPORT == "log":
+        return LogTransport()
+    return SendGridTransport(client)
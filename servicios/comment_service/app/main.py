@@ -1,11 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .router import comments
+from . import database
+from .outbox import OutboxWorker
+from .dependencies import get_comments_service, HTTP_CLIENT
+from .service.commentsService import DIGEST_POLL_SECONDS
+
+
+async def enviar_resumenes_periodicamente():
+    """
+    Job en segundo plano: cada DIGEST_POLL_SECONDS pasa a la bandeja de salida los resúmenes
+    vencidos y las notificaciones que se quedaron en su comentario.
+    """
+    service = get_comments_service()
+    while True:
+        try:
+            recuperadas = await service.flush_pending_notifications()
+            if recuperadas:
+                print(f"📮 {recuperadas} notificaciones recuperadas a la bandeja de salida")
+            enviados = await service.flush_due_digests()
+            if enviados:
+                print(f"📬 {enviados} resúmenes listos para enviar")
+        except Exception as e:
+            print(f"⚠️ Error procesando resúmenes: {e}")
+        await asyncio.sleep(DIGEST_POLL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Índices de MongoDB y workers de la bandeja de salida (notificaciones)
+    database.ensure_indexes()
+    worker = OutboxWorker(database.db["outbox"], get_comments_service().process_outbox_task)
+    worker.start()
+    resumenes = asyncio.create_task(enviar_resumenes_periodicamente())
+    yield
+    resumenes.cancel()
+    await worker.stop()
+    await HTTP_CLIENT.aclose()
 
 
 app = FastAPI(
     title="API de Kalendas",
     description="API para la gestión de calendarios y eventos.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Incluimos el router de comentarios en la aplicación principal.
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from uuid import UUID 
 
@@ -31,4 +31,21 @@ class CommentInDB(CommentBase):
             }
         }
     )
-    
\ No newline at end of file
+    
+
+# Página de comentarios (más recientes primero); 'siguiente' es el cursor de la página siguiente
+class CommentPage(BaseModel):
+    comentarios: List[CommentInDB]
+    siguiente: Optional[str] = None
+
+# Petición de recuento de comentarios de muchos eventos/calendarios a la vez
+class CommentCountsRequest(BaseModel):
+    ids_evento: List[UUID] = Field(default_factory=list, alias="idsEvento", max_length=1000)
+    ids_calendario: List[UUID] = Field(default_factory=list, alias="idsCalendario", max_length=1000)
+
+    model_config = ConfigDict(populate_by_name=True)
+
+# Número de comentarios por ID (los IDs sin comentarios aparecen con 0)
+class CommentCounts(BaseModel):
+    eventos: Dict[str, int] = Field(default_factory=dict)
+    calendarios: Dict[str, int] = Field(default_factory=dict)
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+from uuid import UUID, uuid4
+
+from pymongo import ReturnDocument
+from starlette.concurrency import run_in_threadpool
+
+from .email_utils import ErrorPermanente
+
+# Número de workers concurrentes que procesan la bandeja de salida
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+# Reintentos: intentos máximos antes de pasar a "muerta" y backoff exponencial (segundos)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "2"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "600"))
+# Cada cuánto se mira la cola si no hay avisos, y cuánto dura la reserva de una tarea
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+# Las tareas completadas se borran solas pasado este tiempo (índice TTL)
+OUTBOX_RETENTION_SECONDS = int(os.getenv("OUTBOX_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Estados de una tarea
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+HECHA = "hecha"
+MUERTA = "muerta"
+
+# Aviso en proceso para no esperar al siguiente sondeo cuando se encola algo
+_hay_trabajo = asyncio.Event()
+
+
+def nueva_tarea(tipo: str, payload: dict, tarea_id: Optional[UUID] = None) -> dict:
+    """Documento de una tarea nueva de la bandeja de salida (tarea_id fijo = inserción idempotente)."""
+    ahora = datetime.utcnow()
+    return {
+        "_id": tarea_id or uuid4(),
+        "tipo": tipo,
+        "payload": payload,
+        "estado": PENDIENTE,
+        "intentos": 0,
+        "proximoIntento": ahora,
+        "creadaEn": ahora,
+    }
+
+
+def despertar():
+    """Avisa a los workers de que hay una tarea nueva."""
+    _hay_trabajo.set()
+
+
+def calcular_backoff(intentos: int) -> float:
+    """Espera antes del siguiente intento: exponencial con tope y un poco de jitter."""
+    espera = min(OUTBOX_BACKOFF_BASE_SECONDS * (2 ** (intentos - 1)), OUTBOX_BACKOFF_MAX_SECONDS)
+    return espera * random.uniform(0.8, 1.2)
+
+
+class OutboxWorker:
+    """
+    Pool de workers que consume la bandeja de salida (colección 'outbox').
+
+    Cada worker reserva una tarea con find_one_and_update (estado 'procesando' con una
+    fecha de caducidad de la reserva, así que si el proceso muere otra instancia la
+    retoma), ejecuta el manejador y la marca como hecha, la reprograma con backoff
+    exponencial o, agotados los intentos, la deja como 'muerta' para revisarla a mano.
+    """
+
+    def __init__(self, collection, handler: Callable[[dict], Awaitable[None]], workers: int = OUTBOX_WORKERS):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _reservar(self) -> Optional[dict]:
+        ahora = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"$or": [
+                {"estado": PENDIENTE, "proximoIntento": {"$lte": ahora}},
+                # Reserva caducada: el worker que la tenía murió a mitad
+                {"estado": PROCESANDO, "reservadaHasta": {"$lt": ahora}},
+            ]},
+            {
+                "$set": {"estado": PROCESANDO, "reservadaHasta": ahora + timedelta(seconds=OUTBOX_LEASE_SECONDS)},
+                "$inc": {"intentos": 1},
+            },
+            sort=[("proximoIntento", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                # PyMongo es bloqueante: la reserva va a un hilo para no parar el bucle de eventos
+                tarea = await run_in_threadpool(self._reservar)
+            except Exception as e:
+                print(f"⚠️ [outbox] Error leyendo la bandeja de salida: {e}")
+                tarea = None
+
+            if tarea is None:
+                _hay_trabajo.clear()
+                try:
+                    await asyncio.wait_for(_hay_trabajo.wait(), timeout=OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._procesar(tarea)
+
+    async def _procesar(self, tarea: dict):
+        try:
+            await self.handler(tarea)
+        except ErrorPermanente as e:
+            await self._muerta(tarea, str(e))
+        except Exception as e:
+            if tarea["intentos"] >= OUTBOX_MAX_ATTEMPTS:
+                await self._muerta(tarea, str(e))
+            else:
+                espera = calcular_backoff(tarea["intentos"])
+                print(f"🔁 [outbox] Tarea {tarea['_id']} falló ({e}); reintento en {espera:.0f}s")
+                await run_in_threadpool(
+                    self.collection.update_one,
+                    {"_id": tarea["_id"]},
+                    {"$set": {
+                        "estado": PENDIENTE,
+                        "proximoIntento": datetime.utcnow() + timedelta(seconds=espera),
+                        "ultimoError": str(e),
+                    }}
+                )
+        else:
+            await run_in_threadpool(
+                self.collection.update_one,
+                {"_id": tarea["_id"]},
+                {"$set": {"estado": HECHA, "completadaEn": datetime.utcnow()}, "$unset": {"reservadaHasta": ""}}
+            )
+
+    async def _muerta(self, tarea: dict, error: str):
+        print(f"💀 [outbox] Tarea {tarea['_id']} descartada tras {tarea['intentos']} intentos: {error}")
+        await run_in_threadpool(
+            self.collection.update_one,
+            {"_id": tarea["_id"]},
+            {"$set": {"estado": MUERTA, "ultimoError": error}, "$unset": {"reservadaHasta": ""}}
+        )
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from fastapi import Request
+
+# Eventos pendientes por conexión: si un cliente lento llena su cola se le desconecta
+# (y al reconectar recupera lo perdido con Last-Event-ID) en vez de crecer sin límite
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+# Eventos recientes que se guardan por canal para reanudar con Last-Event-ID
+SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", "200"))
+# Un canal sin suscriptores se olvida (con su histórico) si no recibe nada en este tiempo
+SSE_CHANNEL_TTL_SECONDS = float(os.getenv("SSE_CHANNEL_TTL_SECONDS", "600"))
+# Cada cuánto se manda un comentario vacío para que proxies y navegador no corten la conexión
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Espera (ms) que se indica al navegador antes de reconectar
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+
+
+@dataclass
+class Mensaje:
+    id: Optional[int]  # None = estado inicial, no cuenta como último evento recibido
+    tipo: str
+    datos: dict
+    hora: float = field(default_factory=time.monotonic)
+
+
+@dataclass(eq=False)
+class Suscripcion:
+    canal: str
+    cola: "asyncio.Queue[Optional[Mensaje]]" = field(default_factory=lambda: asyncio.Queue(SSE_QUEUE_SIZE))
+
+
+class Broker:
+    """
+    Pub/sub en proceso para las conexiones SSE.
+
+    Cada canal ("evento:<id>", "usuario:<email>") tiene sus suscriptores y un histórico
+    corto de mensajes. publish nunca espera: deja el mensaje en la cola de cada
+    suscriptor y, si alguna está llena, cierra esa suscripción. Los IDs arrancan en el
+    instante de arranque (ms), así que siguen creciendo aunque el servicio se reinicie.
+
+    Los canales sin suscriptores cuyo último mensaje tiene más de canal_ttl segundos se
+    olvidan; quien reanude desde antes de lo olvidado recibe 'reinicio'.
+    """
+
+    def __init__(self, replay_size: int = SSE_REPLAY_SIZE, canal_ttl: float = SSE_CHANNEL_TTL_SECONDS):
+        self.replay_size = replay_size
+        self.canal_ttl = canal_ttl
+        self._suscriptores: Dict[str, Set[Suscripcion]] = {}
+        self._historico: Dict[str, Deque[Mensaje]] = {}
+        self._inicio = int(time.time() * 1000)
+        self._ultimo_id = self._inicio
+        # Último ID que ha salido del histórico de cada canal
+        self._descartado: Dict[str, int] = {}
+        # Último ID de los canales olvidados: un canal nuevo no puede reanudar desde antes
+        self._olvidado_hasta = self._inicio
+        self._ultima_limpieza = time.monotonic()
+
+    def subscribe(self, canal: str, last_event_id: Optional[int] = None) -> Suscripcion:
+        """
+        Registra una conexión en el canal. Si trae Last-Event-ID se le encolan los mensajes
+        posteriores del histórico; si el histórico ya no llega tan atrás recibe 'reinicio'
+        para que vuelva a pedir los datos completos.
+        """
+        suscripcion = Suscripcion(canal)
+        if last_event_id is not None:
+            pendientes = [m for m in self._historico.get(canal, ()) if m.id > last_event_id]
+            # Se ha perdido algo si lo pedido es anterior a lo que ya salió del histórico
+            # (o a este arranque del servicio)
+            perdidos = last_event_id < self._descartado.get(canal, self._olvidado_hasta)
+            if perdidos or len(pendientes) >= SSE_QUEUE_SIZE:
+                suscripcion.cola.put_nowait(Mensaje(self._ultimo_id, "reinicio", {}))
+            else:
+                for mensaje in pendientes:
+                    suscripcion.cola.put_nowait(mensaje)
+        self._suscriptores.setdefault(canal, set()).add(suscripcion)
+        return suscripcion
+
+    def unsubscribe(self, suscripcion: Suscripcion):
+        suscriptores = self._suscriptores.get(suscripcion.canal)
+        if suscriptores is None:
+            return
+        suscriptores.discard(suscripcion)
+        if not suscriptores:
+            del self._suscriptores[suscripcion.canal]
+        self._limpiar()
+
+    def publish(self, canal: str, tipo: str, datos: dict) -> Mensaje:
+        self._ultimo_id += 1
+        mensaje = Mensaje(self._ultimo_id, tipo, datos)
+        historico = self._historico.get(canal)
+        if historico is None:
+            historico = self._historico[canal] = deque(maxlen=self.replay_size)
+            self._descartado[canal] = self._olvidado_hasta
+        if len(historico) == self.replay_size:
+            self._descartado[canal] = historico[0].id
+        historico.append(mensaje)
+
+        lentos: List[Suscripcion] = []
+        for suscripcion in self._suscriptores.get(canal, ()):
+            try:
+                suscripcion.cola.put_nowait(mensaje)
+            except asyncio.QueueFull:
+                lentos.append(suscripcion)
+        for suscripcion in lentos:
+            print(f"🐢 [sse] Conexión lenta en '{canal}': se cierra para que reanude con Last-Event-ID")
+            self.unsubscribe(suscripcion)
+            self._cerrar(suscripcion)
+        self._limpiar()
+        return mensaje
+
+    def _limpiar(self):
+        """Olvida los canales inactivos sin suscriptores (como mucho una pasada cada canal_ttl)."""
+        ahora = time.monotonic()
+        if ahora - self._ultima_limpieza < self.canal_ttl:
+            return
+        self._ultima_limpieza = ahora
+        for canal, historico in list(self._historico.items()):
+            if canal in self._suscriptores or (historico and ahora - historico[-1].hora < self.canal_ttl):
+                continue
+            if historico:
+                self._olvidado_hasta = max(self._olvidado_hasta, historico[-1].id)
+            del self._historico[canal]
+            self._descartado.pop(canal, None)
+
+    def _cerrar(self, suscripcion: Suscripcion):
+        # Se vacía la cola para que el aviso de cierre (None) entre y sea lo siguiente en leerse
+        while not suscripcion.cola.empty():
+            suscripcion.cola.get_nowait()
+        suscripcion.cola.put_nowait(None)
+
+
+def parse_last_event_id(valor: Optional[str]) -> Optional[int]:
+    """Last-Event-ID del navegador (cabecera o query); se ignora si no es un número."""
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def formatear(mensaje: Mensaje) -> str:
+    datos = json.dumps(mensaje.datos, ensure_ascii=False, default=str)
+    cabecera = f"id: {mensaje.id}\n" if mensaje.id is not None else ""
+    return f"{cabecera}event: {mensaje.tipo}\ndata: {datos}\n\n"
+
+
+async def sse_eventos(
+    request: Request,
+    broker: Broker,
+    canal: str,
+    last_event_id: Optional[int] = None,
+    inicial: Optional[Callable[[], Awaitable[Mensaje]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Cuerpo de una respuesta text/event-stream: mensajes del canal y latidos periódicos.
+    La suscripción se crea al empezar a recorrerlo y se quita al terminar, así que no
+    queda registrada si la respuesta nunca llega a enviarse. 'inicial' se calcula ya
+    suscrito, para no perder cambios entre leer el estado y empezar a escuchar.
+    """
+    suscripcion = broker.subscribe(canal, last_event_id)
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        if inicial is not None:
+            yield formatear(await inicial())
+        while True:
+            try:
+                mensaje = await asyncio.wait_for(suscripcion.cola.get(), timeout=SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            if mensaje is None:
+                break
+            yield formatear(mensaje)
+    finally:
+        broker.unsubscribe(suscripcion)
@@ -1,20 +1,30 @@
-from fastapi import APIRouter, Body, Response, status, Query, Depends, Header
+from fastapi import APIRouter, Body, Response, status, Query, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Annotated, Optional
 from uuid import UUID
 from pydantic import BaseModel
 
 from ..service.commentsService import CommentsService
 from ..dependencies import get_comments_service
-from ..model.comment_models import CommentCreate, CommentInDB
+from ..model.comment_models import CommentCreate, CommentInDB, CommentPage, CommentCountsRequest, CommentCounts
+from ..pubsub import parse_last_event_id
 
 router = APIRouter(prefix="/comments", tags=["Comentarios"])
 
 # Inyección de Dependencia
 ServiceDep = Annotated[CommentsService, Depends(get_comments_service)]
 
+# Cabeceras de las respuestas SSE: sin caché y sin buffering en proxies (nginx)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+class MarkRead(BaseModel):
+    email: str
+    ids: Optional[List[UUID]] = None  # None = marcar todas como leídas
+
 class PreferenceUpdate(BaseModel):
     email: str
     preference: str  # "email" o "app"
+    digest_minutes: Optional[int] = None  # > 0: un correo de resumen cada N minutos en vez de uno por comentario
 
 @router.post("/", response_model=CommentInDB, status_code=status.HTTP_201_CREATED)
 async def create_comment(
@@ -29,20 +39,79 @@ async def create_comment(
     # Llamamos al servicio con los argumentos correctos (modelo + nombre autor)
     return await service.create_comment(comment, x_user_name)
 
-@router.get("/", response_model=List[CommentInDB])
+@router.get("/", response_model=CommentPage)
 async def list_comments(
     service: ServiceDep,
     id_calendario: Optional[UUID] = Query(None, alias="idCalendario"),
-    id_evento: Optional[UUID] = Query(None, alias="idEvento")
+    id_evento: Optional[UUID] = Query(None, alias="idEvento"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Valor de 'siguiente' de la página anterior")
+):
+    """Comentarios de los más recientes a los más antiguos, paginados por cursor."""
+    try:
+        return await service.list_comments(id_calendario, id_evento, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor no válido")
+
+@router.post("/counts", response_model=CommentCounts)
+async def count_comments(data: CommentCountsRequest, service: ServiceDep):
+    """Número de comentarios de muchos eventos y/o calendarios con una sola consulta."""
+    return await service.count_comments(data.ids_evento, data.ids_calendario)
+
+@router.get("/stream")
+async def stream_comments(
+    request: Request,
+    service: ServiceDep,
+    id_evento: UUID = Query(..., alias="idEvento"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Comentarios nuevos del evento en tiempo real (Server-Sent Events, evento 'comentario')."""
+    return StreamingResponse(
+        service.stream_comments(request, id_evento, parse_last_event_id(last_event_id)),
+        media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+@router.get("/notifications/stream", tags=["Notificaciones"])
+async def stream_notifications(
+    request: Request,
+    service: ServiceDep,
+    x_user_email: str = Query(..., alias="email"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
 ):
-    return await service.list_comments(id_calendario, id_evento)
+    """
+    Notificaciones del usuario en tiempo real (SSE). Al conectar se envía el contador
+    actual ('no_leidas'); después, cada 'notificacion' nueva y los cambios del contador.
+    """
+    return StreamingResponse(
+        service.stream_notifications(request, x_user_email, parse_last_event_id(last_event_id)),
+        media_type="text/event-stream", headers=SSE_HEADERS
+    )
 
 @router.get("/notifications", tags=["Notificaciones"])
 async def get_my_notifications(
     service: ServiceDep,
-    x_user_email: str = Query(..., alias="email") # Recibimos email por query param
+    x_user_email: str = Query(..., alias="email"), # Recibimos email por query param
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Valor de 'siguiente' de la página anterior")
 ):
-    return await service.get_notifications(x_user_email)
+    """Bandeja del usuario, de la más reciente a la más antigua, paginada por cursor."""
+    try:
+        return await service.get_notifications(x_user_email, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor no válido")
+
+@router.get("/notifications/unread-count", tags=["Notificaciones"])
+async def get_unread_count(
+    service: ServiceDep,
+    x_user_email: str = Query(..., alias="email")
+):
+    """Número de notificaciones sin leer (contador mantenido al insertar y al leer)."""
+    return {"no_leidas": await service.get_unread_count(x_user_email)}
+
+@router.post("/notifications/read", tags=["Notificaciones"])
+async def mark_notifications_read(data: MarkRead, service: ServiceDep):
+    """Marca como leídas las notificaciones indicadas, o todas si no se pasan IDs."""
+    return {"marcadas": await service.mark_notifications_read(data.email, data.ids)}
 
 @router.get("/{id}", response_model=CommentInDB)
 async def get_comment(id: UUID, service: ServiceDep):
@@ -61,10 +130,11 @@ async def delete_comment(id: UUID, service: ServiceDep):
 async def get_preferences(email: str, service: ServiceDep):
     """Obtiene la preferencia de notificación de un usuario."""
     pref = await service.get_user_preference(email)
-    return {"preference": pref}
+    digest_minutes = await service.get_user_digest_minutes(email)
+    return {"preference": pref, "digest_minutes": digest_minutes}
 
 @router.post("/preferences", tags=["Preferencias"])
 async def save_preferences(data: PreferenceUpdate, service: ServiceDep):
-    """Guarda la preferencia (Email o App)."""
-    saved_pref = await service.update_user_preference(data.email, data.preference)
+    """Guarda la preferencia (Email o App) y, opcionalmente, la ventana del modo resumen."""
+    saved_pref = await service.update_user_preference(data.email, data.preference, data.digest_minutes)
     return {"status": "ok", "saved": saved_pref}
\ No newline at end of file
@@ -1,24 +1,70 @@
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from uuid import UUID, uuid4
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
 import os
 import httpx
-from fastapi import HTTPException, status
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from pymongo.errors import DuplicateKeyError
+from fastapi import HTTPException, Request, status
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
 
 # Importaciones de tu proyecto
 from ..model.comment_models import CommentCreate, CommentInDB
+from ..email_utils import ErrorPermanente, ErrorTransitorio, email_nuevo_comentario, email_resumen
+from .. import outbox
+from ..pubsub import Broker, Mensaje, sse_eventos
+from ..cache_utils import (
+    TTLCache, EVENT_CACHE_SIZE, EVENT_CACHE_TTL_SECONDS, PREFERENCE_CACHE_SIZE, PREFERENCE_CACHE_TTL_SECONDS
+)
 
 # URL del microservicio de eventos
 EVENT_SERVICE_URL = os.getenv("EVENT_SERVICE_URL", "http://event_service:8000")
 
+# Modo resumen: ventana máxima (minutos), comentarios guardados por resumen y cada cuánto se buscan resúmenes vencidos
+DIGEST_MAX_MINUTES = int(os.getenv("DIGEST_MAX_MINUTES", "1440"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "50"))
+DIGEST_POLL_SECONDS = int(os.getenv("DIGEST_POLL_SECONDS", "30"))
+
+
+def encode_cursor(created_at: datetime, notification_id: UUID) -> str:
+    """Cursor opaco de la bandeja y de los comentarios: posición (fecha, _id) del último elemento entregado."""
+    crudo = f"{created_at.isoformat()}|{notification_id}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Devuelve (created_at, _id). Lanza ValueError si el cursor no es válido."""
+    relleno = "=" * (-len(cursor) % 4)
+    created_at, notification_id = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+    return datetime.fromisoformat(created_at), UUID(notification_id)
+
 class CommentsService:
-    def __init__(self, db):
+    def __init__(
+        self,
+        db,
+        http_client: Optional[httpx.AsyncClient] = None,
+        email_transport=None,
+        event_cache: Optional[TTLCache] = None,
+        preference_cache: Optional[TTLCache] = None,
+        broker: Optional[Broker] = None,
+    ):
         self.db = db
         self.comments_collection = db["comentarios"]
         self.users_collection = db["users"]
         self.notif_collection = db["notificaciones"]
+        self.outbox_collection = db["outbox"]
+        self.digests_collection = db["resumenes"]
+        self.http_client = http_client if http_client is not None else httpx.AsyncClient(timeout=10.0)
+        self.email_transport = email_transport
+        # Cachés compartidas entre peticiones (las inyecta dependencies.py)
+        self.event_cache = event_cache if event_cache is not None else TTLCache(EVENT_CACHE_SIZE, EVENT_CACHE_TTL_SECONDS)
+        self.preference_cache = (
+            preference_cache if preference_cache is not None
+            else TTLCache(PREFERENCE_CACHE_SIZE, PREFERENCE_CACHE_TTL_SECONDS)
+        )
+        # Pub/sub en proceso que alimenta las conexiones SSE (comentarios y notificaciones en vivo)
+        self.broker = broker if broker is not None else Broker()
 
     async def create_comment(self, comment: CommentCreate, author_name: str) -> CommentInDB:
         # 1. Crear el objeto comentario
@@ -26,49 +72,132 @@ class CommentsService:
         comment_dict["_id"] = uuid4()
         comment_dict["fechaCreacion"] = datetime.now()
 
-        # 2. Insertar en Base de Datos (SIN AWAIT)
-        new_comment = self.comments_collection.insert_one(comment_dict)
-        created_comment = self.comments_collection.find_one({"_id": new_comment.inserted_id})
+        # 2. La tarea de notificación viaja dentro del propio comentario: se guardan en la
+        #    misma escritura, así que no puede quedar un comentario sin su notificación.
+        #    Después se pasa a la bandeja de salida (y si el proceso muere antes, lo hace
+        #    flush_pending_notifications).
+        if comment.id_evento:
+            comment_dict["notificacionPendiente"] = outbox.nueva_tarea("nuevo_comentario", {
+                "idComentario": comment_dict["_id"],
+                "idEvento": comment.id_evento,
+                "autor": author_name,
+                "contenido": comment.contenido,
+            }, tarea_id=comment_dict["_id"])
+
+        # 3. Insertar en Base de Datos (SIN AWAIT)
+        self.comments_collection.insert_one(comment_dict)
+
+        # 4. Se publica en el canal del evento para las páginas que lo tienen abierto
+        if comment.id_evento:
+            self.broker.publish(
+                f"evento:{comment.id_evento}", "comentario",
+                jsonable_encoder(CommentInDB.model_validate(comment_dict))
+            )
+
+        # 5. La notificación no se envía aquí: la procesan los workers de la bandeja de
+        #    salida en segundo plano (la respuesta no espera a nadie).
+        tarea = comment_dict.pop("notificacionPendiente", None)
+        if tarea:
+            self._encolar_notificacion(comment_dict["_id"], tarea)
+            outbox.despertar()
+
+        # 6. Devolver éxito
+        return comment_dict
 
-        # 3. Lógica de Notificación (CON PROTECCIÓN)
+    def _encolar_notificacion(self, comment_id: UUID, tarea: dict):
+        """Copia la tarea guardada en el comentario a la bandeja de salida (idempotente: usa el _id del comentario)."""
         try:
-            if comment.id_evento:
-                await self._notify_organizer(comment.id_evento, author_name, comment.contenido)
-        except Exception as e:
-            print(f"⚠️ Alerta: Comentario guardado, pero falló el sistema de notificación: {e}")
+            self.outbox_collection.insert_one(tarea)
+        except DuplicateKeyError:
+            pass
+        self.comments_collection.update_one({"_id": comment_id}, {"$unset": {"notificacionPendiente": ""}})
 
-        # 4. Devolver éxito
-        return created_comment
+    async def flush_pending_notifications(self, limit: int = 500) -> int:
+        """
+        Pasa a la bandeja de salida las notificaciones que se quedaron en su comentario
+        (el proceso murió entre guardarlo y encolarla) y devuelve cuántas.
+        """
+        pendientes = list(
+            self.comments_collection.find(
+                {"notificacionPendiente": {"$exists": True}}, {"notificacionPendiente": 1}
+            ).limit(limit)
+        )
+        for doc in pendientes:
+            self._encolar_notificacion(doc["_id"], doc["notificacionPendiente"])
+        if pendientes:
+            outbox.despertar()
+        return len(pendientes)
+
+    async def _get_user_prefs(self, email: str) -> dict:
+        """Preferencias de notificación del usuario (cacheadas; update_user_preference invalida)."""
+        async def cargar():
+            # SIN AWAIT
+            user = self.users_collection.find_one({"email": email}) or {}
+            return {
+                "notification_pref": user.get("notification_pref", "email"),
+                "digest_minutes": user.get("digest_minutes", 0),
+            }
+        return await self.preference_cache.get_or_load(email, cargar)
 
     async def get_user_preference(self, email: str):
-        # SIN AWAIT
-        user = self.users_collection.find_one({"email": email})
-        return user.get("notification_pref", "email") if user else "email"
+        return (await self._get_user_prefs(email))["notification_pref"]
 
-    async def update_user_preference(self, email: str, preference: str):
+    async def get_user_digest_minutes(self, email: str) -> int:
+        """Ventana del modo resumen en minutos (0 = un correo por comentario)."""
+        return (await self._get_user_prefs(email))["digest_minutes"]
+
+    async def update_user_preference(self, email: str, preference: str, digest_minutes: Optional[int] = None):
         if preference not in ["email", "app"]:
             preference = "email"
         
+        cambios = {"notification_pref": preference, "email": email}
+        if digest_minutes is not None:
+            cambios["digest_minutes"] = max(0, min(digest_minutes, DIGEST_MAX_MINUTES))
+
         # SIN AWAIT
         self.users_collection.update_one(
             {"email": email},
-            {"$set": {"notification_pref": preference, "email": email}},
+            {"$set": cambios},
             upsert=True
         )
+        self.preference_cache.invalidate(email)
         return preference
 
-    async def _notify_organizer(self, event_id: UUID, author_name: str, content: str):
-        # A. Obtener datos del evento (HTTP es async, LLEVA AWAIT)
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{EVENT_SERVICE_URL}/events/{event_id}")
-                if response.status_code != 200:
-                    print(f"⚠️ No se pudo obtener el evento {event_id}")
-                    return
-                event_data = response.json()
-        except Exception as e:
-            print(f"❌ Error conectando con EventService: {e}")
-            return
+    async def process_outbox_task(self, task: dict):
+        """Manejador de los workers de la bandeja de salida."""
+        payload = task["payload"]
+        if task["tipo"] == "nuevo_comentario":
+            await self._notify_organizer(payload["idEvento"], payload["autor"], payload["contenido"], task["_id"])
+        elif task["tipo"] == "resumen":
+            await self.email_transport.send(
+                email_resumen(payload["destinatario"], payload["comentarios"], payload["total"])
+            )
+        else:
+            raise ErrorPermanente(f"Tipo de tarea desconocido: {task['tipo']}")
+
+    async def _get_event_metadata(self, event_id: UUID) -> dict:
+        """
+        Título y email del organizador del evento. Se cachean (TTL + LRU) y las consultas
+        simultáneas del mismo evento se agrupan en una sola llamada a EventService.
+        """
+        async def cargar():
+            # Cliente HTTP compartido; si falla, la tarea de la bandeja de salida se reintenta
+            try:
+                response = await self.http_client.get(f"{EVENT_SERVICE_URL}/events/{event_id}")
+            except httpx.RequestError as e:
+                raise ErrorTransitorio(f"Error conectando con EventService: {e}")
+            if response.status_code == 404:
+                raise ErrorPermanente(f"El evento {event_id} no existe")
+            if response.status_code != 200:
+                raise ErrorTransitorio(f"EventService respondió {response.status_code} para el evento {event_id}")
+            event_data = response.json()
+            # Solo lo que necesita la notificación, no el documento entero
+            return {"titulo": event_data.get("titulo"), "emailOrganizador": event_data.get("emailOrganizador")}
+        return await self.event_cache.get_or_load(event_id, cargar)
+
+    async def _notify_organizer(self, event_id: UUID, author_name: str, content: str, notification_id: UUID):
+        # A. Obtener datos del evento
+        event_data = await self._get_event_metadata(event_id)
 
         # B. Extraer Email y Preferencias
         organizer_email = event_data.get("emailOrganizador")
@@ -78,49 +207,92 @@ class CommentsService:
             print(f"⚠️ El evento '{event_title}' no tiene emailOrganizador.")
             return
 
-        # C. Buscar preferencia (SIN AWAIT)
-        user_pref_doc = self.users_collection.find_one({"email": organizer_email})
-        preference = user_pref_doc.get("notification_pref", "email") if user_pref_doc else "email"
+        # C. Buscar preferencia
+        prefs = await self._get_user_prefs(organizer_email)
+        preference = prefs["notification_pref"]
+        digest_minutes = prefs["digest_minutes"]
 
         print(f"🔔 Notificando a {organizer_email} ({preference})")
 
-        if preference == "email":
-            self._send_email_sendgrid(organizer_email, author_name, content, event_title)
+        if preference == "email" and digest_minutes > 0:
+            if not self._add_to_digest(organizer_email, digest_minutes, event_id, event_title, author_name, content):
+                # No se pudo guardar en el resumen: mejor un correo suelto que perder el comentario
+                print(f"⚠️ No se pudo añadir el comentario al resumen de {organizer_email}; se envía ya")
+                await self.email_transport.send(email_nuevo_comentario(organizer_email, author_name, event_title, content))
+        elif preference == "email":
+            await self.email_transport.send(email_nuevo_comentario(organizer_email, author_name, event_title, content))
         else:
-            await self._save_app_notification(organizer_email, author_name, content, event_title, event_id)
-
-    def _send_email_sendgrid(self, to_email, author_name, content, event_title):
-        remitente = os.getenv('EMAIL_REMITENTE')
-        api_key = os.getenv('SENDGRID_API_KEY')
+            await self._save_app_notification(notification_id, organizer_email, author_name, content, event_title, event_id)
 
-        if not remitente or not api_key:
-            error_msg = "Faltan credenciales: Revisa EMAIL_REMITENTE y SENDGRID_API_KEY en el .env"
-            print(f"❌ {error_msg}")
-            raise ValueError(error_msg)
+    def _add_to_digest(self, email, digest_minutes, event_id, event_title, author_name, content) -> bool:
+        """
+        Acumula el comentario en el resumen pendiente del organizador. El primer comentario
+        crea el resumen y fija cuándo se envía (enviarEn); los siguientes solo se añaden.
+        Devuelve False si no se ha podido guardar (choques repetidos con otros upserts).
+        """
+        ahora = datetime.utcnow()
+        entrada = {
+            "idEvento": event_id, "tituloEvento": event_title,
+            "autor": author_name, "contenido": content, "fecha": ahora,
+        }
+        for _ in range(2):
+            try:
+                self.digests_collection.update_one(
+                    {"destinatario": email, "estado": "pendiente"},
+                    {
+                        # Solo se guardan los últimos DIGEST_MAX_ITEMS; 'total' cuenta todos
+                        "$push": {"comentarios": {"$each": [entrada], "$slice": -DIGEST_MAX_ITEMS}},
+                        "$inc": {"total": 1},
+                        "$setOnInsert": {"_id": uuid4(), "enviarEn": ahora + timedelta(minutes=digest_minutes)},
+                    },
+                    upsert=True
+                )
+                return True
+            except DuplicateKeyError:
+                # Dos upserts simultáneos: el índice único solo deja crear uno, el otro se repite
+                continue
+        return False
 
-        try:
-            message = Mail(
-                from_email=remitente,
-                to_emails=to_email,
-                subject=f'Nuevo comentario en: {event_title}',
-                html_content=f'''
-                    <h3>¡Tienes un nuevo comentario!</h3>
-                    <p><strong>{author_name}</strong> ha comentado en tu evento <em>"{event_title}"</em>:</p>
-                    <blockquote style="background: #f8f9fa; padding: 15px; border-left: 4px solid #0d6efd;">
-                        "{content}"
-                    </blockquote>
-                '''
+    async def flush_due_digests(self) -> int:
+        """
+        Pasa a la bandeja de salida los resúmenes vencidos (índice estado + enviarEn) y
+        devuelve cuántos. El resumen se cierra antes de copiarlo, así que los comentarios
+        que lleguen mientras tanto abren uno nuevo; la tarea usa el _id del resumen, así
+        que repetir la copia tras una caída no envía dos correos.
+        """
+        enviados = 0
+        ahora = datetime.utcnow()
+        while True:
+            resumen = self.digests_collection.find_one_and_update(
+                {"$or": [{"estado": "pendiente", "enviarEn": {"$lte": ahora}}, {"estado": "cerrado"}]},
+                {"$set": {"estado": "cerrado"}},
+                sort=[("enviarEn", 1)]
             )
-            sg = SendGridAPIClient(api_key)
-            sg.send(message)
-            print(f"✅ Email enviado correctamente a {to_email}")
-        except Exception as e:
-            print(f"❌ Error crítico de SendGrid: {e}")
-            raise e
-
-    async def _save_app_notification(self, user_email, author_name, content, event_title, event_id):
+            if not resumen:
+                break
+            try:
+                self.outbox_collection.insert_one(outbox.nueva_tarea("resumen", {
+                    "destinatario": resumen["destinatario"],
+                    "comentarios": resumen["comentarios"],
+                    "total": resumen["total"],
+                }, tarea_id=resumen["_id"]))
+            except DuplicateKeyError:
+                pass
+            self.digests_collection.delete_one({"_id": resumen["_id"]})
+            enviados += 1
+
+        if enviados:
+            outbox.despertar()
+        return enviados
+
+    async def _save_app_notification(self, notification_id, user_email, author_name, content, event_title, event_id):
+        """
+        Guarda la notificación en la bandeja del usuario con el _id de la tarea de la bandeja
+        de salida, así que reintentar la tarea no la duplica: el contador de no leídas solo
+        sube si la inserción ha creado el documento.
+        """
         notification = {
-            "_id": uuid4(),
+            "_id": notification_id,
             "user_email": user_email,
             "message": f"{author_name} comentó en '{event_title}': {content[:50]}...",
             "event_id": str(event_id),
@@ -128,26 +300,138 @@ class CommentsService:
             "created_at": datetime.now()
         }
         # SIN AWAIT
-        self.notif_collection.insert_one(notification)
+        try:
+            self.notif_collection.insert_one(notification)
+        except DuplicateKeyError:
+            print(f"ℹ️ La notificación {notification_id} ya estaba guardada (tarea reintentada)")
+            return
+        # Contador de no leídas mantenido de forma incremental (la campana no cuenta documentos)
+        user = self.users_collection.find_one_and_update(
+            {"email": user_email}, {"$inc": {"no_leidas": 1}},
+            projection={"no_leidas": 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self.broker.publish(f"usuario:{user_email}", "notificacion", {
+            "notificacion": jsonable_encoder(notification), "no_leidas": user["no_leidas"]
+        })
         print("✅ Notificación guardada en BD con enlace correcto.")
 
     # --- CRUD y LISTAS (CORREGIDOS) ---
     
-    async def get_notifications(self, user_email: str):
-        # SIN AWAIT y usando list()
-        cursor = self.notif_collection.find({"user_email": user_email}).sort("created_at", -1).limit(50)
-        results = list(cursor) 
+    async def get_notifications(self, user_email: str, limit: int = 20, cursor: Optional[str] = None):
+        """
+        Página de la bandeja del usuario, de la más reciente a la más antigua. Se pagina por
+        cursor (created_at, _id) sobre el índice de la colección, no con skip.
+        Lanza ValueError si el cursor no es válido.
+        """
+        filtro = {"user_email": user_email}
+        if cursor:
+            created_at, notification_id = decode_cursor(cursor)
+            filtro["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": notification_id}},
+            ]
+
+        # SIN AWAIT y usando list(); se pide una de más para saber si hay otra página
+        cursor_db = self.notif_collection.find(filtro).sort([("created_at", -1), ("_id", -1)]).limit(limit + 1)
+        results = list(cursor_db)
+        siguiente = None
+        if len(results) > limit:
+            results = results[:limit]
+            siguiente = encode_cursor(results[-1]["created_at"], results[-1]["_id"])
+
         for n in results: n["_id"] = str(n["_id"])
-        return results
+        return {"notificaciones": results, "siguiente": siguiente}
+
+    async def get_unread_count(self, user_email: str) -> int:
+        """Número de notificaciones sin leer: una lectura por clave del documento del usuario."""
+        user = self.users_collection.find_one({"email": user_email}, {"no_leidas": 1})
+        return max(user.get("no_leidas", 0), 0) if user else 0
+
+    async def mark_notifications_read(self, user_email: str, ids: Optional[List[UUID]] = None) -> int:
+        """Marca como leídas las notificaciones indicadas (o todas) con un solo update_many."""
+        filtro = {"user_email": user_email, "read": False}
+        if ids is not None:
+            filtro["_id"] = {"$in": ids}
+
+        marcadas = self.notif_collection.update_many(filtro, {"$set": {"read": True}}).modified_count
+        if marcadas:
+            # Se descuentan exactamente las que han cambiado (sin bajar nunca de 0)
+            user = self.users_collection.find_one_and_update(
+                {"email": user_email},
+                [{"$set": {"no_leidas": {"$max": [0, {"$subtract": [{"$ifNull": ["$no_leidas", 0]}, marcadas]}]}}}],
+                projection={"no_leidas": 1}, return_document=ReturnDocument.AFTER
+            )
+            # Las demás pestañas del usuario actualizan la campana
+            self.broker.publish(f"usuario:{user_email}", "no_leidas", {"no_leidas": user["no_leidas"] if user else 0})
+        return marcadas
 
-    async def list_comments(self, id_calendario: Optional[UUID], id_evento: Optional[UUID]):
+    def stream_comments(self, request: Request, event_id: UUID, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Flujo SSE de los comentarios nuevos de un evento."""
+        return sse_eventos(request, self.broker, f"evento:{event_id}", last_event_id)
+
+    def stream_notifications(self, request: Request, user_email: str, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Flujo SSE de las notificaciones nuevas de un usuario; empieza con su contador de no leídas."""
+        async def inicial() -> Mensaje:
+            return Mensaje(None, "no_leidas", {"no_leidas": await self.get_unread_count(user_email)})
+        return sse_eventos(request, self.broker, f"usuario:{user_email}", last_event_id, inicial)
+
+    async def list_comments(
+        self, id_calendario: Optional[UUID], id_evento: Optional[UUID], limit: int = 50, cursor: Optional[str] = None
+    ):
+        """
+        Página de comentarios, de los más recientes a los más antiguos, paginada por cursor
+        (fechaCreacion, _id) sobre el índice del evento/calendario.
+        Lanza ValueError si el cursor no es válido.
+        """
         filtro = {}
         if id_calendario: filtro["idCalendario"] = id_calendario
         if id_evento: filtro["idEvento"] = id_evento
+        if cursor:
+            fecha, comment_id = decode_cursor(cursor)
+            filtro["$or"] = [
+                {"fechaCreacion": {"$lt": fecha}},
+                {"fechaCreacion": fecha, "_id": {"$lt": comment_id}},
+            ]
         
-        # SIN AWAIT y usando list()
-        cursor = self.comments_collection.find(filtro)
-        return list(cursor) # 'to_list' falla en PyMongo síncrono
+        # SIN AWAIT y usando list(); se pide uno de más para saber si hay otra página
+        cursor_db = self.comments_collection.find(filtro).sort([("fechaCreacion", -1), ("_id", -1)]).limit(limit + 1)
+        results = list(cursor_db) # 'to_list' falla en PyMongo síncrono
+        siguiente = None
+        if len(results) > limit:
+            results = results[:limit]
+            siguiente = encode_cursor(results[-1]["fechaCreacion"], results[-1]["_id"])
+        return {"comentarios": results, "siguiente": siguiente}
+
+    async def count_comments(self, ids_evento: List[UUID], ids_calendario: List[UUID]) -> dict:
+        """Número de comentarios de cada evento y calendario pedido, en una sola agregación."""
+        condiciones = []
+        if ids_evento: condiciones.append({"idEvento": {"$in": ids_evento}})
+        if ids_calendario: condiciones.append({"idCalendario": {"$in": ids_calendario}})
+
+        eventos = {str(i): 0 for i in ids_evento}
+        calendarios = {str(i): 0 for i in ids_calendario}
+        if not condiciones:
+            return {"eventos": eventos, "calendarios": calendarios}
+
+        # Un solo recorrido del índice; cada faceta agrupa por su campo
+        resultado = next(self.comments_collection.aggregate([
+            {"$match": {"$or": condiciones}},
+            {"$facet": {
+                "eventos": [
+                    {"$match": {"idEvento": {"$in": ids_evento}}},
+                    {"$group": {"_id": "$idEvento", "total": {"$sum": 1}}},
+                ],
+                "calendarios": [
+                    {"$match": {"idCalendario": {"$in": ids_calendario}}},
+                    {"$group": {"_id": "$idCalendario", "total": {"$sum": 1}}},
+                ],
+            }},
+        ]))
+        for grupo in resultado["eventos"]:
+            eventos[str(grupo["_id"])] = grupo["total"]
+        for grupo in resultado["calendarios"]:
+            calendarios[str(grupo["_id"])] = grupo["total"]
+        return {"eventos": eventos, "calendarios": calendarios}
 
     async def get_comment(self, id: UUID):
         # SIN AWAIT
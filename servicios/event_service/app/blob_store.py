@@ -0,0 +1,145 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow es opcional: sin él simplemente no se generan miniaturas
+    Image = None
+
+# Directorio raíz del almacén local (en Docker, un volumen)
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "/data/adjuntos")
+# Tamaño máximo por fichero y número máximo de ficheros por petición
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+ATTACHMENT_MAX_FILES = int(os.getenv("ATTACHMENT_MAX_FILES", "10"))
+# Tamaño de cada trozo leído/escrito (la memoria usada por subida no pasa de aquí)
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(64 * 1024)))
+# Lado máximo (px) de las miniaturas
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class AdjuntoDemasiadoGrande(Exception):
+    """El fichero supera ATTACHMENT_MAX_BYTES."""
+
+
+@dataclass
+class StoredBlob:
+    digest: str
+    tamano: int
+    nuevo: bool
+
+
+class BlobStore(ABC):
+    """
+    Interfaz del almacén de adjuntos. El contenido se direcciona por su SHA-256,
+    así que subir dos veces el mismo cartel solo ocupa espacio una vez.
+    """
+
+    @abstractmethod
+    def put(self, source: BinaryIO, max_bytes: int = ATTACHMENT_MAX_BYTES) -> StoredBlob:
+        ...
+
+    @abstractmethod
+    def path(self, digest: str) -> Optional[str]:
+        """Ruta local del contenido, o None si no existe."""
+
+    @abstractmethod
+    def thumbnail_path(self, digest: str) -> str:
+        """Ruta local donde vive (o vivirá) la miniatura del contenido."""
+
+    @abstractmethod
+    def delete(self, digest: str):
+        """Borra el contenido y su miniatura (si no existen, no hace nada)."""
+
+
+class LocalBlobStore(BlobStore):
+    """Almacén en el sistema de ficheros: <raiz>/ab/cd/<sha256>."""
+
+    def __init__(self, root: str = ATTACHMENTS_DIR, chunk_size: int = ATTACHMENT_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        # Temporales dentro de la raíz: el os.replace final es atómico (mismo sistema de ficheros)
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def _ruta(self, digest: str, carpeta: str = "blobs", extension: str = "") -> str:
+        return os.path.join(self.root, carpeta, digest[:2], digest[2:4], digest + extension)
+
+    def put(self, source: BinaryIO, max_bytes: int = ATTACHMENT_MAX_BYTES) -> StoredBlob:
+        """
+        Copia el fichero por trozos a un temporal calculando su SHA-256 sobre la marcha
+        y lo mueve a su ruta definitiva. Si el contenido ya existía, se descarta la copia.
+        Lanza AdjuntoDemasiadoGrande en cuanto se pasa de max_bytes.
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        sha, tamano = hashlib.sha256(), 0
+        try:
+            with os.fdopen(fd, "wb") as destino:
+                while True:
+                    trozo = source.read(self.chunk_size)
+                    if not trozo:
+                        break
+                    tamano += len(trozo)
+                    if tamano > max_bytes:
+                        raise AdjuntoDemasiadoGrande()
+                    sha.update(trozo)
+                    destino.write(trozo)
+
+            digest = sha.hexdigest()
+            final = self._ruta(digest)
+            if os.path.exists(final):
+                os.remove(tmp)
+                return StoredBlob(digest=digest, tamano=tamano, nuevo=False)
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(tmp, final)
+            return StoredBlob(digest=digest, tamano=tamano, nuevo=True)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def path(self, digest: str) -> Optional[str]:
+        ruta = self._ruta(digest)
+        return ruta if os.path.exists(ruta) else None
+
+    def thumbnail_path(self, digest: str) -> str:
+        return self._ruta(digest, carpeta="miniaturas", extension=".jpg")
+
+    def delete(self, digest: str):
+        for ruta in (self._ruta(digest), self.thumbnail_path(digest)):
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+
+def generar_miniatura(store: BlobStore, digest: str, lado: int = THUMBNAIL_SIZE):
+    """
+    Genera la miniatura JPEG de una imagen (fuera del camino de la petición, en una
+    tarea en segundo plano). Si Pillow no está instalado o la imagen no se puede leer,
+    no hace nada: la descarga de la miniatura responderá 404.
+    """
+    origen = store.path(digest)
+    destino = store.thumbnail_path(digest)
+    if Image is None or origen is None or os.path.exists(destino):
+        return
+
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    tmp = destino + ".tmp"
+    try:
+        with Image.open(origen) as imagen:
+            # draft() deja que el decodificador JPEG reduzca al leer (mucha menos memoria)
+            imagen.draft("RGB", (lado, lado))
+            imagen.thumbnail((lado, lado))
+            imagen.convert("RGB").save(tmp, "JPEG", quality=85)
+        os.replace(tmp, destino)
+    except Exception as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        print(f"⚠️ No se pudo generar la miniatura de {digest}: {e}")
@@ -1,14 +1,25 @@
-from typing import List, Optional
+import heapq
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 from uuid import UUID
 from datetime import datetime
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, ASCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
 
 # Importaciones de tu proyecto
 from .. import database
 from ..model.event_model import EventCreate, EventInDB 
+from ..sync_utils import secuencias_reservadas, tope_visible
 
 # Alias para la colección de MongoDB (simplifica el código)
 EventCollection = database.eventos_collection 
+ArchiveCollection = database.eventos_archivo_collection
+SequenceCollection = database.secuencias_collection
+TombstoneCollection = database.eventos_eliminados_collection
+AttachmentCollection = database.adjuntos_collection
+
+# Veces que se reintenta archivar un evento que se modifica mientras se mueve
+ARCHIVE_MAX_ATTEMPTS = 3
 
 class EventCRUD:
     """
@@ -17,27 +28,82 @@ class EventCRUD:
     """
 
     async def create(self, event_data: dict) -> EventInDB:
-        """Inserta el diccionario de evento en la BD y lo recupera."""
-        new_event = EventCollection.insert_one(event_data)
-        created_event = EventCollection.find_one({"_id": new_event.inserted_id})
-        return EventInDB.model_validate(created_event) # Convierte el dict de Mongo a Pydantic
+        """Inserta el diccionario de evento en la BD y lo devuelve como modelo."""
+        # El _id lo asigna el servicio, así que no hace falta releer el documento
+        EventCollection.insert_one(event_data)
+        return EventInDB.model_validate(event_data) # Convierte el dict de Mongo a Pydantic
+
 
+    async def create_many(self, events_data: List[dict]) -> Dict[int, str]:
+        """
+        Inserta un lote con insert_many no ordenado (un fallo no detiene el resto).
+        Devuelve los errores por posición dentro del lote; las posiciones ausentes se insertaron.
+        """
+        try:
+            EventCollection.insert_many(events_data, ordered=False)
+        except BulkWriteError as e:
+            return {err["index"]: err.get("errmsg", "Error de escritura") for err in e.details.get("writeErrors", [])}
+        return {}
 
-    async def get_by_id(self, event_id: UUID) -> Optional[EventInDB]:
-        """Busca un evento por ID."""
+
+    async def get_by_id(self, event_id: UUID, include_archived: bool = False) -> Optional[EventInDB]:
+        """Busca un evento por ID (y, si se pide, también en el archivo)."""
         event_data = EventCollection.find_one({"_id": event_id})
+        if not event_data and include_archived:
+            event_data = ArchiveCollection.find_one({"_id": event_id})
         if event_data:
             return EventInDB.model_validate(event_data)
         return None
 
     
-    async def list_by_filter(self, filters: dict) -> List[EventInDB]:
-        """Devuelve una lista de eventos aplicando el filtro de MongoDB."""
+    async def list_by_filter(self, filters: dict, include_archived: bool = False) -> List[EventInDB]:
+        """Devuelve una lista de eventos aplicando el filtro de MongoDB (opcionalmente también al archivo)."""
         cursor = EventCollection.find(filters)
         event_list = list(cursor)
+        if include_archived:
+            event_list.extend(ArchiveCollection.find(filters))
         return [EventInDB.model_validate(event) for event in event_list]
 
 
+    async def aggregate(self, pipeline: List[dict]) -> List[dict]:
+        """Ejecuta un pipeline de agregación y devuelve los documentos resultantes."""
+        return list(EventCollection.aggregate(pipeline))
+
+
+    async def list_ids(self, filters: dict) -> List[UUID]:
+        """Devuelve solo los IDs de los eventos que cumplen el filtro, por orden de comienzo."""
+        cursor = EventCollection.find(filters, {"_id": 1}).sort("horaComienzo", ASCENDING)
+        return [doc["_id"] for doc in cursor]
+
+
+    def iter_by_filter(
+        self, filters: dict, sort: list, batch_size: int, include_archived: bool = False
+    ) -> Iterator[dict]:
+        """
+        Devuelve un cursor perezoso (no una lista): los documentos se traen de
+        MongoDB por lotes de batch_size a medida que se consumen. Con include_archived
+        se mezclan en orden los cursores de 'eventos' y del archivo (orden ascendente).
+        """
+        hot = EventCollection.find(filters).sort(sort).batch_size(batch_size)
+        if not include_archived:
+            return hot
+        cold = ArchiveCollection.find(filters).sort(sort).batch_size(batch_size)
+        campos = [campo for campo, _ in sort]
+        return heapq.merge(hot, cold, key=lambda doc: tuple(doc[campo] for campo in campos))
+
+
+    def iter_intervals(self, filters: dict) -> Iterator[dict]:
+        """
+        Devuelve un cursor ordenado por horaComienzo que solo trae los campos
+        necesarios para calcular intervalos ocupados (sin documentos completos).
+        """
+        projection = {
+            "_id": 0, "horaComienzo": 1, "horaFin": 1,
+            "duracionMinutos": 1, "rrule": 1, "fechasExcluidas": 1,
+        }
+        return EventCollection.find(filters, projection).sort("horaComienzo", ASCENDING)
+
+
     async def update(self, event_id: UUID, update_data: dict) -> Optional[EventInDB]:
         """Actualiza y devuelve el documento actualizado."""
         updated_data = EventCollection.find_one_and_update(
@@ -50,7 +116,195 @@ class EventCRUD:
         return None
 
 
+    @asynccontextmanager
+    async def reserve_sequence(self, cantidad: int = 1) -> AsyncIterator[int]:
+        """
+        Reserva 'cantidad' números de secuencia consecutivos y da el último. La secuencia es
+        global a la colección y solo crece (base de la sincronización incremental). La
+        escritura que los usa se hace dentro del bloque: hasta salir de él, /events/changes
+        no entrega nada a partir de esos números.
+        """
+        with secuencias_reservadas(SequenceCollection, "eventos", cantidad) as ultima:
+            yield ultima
+
+
+    async def sequence_limit(self) -> Optional[int]:
+        """Primera secuencia que /events/changes aún no puede entregar (ver sync_utils.tope_visible)."""
+        return tope_visible(SequenceCollection, "eventos")
+
+
+    async def add_tombstone(self, event_id: UUID, secuencia: int):
+        """Deja una marca de borrado (caduca sola por el índice TTL)."""
+        TombstoneCollection.replace_one(
+            {"_id": event_id},
+            {"_id": event_id, "secuencia": secuencia, "eliminadoEn": datetime.utcnow()},
+            upsert=True
+        )
+
+
+    async def list_changes(self, filters: dict, limit: int) -> List[dict]:
+        """Eventos modificados que cumplen el filtro, en orden (secuencia, _id)."""
+        cursor = EventCollection.find(filters).sort([("secuencia", ASCENDING), ("_id", ASCENDING)]).limit(limit)
+        return list(cursor)
+
+
+    async def list_tombstones(self, filters: dict, limit: int) -> List[dict]:
+        """Marcas de borrado que cumplen el filtro, en orden (secuencia, _id)."""
+        cursor = TombstoneCollection.find(filters).sort([("secuencia", ASCENDING), ("_id", ASCENDING)]).limit(limit)
+        return list(cursor)
+
+
+    async def save_attachment(self, attachment_data: dict, subida: bool = True):
+        """
+        Registra los metadatos de un adjunto (si ya existía el mismo contenido, no cambia
+        nada). Con subida=True cuenta además una subida en curso de ese contenido: mientras
+        el contador no vuelva a 0 (release_attachments) no se puede borrar.
+        """
+        cambios = {"$setOnInsert": attachment_data}
+        if subida:
+            cambios["$inc"] = {"subidasEnCurso": 1}
+        AttachmentCollection.update_one({"_id": attachment_data["_id"]}, cambios, upsert=True)
+
+
+    async def release_attachments(self, digests: List[str]):
+        """Da por terminadas las subidas en curso contadas por save_attachment."""
+        for digest in digests:
+            AttachmentCollection.update_one({"_id": digest}, {"$inc": {"subidasEnCurso": -1}})
+
+
+    async def delete_attachment(self, digest: str) -> Optional[dict]:
+        """
+        Borra los metadatos de un adjunto (p. ej. al deshacer una subida fallida) si no hay
+        ninguna subida en curso del mismo contenido. Devuelve lo borrado o None.
+        """
+        return AttachmentCollection.find_one_and_delete({"_id": digest, "subidasEnCurso": {"$lte": 0}})
+
+
+    async def attachment_in_use(self, url: str) -> bool:
+        """
+        Indica si algún evento (también archivado) enlaza la URL del adjunto. Sin índice:
+        solo se usa al deshacer una subida fallida.
+        """
+        filtro = {"$or": [{"contenidoAdjunto.imagenes": url}, {"contenidoAdjunto.archivos": url}]}
+        return any(
+            coleccion.find_one(filtro, {"_id": 1}) is not None
+            for coleccion in (EventCollection, ArchiveCollection)
+        )
+
+
+    async def get_attachment(self, digest: str) -> Optional[dict]:
+        """Metadatos de un adjunto por su SHA-256."""
+        return AttachmentCollection.find_one({"_id": digest})
+
+
+    async def add_attachment_urls(
+        self, event_id: UUID, imagenes: List[str], archivos: List[str], secuencia: int
+    ) -> Optional[EventInDB]:
+        """Añade URLs de adjuntos al evento sin duplicarlas y devuelve el documento actualizado."""
+        updated_data = EventCollection.find_one_and_update(
+            {"_id": event_id},
+            {
+                "$addToSet": {
+                    "contenidoAdjunto.imagenes": {"$each": imagenes},
+                    "contenidoAdjunto.archivos": {"$each": archivos},
+                },
+                "$set": {"secuencia": secuencia},
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_data:
+            return EventInDB.model_validate(updated_data)
+        return None
+
+
+    async def replace_calendar_ancestry(self, calendar_id: UUID, new_ancestors: List[UUID], secuencia: int) -> int:
+        """
+        En los eventos del subárbol de un calendario, sustituye lo que hay por encima
+        de él en 'ancestrosCalendario' por la nueva lista de antecesores.
+        """
+        posicion = {"$indexOfArray": ["$ancestrosCalendario", calendar_id]}
+        actualizacion = [{"$set": {
+            "ancestrosCalendario": {"$concatArrays": [
+                {"$slice": ["$ancestrosCalendario", {"$add": [posicion, 1]}]},
+                new_ancestors,
+            ]},
+            "secuencia": secuencia,
+        }}]
+        # También en el archivo: si no, los eventos archivados conservarían la ascendencia antigua
+        return sum(
+            coleccion.update_many({"ancestrosCalendario": calendar_id}, actualizacion).modified_count
+            for coleccion in (EventCollection, ArchiveCollection)
+        )
+
+
+    async def detach_calendar(self, calendar_id: UUID, secuencia: int) -> int:
+        """
+        Quita un calendario eliminado (y sus antecesores) de 'ancestrosCalendario'.
+        Los eventos conservan siempre su propio idCalendario.
+        """
+        posicion = {"$indexOfArray": ["$ancestrosCalendario", calendar_id]}
+        actualizacion = [{"$set": {
+            "ancestrosCalendario": {"$slice": ["$ancestrosCalendario", {"$max": [posicion, 1]}]},
+            "secuencia": secuencia,
+        }}]
+        return sum(
+            coleccion.update_many({"ancestrosCalendario": calendar_id}, actualizacion).modified_count
+            for coleccion in (EventCollection, ArchiveCollection)
+        )
+
+
     async def delete(self, event_id: UUID) -> int:
-        """Elimina un evento y devuelve el número de documentos eliminados (0 o 1)."""
+        """Elimina un evento (esté en 'eventos' o en el archivo) y devuelve el número de documentos eliminados (0 o 1)."""
         delete_result = EventCollection.delete_one({"_id": event_id})
-        return delete_result.deleted_count
\ No newline at end of file
+        if delete_result.deleted_count == 0:
+            delete_result = ArchiveCollection.delete_one({"_id": event_id})
+        return delete_result.deleted_count
+
+
+    def archive_batch(self, limite: datetime, batch_size: int) -> int:
+        """
+        Mueve al archivo un lote de eventos terminados antes de 'limite' y devuelve cuántos.
+        Primero copia (upsert, así repetir un lote a medias no duplica nada) y después borra
+        cada evento de 'eventos' solo si sigue siendo la versión copiada (misma secuencia).
+        Si alguien lo ha modificado entretanto, se vuelve a copiar la versión nueva si sigue
+        terminada; si no, se retira del archivo y sigue en caliente.
+        Por cada evento archivado deja una marca en /events/changes.
+        """
+        docs = list(EventCollection.find({"horaFin": {"$lt": limite}}).limit(batch_size))
+        archivados = []
+        for _ in range(ARCHIVE_MAX_ATTEMPTS):
+            if not docs:
+                break
+            ArchiveCollection.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False)
+            fallidos = []
+            for doc in docs:
+                borrado = EventCollection.delete_one({"_id": doc["_id"], "secuencia": doc.get("secuencia")})
+                (archivados if borrado.deleted_count else fallidos).append(doc["_id"])
+            if not fallidos:
+                break
+
+            # El borrado no coincidió: el evento cambió (o se eliminó) después de copiarlo.
+            # Si sigue terminado se copia otra vez; si no (o ya no existe), fuera del archivo
+            docs = [
+                doc for doc in EventCollection.find({"_id": {"$in": fallidos}})
+                if doc.get("horaFin") is not None and doc["horaFin"] < limite
+            ]
+            siguen = {doc["_id"] for doc in docs}
+            retirar = [i for i in fallidos if i not in siguen]
+            if retirar:
+                ArchiveCollection.delete_many({"_id": {"$in": retirar}})
+        else:
+            # Se siguen modificando: se quedan en caliente hasta el próximo pase
+            ArchiveCollection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+
+        if archivados:
+            with secuencias_reservadas(SequenceCollection, "eventos", len(archivados)) as ultima:
+                TombstoneCollection.bulk_write([
+                    ReplaceOne(
+                        {"_id": event_id},
+                        {"_id": event_id, "secuencia": ultima - len(archivados) + 1 + n, "eliminadoEn": datetime.utcnow(), "archivado": True},
+                        upsert=True,
+                    )
+                    for n, event_id in enumerate(archivados)
+                ], ordered=False)
+        return len(archivados)
@@ -1,13 +1,62 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo import ASCENDING, GEOSPHERE
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 
+from .sync_utils import TOMBSTONE_TTL_SECONDS
+
 
 load_dotenv()
 
 uri = os.getenv('MONGODB_URI')
 client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
 db = client['KalendasDB']
-eventos_collection = db['eventos']
\ No newline at end of file
+eventos_collection = db['eventos']
+# Archivo frío: eventos terminados hace más del horizonte configurado (los mueve un job periódico)
+eventos_archivo_collection = db['eventos_archivo']
+# Sincronización incremental: contador de secuencia y marcas de borrado con caducidad
+secuencias_collection = db['secuencias']
+eventos_eliminados_collection = db['eventos_eliminados']
+# Metadatos de los adjuntos (el contenido vive en el almacén de blobs, clave = SHA-256)
+adjuntos_collection = db['adjuntos']
+
+
+def ensure_indexes():
+    """Crea (si no existen) los índices que usan las consultas del servicio."""
+    # Consultas clásicas por fecha de comienzo y exportación paginada por (horaComienzo, _id)
+    eventos_collection.create_index([("horaComienzo", ASCENDING), ("_id", ASCENDING)], name="hora_comienzo_id")
+    # Consultas por solapamiento [inicio, fin): horaFin > inicio AND horaComienzo < fin
+    eventos_collection.create_index(
+        [("horaFin", ASCENDING), ("horaComienzo", ASCENDING)], name="intervalo_evento"
+    )
+    # Free/busy: intervalos de un conjunto de calendarios recorridos en orden de comienzo
+    eventos_collection.create_index(
+        [("idCalendario", ASCENDING), ("horaComienzo", ASCENDING), ("horaFin", ASCENDING)],
+        name="calendario_intervalo"
+    )
+    # Multikey: eventos de un calendario y de todo su subárbol con una sola consulta
+    eventos_collection.create_index(
+        [("ancestrosCalendario", ASCENDING), ("horaComienzo", ASCENDING), ("horaFin", ASCENDING)],
+        name="arbol_calendario_intervalo"
+    )
+    # Geoespacial: punto GeoJSON derivado de contenidoAdjunto.mapa (+ ventana temporal)
+    eventos_collection.create_index(
+        [("ubicacion", GEOSPHERE), ("horaComienzo", ASCENDING)], name="ubicacion_hora"
+    )
+    # Sincronización incremental: cambios y borrados en orden (secuencia, _id)
+    eventos_collection.create_index([("secuencia", ASCENDING), ("_id", ASCENDING)], name="secuencia_id")
+    eventos_eliminados_collection.create_index([("secuencia", ASCENDING), ("_id", ASCENDING)], name="secuencia_id")
+    eventos_eliminados_collection.create_index(
+        [("eliminadoEn", ASCENDING)], name="caducidad", expireAfterSeconds=TOMBSTONE_TTL_SECONDS
+    )
+    # Archivo frío: solo los índices de las lecturas que admiten include_archived
+    eventos_archivo_collection.create_index([("horaComienzo", ASCENDING), ("_id", ASCENDING)], name="hora_comienzo_id")
+    eventos_archivo_collection.create_index(
+        [("ancestrosCalendario", ASCENDING), ("horaComienzo", ASCENDING), ("horaFin", ASCENDING)],
+        name="arbol_calendario_intervalo"
+    )
+    eventos_archivo_collection.create_index(
+        [("ubicacion", GEOSPHERE), ("horaComienzo", ASCENDING)], name="ubicacion_hora"
+    )
@@ -1,13 +1,21 @@
 from app.service.eventService import EventService
 from app.crud.event_crud import EventCRUD
+from app.ical_feed import FeedCache
+from app.blob_store import LocalBlobStore
 # Instanciación estática del CRUD (si no requiere sesión/estado)
 # Si EventCRUD requiriera una sesión de BD, esto usaría 'yield' y el patrón Context Manager
 EVENT_CRUD_INSTANCE = EventCRUD() 
+# La caché de feeds iCalendar se comparte entre peticiones (vive mientras vive el proceso)
+FEED_CACHE_INSTANCE = FeedCache()
+# Almacén de adjuntos (sistema de ficheros local; se puede sustituir por otra implementación de BlobStore)
+BLOB_STORE_INSTANCE = LocalBlobStore()
 
 def get_event_crud() -> EventCRUD:
     """Provee la instancia del CRUD (útil para otros servicios o tests)."""
     return EVENT_CRUD_INSTANCE
 
 def get_event_service() -> EventService:
-    """Provee la instancia del EventService, inyectándole el CRUD."""
-    return EventService(crud_repository=EVENT_CRUD_INSTANCE)
\ No newline at end of file
+    """Provee la instancia del EventService, inyectándole el CRUD, la caché de feeds y el almacén de adjuntos."""
+    return EventService(
+        crud_repository=EVENT_CRUD_INSTANCE, feed_cache=FEED_CACHE_INSTANCE, blob_store=BLOB_STORE_INSTANCE
+    )
\ No newline at end of file
@@ -0,0 +1,66 @@
+import heapq
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Tuple
+
+from .recurrence_utils import expandir_ocurrencias
+
+Intervalo = Tuple[datetime, datetime]
+
+
+def intervalos_ordenados(docs: Iterable[dict], desde: datetime, hasta: datetime) -> Iterator[Intervalo]:
+    """
+    Convierte documentos proyectados (ordenados por horaComienzo) en intervalos
+    ocupados, también ordenados por inicio.
+
+    Las series recurrentes se expanden en la ventana y sus ocurrencias esperan en
+    un heap: como todas empiezan después del horaComienzo de la serie, el orden
+    global se mantiene sin tener que cargar el cursor completo en memoria.
+    """
+    pendientes: List[Intervalo] = []
+    for doc in docs:
+        inicio = doc["horaComienzo"]
+        while pendientes and pendientes[0][0] <= inicio:
+            yield heapq.heappop(pendientes)
+
+        if doc.get("rrule"):
+            duracion = timedelta(minutes=doc["duracionMinutos"])
+            for comienzo in expandir_ocurrencias(
+                inicio, doc["duracionMinutos"], doc["rrule"],
+                doc.get("fechasExcluidas", []), desde, hasta, solapamiento=True
+            ):
+                heapq.heappush(pendientes, (comienzo, comienzo + duracion))
+        else:
+            yield inicio, doc["horaFin"]
+
+    while pendientes:
+        yield heapq.heappop(pendientes)
+
+
+def fusionar_intervalos(intervalos: Iterable[Intervalo], desde: datetime, hasta: datetime) -> List[Intervalo]:
+    """Barrido sobre intervalos ordenados por inicio: recorta a [desde, hasta) y fusiona solapes."""
+    ocupados: List[Intervalo] = []
+    for inicio, fin in intervalos:
+        inicio, fin = max(inicio, desde), min(fin, hasta)
+        if inicio >= fin:
+            continue
+        if ocupados and inicio <= ocupados[-1][1]:
+            if fin > ocupados[-1][1]:
+                ocupados[-1] = (ocupados[-1][0], fin)
+        else:
+            ocupados.append((inicio, fin))
+    return ocupados
+
+
+def huecos_libres(
+    ocupados: List[Intervalo], desde: datetime, hasta: datetime, duracion_minima: timedelta
+) -> List[Intervalo]:
+    """Devuelve los huecos entre bloques ocupados que duran al menos duracion_minima."""
+    libres: List[Intervalo] = []
+    cursor = desde
+    for inicio, fin in ocupados:
+        if inicio - cursor >= duracion_minima:
+            libres.append((cursor, inicio))
+        cursor = max(cursor, fin)
+    if hasta - cursor >= duracion_minima:
+        libres.append((cursor, hasta))
+    return libres
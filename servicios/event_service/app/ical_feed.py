@@ -0,0 +1,152 @@
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+from uuid import UUID
+
+from .model.event_model import EventInDB
+
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "256"))
+FEED_FRAGMENT_CACHE_SIZE = int(os.getenv("FEED_FRAGMENT_CACHE_SIZE", "20000"))
+
+FeedKey = Tuple[UUID, bool]
+
+
+def _escape(text: str) -> str:
+    """Escapa un valor de texto según RFC 5545 (3.3.11)."""
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def _param(text: str) -> str:
+    """Valor de parámetro entrecomillado: no admite comillas dobles ni saltos de línea."""
+    return text.replace('"', "'").replace("\r", " ").replace("\n", " ")
+
+
+def _fold(line: str) -> str:
+    """Pliega una línea de contenido en trozos de 75 octetos como exige RFC 5545."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line + "\r\n"
+    partes, inicio, limite = [], 0, 75
+    while inicio < len(raw):
+        fin = min(inicio + limite, len(raw))
+        # No cortar un carácter UTF-8 multibyte por la mitad
+        while fin < len(raw) and (raw[fin] & 0xC0) == 0x80:
+            fin -= 1
+        partes.append(raw[inicio:fin].decode("utf-8"))
+        inicio, limite = fin, 74  # las continuaciones empiezan con un espacio
+    return "\r\n ".join(partes) + "\r\n"
+
+
+def _fecha(dt: datetime) -> str:
+    return dt.strftime("%Y%m%dT%H%M%S")
+
+
+def render_vevent(event: EventInDB) -> str:
+    """Genera el bloque VEVENT de un evento (hora local flotante, como se guarda en MongoDB)."""
+    lineas = [
+        "BEGIN:VEVENT",
+        f"UID:{event.id}@kalendas",
+        f"DTSTAMP:{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{_fecha(event.hora_comienzo)}",
+        f"DURATION:PT{event.duracion_minutos}M",
+        f"SUMMARY:{_escape(event.titulo)}",
+        f"LOCATION:{_escape(event.lugar)}",
+        f'ORGANIZER;CN="{_param(event.organizador)}":mailto:{event.email_organizador}',
+    ]
+    if event.rrule:
+        lineas.append(f"RRULE:{event.rrule}")
+    if event.fechas_excluidas:
+        lineas.append("EXDATE:" + ",".join(_fecha(f) for f in event.fechas_excluidas))
+    mapa = event.contenido_adjunto.mapa
+    if mapa:
+        lineas.append(f"GEO:{mapa.latitud};{mapa.longitud}")
+    lineas.append("END:VEVENT")
+    return "".join(_fold(linea) for linea in lineas)
+
+
+@dataclass
+class Feed:
+    body: bytes
+    etag: str
+    last_modified: datetime
+
+
+class FeedCache:
+    """
+    Caché en proceso de los feeds iCalendar.
+
+    Guarda dos niveles: el VEVENT ya renderizado de cada evento y el feed completo
+    de cada (calendario, incluir_subcalendarios). Una escritura de evento solo
+    invalida su fragmento y los feeds de su ascendencia, así que al regenerar un
+    feed únicamente se renderizan los eventos que han cambiado.
+    """
+
+    def __init__(self, max_feeds: int = FEED_CACHE_SIZE, max_fragments: int = FEED_FRAGMENT_CACHE_SIZE):
+        self.max_feeds = max_feeds
+        self.max_fragments = max_fragments
+        self.feeds: "OrderedDict[FeedKey, Feed]" = OrderedDict()
+        self.fragments: "OrderedDict[UUID, str]" = OrderedDict()
+
+    def get_feed(self, key: FeedKey) -> Optional[Feed]:
+        feed = self.feeds.get(key)
+        if feed:
+            self.feeds.move_to_end(key)
+        return feed
+
+    def store_feed(self, key: FeedKey, body: bytes) -> Feed:
+        feed = Feed(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+        )
+        previous = self.feeds.get(key)
+        if previous and previous.etag == feed.etag:
+            # Mismo contenido: se conserva la fecha para que If-Modified-Since siga valiendo
+            feed.last_modified = previous.last_modified
+        self.feeds[key] = feed
+        self.feeds.move_to_end(key)
+        while len(self.feeds) > self.max_feeds:
+            self.feeds.popitem(last=False)
+        return feed
+
+    def get_fragment(self, event_id: UUID) -> Optional[str]:
+        fragment = self.fragments.get(event_id)
+        if fragment is not None:
+            self.fragments.move_to_end(event_id)
+        return fragment
+
+    def store_fragment(self, event_id: UUID, fragment: str):
+        self.fragments[event_id] = fragment
+        self.fragments.move_to_end(event_id)
+        while len(self.fragments) > self.max_fragments:
+            self.fragments.popitem(last=False)
+
+    def invalidate_event(self, event_id: UUID, ancestros: Iterable[UUID]):
+        """Un evento ha cambiado: se descarta su VEVENT y los feeds que lo contienen."""
+        self.fragments.pop(event_id, None)
+        ancestros = list(ancestros)
+        if ancestros:
+            self.feeds.pop((ancestros[0], False), None)
+        for calendar_id in ancestros:
+            self.feeds.pop((calendar_id, True), None)
+
+    def clear_feeds(self):
+        """Cambios de estructura (p. ej. reparentar un calendario): se descartan todos los feeds."""
+        self.feeds.clear()
+
+
+def build_calendar(nombre: str, fragments: Iterable[str]) -> bytes:
+    cabecera = "".join(_fold(linea) for linea in [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Kalendas//Event Service//ES",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape(nombre)}",
+    ])
+    return (cabecera + "".join(fragments) + "END:VCALENDAR\r\n").encode("utf-8")
@@ -1,11 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from .router import events
+from . import database
+from .dependencies import get_event_service
+from .service.eventService import ARCHIVE_HORIZON_DAYS, ARCHIVE_INTERVAL_SECONDS
+
+
+async def archivar_periodicamente():
+    """Job en segundo plano: mueve al archivo los eventos antiguos cada ARCHIVE_INTERVAL_SECONDS."""
+    event_service = get_event_service()
+    while True:
+        try:
+            movidos = await run_in_threadpool(event_service.archive_past_events)
+            if movidos:
+                print(f"🗄️ {movidos} eventos movidos al archivo")
+        except Exception as e:
+            print(f"⚠️ Error archivando eventos: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Aseguramos los índices de MongoDB al arrancar el servicio.
+    database.ensure_indexes()
+    archivado = asyncio.create_task(archivar_periodicamente()) if ARCHIVE_HORIZON_DAYS > 0 else None
+    yield
+    if archivado:
+        archivado.cancel()
 
 
 app = FastAPI(
     title="API de Kalendas",
     description="API para la gestión de calendarios y eventos.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Incluimos el router de eventos en la aplicación principal.
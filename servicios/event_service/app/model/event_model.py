@@ -1,11 +1,13 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, field_validator
 from typing import List, Optional
 from datetime import datetime
 from uuid import UUID 
 
+from ..recurrence_utils import validar_regla
+
 class Mapa(BaseModel):
-    latitud: float
-    longitud: float
+    latitud: float = Field(..., ge=-90, le=90)
+    longitud: float = Field(..., ge=-180, le=180)
 
 class ContenidoAdjunto(BaseModel):
     imagenes: List[str] = []
@@ -23,6 +25,19 @@ class EventBase(BaseModel):
     organizador: str = Field(..., example="Concejalía de Cultura")
     email_organizador: str = Field(..., alias="emailOrganizador", example="usuario@gmail.com")
     contenido_adjunto: ContenidoAdjunto = Field(default_factory=ContenidoAdjunto, alias="contenidoAdjunto")
+    # Recurrencia (RFC 5545): se guarda solo la regla y las excepciones, nunca cada ocurrencia
+    rrule: Optional[str] = Field(default=None, example="FREQ=WEEKLY;BYDAY=MO;COUNT=10")
+    fechas_excluidas: List[datetime] = Field(default=[], alias="fechasExcluidas")
+
+    @field_validator("rrule")
+    @classmethod
+    def _validar_rrule(cls, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return value
+        try:
+            return validar_regla(value)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Regla de recurrencia no válida: {e}")
 
 # Modelo para CREAR un evento
 class EventCreate(EventBase):
@@ -31,8 +46,80 @@ class EventCreate(EventBase):
 # Modelo para RESPUESTA (lo que devolvemos desde la API)
 class EventInDB(EventBase):
     id: UUID = Field(..., alias="_id")
+    # Campo derivado (horaComienzo + duracionMinutos), lo mantiene el servicio.
+    # En eventos recurrentes es el fin de la última ocurrencia de la serie.
+    hora_fin: Optional[datetime] = Field(default=None, alias="horaFin")
+    # [idCalendario, padre, ..., raíz]: permite consultar un subárbol sin llamar al servicio de calendarios
+    ancestros_calendario: List[UUID] = Field(default=[], alias="ancestrosCalendario")
+    # Número de secuencia de la última modificación (sincronización incremental)
+    secuencia: Optional[int] = None
 
     model_config = ConfigDict(
         populate_by_name=True,
         json_encoders={datetime: lambda dt: dt.isoformat()}
-    )
\ No newline at end of file
+    )
+
+
+# Modelo para propagar la ascendencia de un calendario a sus eventos
+class AncestryUpdate(BaseModel):
+    ancestros: List[UUID]
+
+
+# Modelos para la consulta de disponibilidad (free/busy)
+class FreeBusyRequest(BaseModel):
+    ids_calendario: List[UUID] = Field(..., min_length=1, alias="idsCalendario")
+    incluir_subcalendarios: bool = Field(default=False, alias="incluirSubcalendarios")
+    desde: datetime = Field(..., example="2025-06-02T08:00:00")
+    hasta: datetime = Field(..., example="2025-06-06T20:00:00")
+    duracion_minima_minutos: int = Field(default=30, gt=0, alias="duracionMinimaMinutos")
+
+    model_config = ConfigDict(populate_by_name=True)
+
+class Intervalo(BaseModel):
+    inicio: datetime
+    fin: datetime
+
+class FreeBusyResponse(BaseModel):
+    ocupado: List[Intervalo]
+    libre: List[Intervalo]
+
+
+
+# Modelos para las vistas agregadas de calendario (día / semana / mes)
+class BucketEvent(BaseModel):
+    id: UUID = Field(..., alias="_id")
+    titulo: str
+    hora_comienzo: datetime = Field(..., alias="horaComienzo")
+
+    model_config = ConfigDict(populate_by_name=True)
+
+class Bucket(BaseModel):
+    inicio: datetime
+    total: int
+    eventos: List[BucketEvent]
+
+
+
+# Modelos para la ingesta masiva
+class BulkItemResult(BaseModel):
+    indice: int
+    id: Optional[UUID] = None
+    error: Optional[str] = None
+
+class BulkResult(BaseModel):
+    insertados: int
+    fallidos: int
+    resultados: List[BulkItemResult]
+
+
+
+# Modelo para la sincronización incremental (GET /events/changes)
+class EventChanges(BaseModel):
+    cambios: List[EventInDB]
+    eliminados: List[UUID]
+    # Eventos que han pasado al archivo: ya no están en caliente, pero siguen existiendo
+    archivados: List[UUID] = []
+    token: str
+    hay_mas: bool = Field(..., alias="hayMas")
+
+    model_config = ConfigDict(populate_by_name=True)
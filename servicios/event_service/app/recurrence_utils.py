@@ -0,0 +1,180 @@
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from dateutil.rrule import rrulestr
+
+# Fin "abierto" para series sin COUNT ni UNTIL. Se guarda en horaFin para que
+# las consultas por intervalo sigan usando el índice sin casos especiales.
+FIN_INDEFINIDO = datetime(9999, 12, 31)
+
+# Límite de ocurrencias generadas por evento y consulta (protege ventanas enormes)
+MAX_OCURRENCIAS = int(os.getenv("RECURRENCE_MAX_OCCURRENCES", "1000"))
+CACHE_SIZE = int(os.getenv("RECURRENCE_CACHE_SIZE", "2048"))
+# COUNT máximo de una serie: el fin de una serie con COUNT se calcula recorriéndola
+MAX_COUNT = int(os.getenv("RECURRENCE_MAX_COUNT", "5000"))
+# Ocurrencias por día que admite una serie sin COUNT (BYHOUR x BYMINUTE x BYSECOND)
+MAX_POR_DIA = 24
+
+SUBDIARIAS = {"HOURLY", "MINUTELY", "SECONDLY"}
+# Periodo en días de las frecuencias en las que se puede adelantar DTSTART sin cambiar la serie
+DIAS_POR_PERIODO = {"DAILY": 1, "WEEKLY": 7}
+
+
+def _partes(rrule: str) -> Dict[str, str]:
+    """Propiedades de la regla (FREQ, COUNT, UNTIL...) en mayúsculas."""
+    regla = rrule.strip()
+    if regla.upper().startswith("RRULE:"):
+        regla = regla[len("RRULE:"):]
+    partes = {}
+    for parte in regla.split(";"):
+        clave, _, valor = parte.partition("=")
+        if clave:
+            partes[clave.strip().upper()] = valor.strip()
+    return partes
+
+
+def normalizar_regla(rrule: str) -> str:
+    """
+    Quita la 'Z' de UNTIL: las fechas de los eventos se guardan sin zona horaria y
+    dateutil no admite un UNTIL en UTC con un comienzo sin zona.
+    """
+    until = _partes(rrule).get("UNTIL", "")
+    if not until.upper().endswith("Z"):
+        return rrule
+    return ";".join(
+        f"UNTIL={until[:-1]}" if parte.strip().upper().startswith("UNTIL=") else parte
+        for parte in rrule.split(";")
+    )
+
+
+def _until(rrule: str) -> Optional[datetime]:
+    valor = _partes(rrule).get("UNTIL")
+    if not valor:
+        return None
+    valor = valor.upper().rstrip("Z")
+    return datetime.strptime(valor, "%Y%m%dT%H%M%S" if "T" in valor else "%Y%m%d")
+
+
+def _por_dia(partes: Dict[str, str]) -> int:
+    """Ocurrencias que generan BYHOUR, BYMINUTE y BYSECOND en un mismo día."""
+    total = 1
+    for clave in ("BYHOUR", "BYMINUTE", "BYSECOND"):
+        if partes.get(clave):
+            total *= len(partes[clave].split(","))
+    return total
+
+
+def validar_regla(rrule: str) -> str:
+    """
+    Comprueba que la regla RRULE (RFC 5545) es interpretable y que su COUNT no pasa de
+    MAX_COUNT. Devuelve la regla normalizada (UNTIL sin zona). Lanza ValueError si no vale.
+
+    Las series con más de una ocurrencia al día (FREQ horaria o menor, o BYHOUR/BYMINUTE/
+    BYSECOND que pasen de MAX_POR_DIA) necesitan COUNT: expandirlas obliga a recorrerlas desde
+    DTSTART y, sin un límite, una serie antigua costaría millones de pasos por consulta.
+    """
+    rrule = normalizar_regla(rrule)
+    partes = _partes(rrule)
+    count = partes.get("COUNT")
+    if count is not None:
+        if not count.isdigit() or int(count) < 1:
+            raise ValueError(f"COUNT no válido: {count}")
+        if int(count) > MAX_COUNT:
+            raise ValueError(f"COUNT no puede pasar de {MAX_COUNT}")
+    elif partes.get("FREQ", "").upper() in SUBDIARIAS or _por_dia(partes) > MAX_POR_DIA:
+        raise ValueError("Las series con varias ocurrencias al día necesitan COUNT")
+    _until(rrule)
+    rrulestr(rrule, dtstart=datetime(2000, 1, 1))
+    return rrule
+
+
+def fin_de_serie(hora_comienzo: datetime, duracion_minutos: int, rrule: str) -> datetime:
+    """
+    Devuelve el fin de la última ocurrencia de la serie, o FIN_INDEFINIDO si la
+    regla no tiene COUNT ni UNTIL.
+
+    Con UNTIL el fin es UNTIL + duración (cota superior: la última ocurrencia puede ser
+    anterior), sin recorrer la serie; con COUNT se recorren como mucho MAX_COUNT ocurrencias.
+    """
+    rrule = normalizar_regla(rrule)
+    until = _until(rrule)
+    if until is not None:
+        return max(until, hora_comienzo) + timedelta(minutes=duracion_minutos)
+    if "COUNT" not in _partes(rrule):
+        return FIN_INDEFINIDO
+
+    ultima = hora_comienzo
+    for ultima in islice(rrulestr(rrule, dtstart=hora_comienzo), MAX_COUNT):
+        pass
+    return ultima + timedelta(minutes=duracion_minutos)
+
+
+def _adelantar_comienzo(rrule: str, hora_comienzo: datetime, desde: datetime) -> datetime:
+    """
+    DTSTART equivalente más cercano a 'desde' para series diarias o semanales sin COUNT:
+    se adelanta un número entero de periodos (INTERVAL incluido), dejando uno de margen,
+    así que las ocurrencias a partir de 'desde' son las mismas y no se recorre la historia.
+    """
+    partes = _partes(rrule)
+    dias = DIAS_POR_PERIODO.get(partes.get("FREQ", "").upper())
+    if dias is None or "COUNT" in partes or desde <= hora_comienzo:
+        return hora_comienzo
+    intervalo = partes.get("INTERVAL", "1")
+    periodo = timedelta(days=dias * (int(intervalo) if intervalo.isdigit() and int(intervalo) > 0 else 1))
+    periodos = (desde - hora_comienzo) // periodo
+    if periodos < 2:
+        return hora_comienzo
+    return hora_comienzo + (periodos - 1) * periodo
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _comienzos_en_ventana(
+    rrule: str,
+    hora_comienzo: datetime,
+    fechas_excluidas: Tuple[datetime, ...],
+    desde: datetime,
+    hasta: datetime,
+) -> Tuple[datetime, ...]:
+    """Comienzos de ocurrencia en [desde, hasta], cacheados por regla y ventana."""
+    excluidas = set(fechas_excluidas)
+    comienzos = []
+    rrule = normalizar_regla(rrule)
+    inicio = _adelantar_comienzo(rrule, hora_comienzo, desde)
+    for comienzo in rrulestr(rrule, dtstart=inicio).xafter(desde, inc=True):
+        if comienzo > hasta or len(comienzos) >= MAX_OCURRENCIAS:
+            break
+        if comienzo not in excluidas:
+            comienzos.append(comienzo)
+    return tuple(comienzos)
+
+
+def expandir_ocurrencias(
+    hora_comienzo: datetime,
+    duracion_minutos: int,
+    rrule: str,
+    fechas_excluidas: List[datetime],
+    desde: Optional[datetime],
+    hasta: Optional[datetime],
+    solapamiento: bool = False,
+) -> List[datetime]:
+    """
+    Expande de forma perezosa una serie recurrente dentro de la ventana pedida.
+
+    Con solapamiento=False devuelve las ocurrencias que empiezan en [desde, hasta];
+    con solapamiento=True, las que ocupan algún instante de [desde, hasta).
+    """
+    duracion = timedelta(minutes=duracion_minutos)
+    desde = desde or hora_comienzo
+    hasta = hasta or FIN_INDEFINIDO
+
+    if solapamiento:
+        # Una ocurrencia que empezó hasta 'duracion' antes de la ventana sigue en curso
+        comienzos = _comienzos_en_ventana(
+            rrule, hora_comienzo, tuple(fechas_excluidas), desde - duracion, hasta
+        )
+        return [c for c in comienzos if c < hasta and c + duracion > desde]
+
+    return list(_comienzos_en_ventana(rrule, hora_comienzo, tuple(fechas_excluidas), desde, hasta))
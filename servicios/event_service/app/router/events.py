@@ -1,11 +1,21 @@
-from fastapi import APIRouter, Body, Response, status, HTTPException, Query, Depends
+from fastapi import APIRouter, Body, Response, status, HTTPException, Query, Depends, Request, Path, BackgroundTasks
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.datastructures import UploadFile
 from typing import List, Annotated, Optional
 from uuid import UUID
 from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
 
-from ..service.eventService import EventService 
+from ..service.eventService import EventService, BULK_CHUNK_SIZE, BULK_MAX_ITEMS
 from ..dependencies import get_event_service 
-from ..model.event_model import EventCreate, EventInDB
+from ..model.event_model import (
+    EventCreate, EventInDB, FreeBusyRequest, FreeBusyResponse, AncestryUpdate, Bucket, BulkResult, EventChanges
+)
+from ..sync_utils import TokenCaducado
+from ..blob_store import ATTACHMENT_MAX_BYTES, ATTACHMENT_MAX_FILES, DIGEST_PATTERN
+
+# Tamaño máximo del cuerpo de una subida de adjuntos (todos los ficheros juntos)
+ATTACHMENT_REQUEST_MAX_BYTES = ATTACHMENT_MAX_BYTES * ATTACHMENT_MAX_FILES
 
 router = APIRouter(
     prefix="/events",
@@ -57,6 +67,40 @@ async def create_event(
     return await event_service.create_event(event) 
 
 
+# 1.1 POST /events/bulk : Crear muchos eventos en una sola petición
+@router.post(
+    "/bulk",
+    response_model=BulkResult,
+    response_description="Resultado de la inserción de cada evento del lote",
+)
+async def create_events_bulk(
+    events: Annotated[List[dict], Body(
+        examples=[[{
+            "idCalendario": "f47ac10b-58cc-4372-a567-0e02b2c3d479",
+            "titulo": "Concierto de Verano",
+            "horaComienzo": "2025-08-15T21:30:00",
+            "duracionMinutos": 150,
+            "lugar": "Parque de la Ciudad",
+            "organizador": "Concejalía de Cultura",
+            "emailOrganizador": "cultura@ejemplo.com"
+        }]]
+    )],
+    event_service: EventServiceDep,
+    chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=5000, description="Eventos por cada insert_many"),
+):
+    """
+    Valida e inserta un lote de eventos. Los elementos no válidos o que fallan al insertarse
+    se informan por posición (indice) sin detener el resto del lote.
+    """
+    if len(events) > BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=f"El lote supera el máximo de {BULK_MAX_ITEMS} eventos"
+        )
+
+    return await event_service.create_events_bulk(events, chunk_size)
+
+
 # 2. GET /events : Obtener una lista de todos los eventos (con filtros opcionales)
 @router.get(
     "/",
@@ -80,14 +124,138 @@ async def list_events(
     titulo: Optional[str] = Query(None, description="Filtrar por título"),
     duration_minima: Optional[int] = Query(None, description="Filtrar por duración minima en minutos"),
     duration_maxima: Optional[int] = Query(None, description="Filtrar por duración maxima en minutos"),
+    overlaps: bool = Query(
+        False,
+        description="Si es true, devuelve los eventos que se solapan con [fecha_inicio, fecha_fin) "
+                    "en lugar de los que empiezan dentro del rango"
+    ),
+    include_archived: bool = Query(False, description="Incluir también los eventos archivados (terminados hace tiempo)"),
 ):
     """
     Devuelve una lista de eventos filtrados. La lógica de construcción del filtro se delega al Servicio.
+    Si se indica un rango de fechas, los eventos recurrentes se devuelven expandidos en sus ocurrencias.
     """
     # Llama al Servicio con los parámetros de la Query.
     return await event_service.list_events(
-        fecha_inicio, fecha_fin, lugar, organizador, titulo, duration_minima, duration_maxima
+        fecha_inicio, fecha_fin, lugar, organizador, titulo, duration_minima, duration_maxima, overlaps,
+        include_archived
+    )
+
+
+# 2.1 GET /events/export : Exportación masiva en streaming (NDJSON o CSV)
+# (declarada antes de /{id} para que esa ruta no capture "export")
+@router.get(
+    "/export",
+    response_description="Exportar eventos en streaming (NDJSON o CSV)",
+)
+async def export_events(
+    event_service: EventServiceDep,
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="Formato de salida: ndjson o csv"),
+    fecha_inicio: Optional[datetime] = Query(None, description="Fecha de inicio del rango (formato ISO: YYYY-MM-DDTHH:MM:SS)"),
+    fecha_fin: Optional[datetime] = Query(None, description="Fecha de fin del rango (formato ISO: YYYY-MM-DDTHH:MM:SS)"),
+    lugar: Optional[str] = Query(None, description="Filtrar por lugar"),
+    organizador: Optional[str] = Query(None, description="Filtrar por organizador"),
+    titulo: Optional[str] = Query(None, description="Filtrar por título"),
+    duration_minima: Optional[int] = Query(None, description="Filtrar por duración minima en minutos"),
+    duration_maxima: Optional[int] = Query(None, description="Filtrar por duración maxima en minutos"),
+    overlaps: bool = Query(False, description="Interpretar [fecha_inicio, fecha_fin) como solapamiento"),
+    after_hora: Optional[datetime] = Query(None, description="Reanudar tras este horaComienzo (último recibido)"),
+    after_id: Optional[UUID] = Query(None, description="Reanudar tras este _id (último recibido, junto con after_hora)"),
+    include_archived: bool = Query(False, description="Incluir también los eventos archivados (terminados hace tiempo)"),
+):
+    """
+    Vuelca los eventos que cumplen los mismos filtros que GET /events/ directamente desde
+    un cursor por lotes, sin cargar el resultado en memoria. El orden es (horaComienzo, _id),
+    así que una exportación interrumpida se reanuda pasando el último par recibido.
+    """
+    if after_id is not None and after_hora is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="after_id requiere after_hora")
+
+    filtro = event_service.build_filter(
+        fecha_inicio, fecha_fin, lugar, organizador, titulo, duration_minima, duration_maxima, overlaps
     )
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    # El generador es síncrono: Starlette lo consume en el threadpool sin bloquear el event loop.
+    return StreamingResponse(
+        event_service.export_events(filtro, formato, after_hora, after_id, include_archived),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="eventos.{formato}"'},
+    )
+
+
+# 2.2 GET /events/near : Eventos cerca de un punto
+@router.get(
+    "/near",
+    response_model=List[EventInDB],
+    response_description="Listar los eventos a menos de 'radius' metros de un punto",
+)
+async def list_events_near(
+    event_service: EventServiceDep,
+    lat: float = Query(..., ge=-90, le=90, description="Latitud del punto", example=36.7213),
+    lon: float = Query(..., ge=-180, le=180, description="Longitud del punto", example=-4.4214),
+    radius: float = Query(5000, gt=0, le=100000, description="Radio de búsqueda en metros"),
+    fecha_inicio: Optional[datetime] = Query(None, description="Fecha de inicio del rango (formato ISO: YYYY-MM-DDTHH:MM:SS)"),
+    fecha_fin: Optional[datetime] = Query(None, description="Fecha de fin del rango (formato ISO: YYYY-MM-DDTHH:MM:SS)"),
+    overlaps: bool = Query(False, description="Interpretar [fecha_inicio, fecha_fin) como solapamiento"),
+    include_archived: bool = Query(False, description="Incluir también los eventos archivados (terminados hace tiempo)"),
+):
+    """
+    Devuelve los eventos con ubicación dentro del radio indicado, usando el índice 2dsphere.
+    """
+    return await event_service.list_events_near(lat, lon, radius, fecha_inicio, fecha_fin, overlaps, include_archived)
+
+
+# 2.3 GET /events/within : Eventos dentro de un rectángulo (viewport del mapa)
+@router.get(
+    "/within",
+    response_model=List[EventInDB],
+    response_description="Listar los eventos dentro de un rectángulo de coordenadas",
+)
+async def list_events_within(
+    event_service: EventServiceDep,
+    sur: float = Query(..., ge=-90, le=90, description="Latitud del borde sur"),
+    oeste: float = Query(..., ge=-180, le=180, description="Longitud del borde oeste"),
+    norte: float = Query(..., ge=-90, le=90, description="Latitud del borde norte"),
+    este: float = Query(..., ge=-180, le=180, description="Longitud del borde este"),
+    fecha_inicio: Optional[datetime] = Query(None, description="Fecha de inicio del rango (formato ISO: YYYY-MM-DDTHH:MM:SS)"),
+    fecha_fin: Optional[datetime] = Query(None, description="Fecha de fin del rango (formato ISO: YYYY-MM-DDTHH:MM:SS)"),
+    overlaps: bool = Query(False, description="Interpretar [fecha_inicio, fecha_fin) como solapamiento"),
+    include_archived: bool = Query(False, description="Incluir también los eventos archivados (terminados hace tiempo)"),
+):
+    """
+    Devuelve los eventos cuya ubicación cae dentro del rectángulo visible del mapa.
+    """
+    if sur >= norte or oeste >= este:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Rectángulo no válido: se espera sur < norte y oeste < este")
+
+    return await event_service.list_events_in_box(
+        sur, oeste, norte, este, fecha_inicio, fecha_fin, overlaps, include_archived
+    )
+
+
+# 2.4 GET /events/changes : Sincronización incremental
+@router.get(
+    "/changes",
+    response_model=EventChanges,
+    response_description="Eventos modificados y eliminados desde el token indicado",
+)
+async def get_event_changes(
+    event_service: EventServiceDep,
+    since: Optional[str] = Query(None, description="Token devuelto por la llamada anterior (vacío = sincronización completa)"),
+    limit: int = Query(500, ge=1, le=5000, description="Número máximo de cambios por página"),
+):
+    """
+    Devuelve solo lo que ha cambiado desde el token: eventos creados o modificados y los IDs
+    de los eliminados y de los que han pasado al archivo (se consultan con include_archived).
+    Si hayMas es true, hay que volver a llamar con el nuevo token.
+    Responde 410 si el token es más antiguo que la retención de borrados.
+    """
+    try:
+        return await event_service.get_changes(since, limit)
+    except TokenCaducado:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Token caducado: es necesaria una sincronización completa")
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Token de sincronización no válido")
 
 
 # 3. GET /events/{id} : Obtener un evento específico por su ID
@@ -96,11 +264,15 @@ async def list_events(
     response_model=EventInDB,
     response_description="Obtener un evento por su ID",
 )
-async def get_event(id: UUID, event_service: EventServiceDep):
+async def get_event(
+    id: UUID,
+    event_service: EventServiceDep,
+    include_archived: bool = Query(False, description="Incluir también los eventos archivados (terminados hace tiempo)"),
+):
     """
     Busca un evento por su ID. Devuelve 404 si no lo encuentra.
     """
-    event = await event_service.get_event_by_id(id) # Llama al Servicio
+    event = await event_service.get_event_by_id(id, include_archived) # Llama al Servicio
     if event:
         return event
 
@@ -157,12 +329,13 @@ async def delete_event(id: UUID, event_service: EventServiceDep):
 )
 async def get_events_from_calendar(
     calendar_id: UUID,
-    event_service: EventServiceDep
+    event_service: EventServiceDep,
+    include_archived: bool = Query(False, description="Incluir también los eventos archivados (terminados hace tiempo)"),
 ):
     """
     Devuelve todos los eventos del calendario indicado y de sus subcalendarios.
     """
-    events = await event_service.get_events_by_calendar_and_subcalendars(calendar_id)
+    events = await event_service.get_events_by_calendar_and_subcalendars(calendar_id, include_archived)
     if not events:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -170,3 +343,228 @@ async def get_events_from_calendar(
         )
     return events
 
+
+# 7. POST /events/freebusy : Calcular disponibilidad de un conjunto de calendarios
+@router.post(
+    "/freebusy",
+    response_model=FreeBusyResponse,
+    response_description="Bloques ocupados y huecos libres de los calendarios indicados",
+)
+async def get_freebusy(
+    request: Annotated[FreeBusyRequest, Body(
+        examples=[{
+            "idsCalendario": ["f47ac10b-58cc-4372-a567-0e02b2c3d479"],
+            "incluirSubcalendarios": True,
+            "desde": "2025-06-02T08:00:00",
+            "hasta": "2025-06-06T20:00:00",
+            "duracionMinimaMinutos": 60
+        }]
+    )],
+    event_service: EventServiceDep
+):
+    """
+    Devuelve los intervalos ocupados (fusionados) y los huecos libres de al menos
+    duracionMinimaMinutos dentro de [desde, hasta).
+    """
+    if request.hasta <= request.desde:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'hasta' debe ser posterior a 'desde'")
+
+    return await event_service.get_freebusy(request)
+
+
+# 8. PUT /events/calendar/{calendar_id}/ancestry : Propagar el cambio de padre de un calendario
+@router.put(
+    "/calendar/{calendar_id}/ancestry",
+    response_description="Actualizar la ascendencia de los eventos del subárbol de un calendario",
+)
+async def update_calendar_ancestry(
+    calendar_id: UUID,
+    ancestry: AncestryUpdate,
+    event_service: EventServiceDep
+):
+    """
+    Uso interno (lo llama el servicio de calendarios): el calendario ha cambiado de padre
+    y 'ancestros' es su nueva lista de antecesores, del padre a la raíz.
+    """
+    updated = await event_service.update_calendar_ancestry(calendar_id, ancestry.ancestros)
+    return {"eventos_actualizados": updated}
+
+
+# 9. DELETE /events/calendar/{calendar_id}/ancestry : Propagar la eliminación de un calendario
+@router.delete(
+    "/calendar/{calendar_id}/ancestry",
+    response_description="Quitar un calendario eliminado de la ascendencia de los eventos",
+)
+async def detach_calendar(calendar_id: UUID, event_service: EventServiceDep):
+    """
+    Uso interno (lo llama el servicio de calendarios): el calendario se ha eliminado y
+    deja de contar como ancestro de los eventos de su subárbol.
+    """
+    updated = await event_service.detach_calendar(calendar_id)
+    return {"eventos_actualizados": updated}
+
+
+# 10. GET /events/calendar/{calendar_id}/feed.ics : Suscripción iCalendar (webcal) a un calendario
+@router.get(
+    "/calendar/{calendar_id}/feed.ics",
+    response_class=Response,
+    response_description="Feed iCalendar del calendario (con caché y peticiones condicionales)",
+)
+async def get_calendar_feed(
+    calendar_id: UUID,
+    request: Request,
+    event_service: EventServiceDep,
+    incluir_subcalendarios: bool = Query(True, description="Incluir los eventos de los subcalendarios"),
+):
+    """
+    Devuelve el calendario en formato .ics para clientes como Google Calendar u Outlook.
+    Responde 304 si el cliente ya tiene la versión actual (If-None-Match / If-Modified-Since).
+    """
+    feed = await event_service.get_calendar_feed(calendar_id, incluir_subcalendarios)
+    headers = {
+        "ETag": feed.etag,
+        "Last-Modified": format_datetime(feed.last_modified, usegmt=True),
+        "Cache-Control": "public, max-age=300",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if feed.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if feed.last_modified <= parsedate_to_datetime(request.headers["if-modified-since"]):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        except (TypeError, ValueError):
+            pass  # Cabecera mal formada: se ignora y se devuelve el feed completo
+
+    return Response(content=feed.body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+
+# 11. GET /events/calendar/{calendar_id}/buckets : Resumen por día / semana / mes para las vistas de calendario
+@router.get(
+    "/calendar/{calendar_id}/buckets",
+    response_model=List[Bucket],
+    response_description="Número de eventos y primeros títulos por día, semana o mes",
+)
+async def get_calendar_buckets(
+    calendar_id: UUID,
+    event_service: EventServiceDep,
+    desde: datetime = Query(..., alias="from", description="Inicio del rango (incluido)", example="2025-11-01T00:00:00"),
+    hasta: datetime = Query(..., alias="to", description="Fin del rango (excluido)", example="2025-12-01T00:00:00"),
+    granularity: str = Query("day", pattern="^(day|week|month)$", description="Agrupar por day, week o month"),
+    top: int = Query(3, ge=1, le=20, description="Número de títulos devueltos por grupo"),
+):
+    """
+    Devuelve, para el calendario y sus subcalendarios, un grupo por cada día (o semana/mes)
+    con eventos: el total y los primeros títulos. Pensado para pintar la vista mensual
+    sin descargar todos los eventos.
+    """
+    if hasta <= desde:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'to' debe ser posterior a 'from'")
+
+    return await event_service.get_calendar_buckets(calendar_id, granularity, desde, hasta, top)
+
+
+# Los adjuntos nunca cambian (la URL es el hash del contenido): se pueden cachear indefinidamente
+ATTACHMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _attachment_response(request: Request, ruta: str, digest: str, media_type: str, filename: Optional[str] = None):
+    """Descarga con soporte de Range (lo gestiona FileResponse) y validación por ETag."""
+    etag = f'"{digest}"'
+    headers = {"Cache-Control": ATTACHMENT_CACHE_CONTROL, "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FileResponse(
+        ruta, media_type=media_type, headers=headers, filename=filename, content_disposition_type="inline"
+    )
+
+
+# 12. POST /events/{id}/attachments : Subir imágenes y archivos de un evento
+@router.post(
+    "/{id}/attachments",
+    response_model=EventInDB,
+    response_description="Evento con las URLs de los nuevos adjuntos",
+)
+async def upload_attachments(
+    id: UUID,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    event_service: EventServiceDep,
+):
+    """
+    Recibe un multipart con los campos 'imagenes' y 'archivos'. Cada fichero se copia
+    por trozos al almacén de adjuntos y se deduplica por su SHA-256. Las miniaturas de
+    las imágenes se generan en segundo plano después de responder.
+    """
+    # El formulario se lee a mano para poder rechazar por Content-Length antes de recibir
+    # el cuerpo. Starlette vuelca a disco los ficheros de más de 1 MB mientras lo analiza,
+    # así que el límite se aplica también trozo a trozo (cuerpos sin Content-Length o que
+    # mienten): nunca se vuelca más de ATTACHMENT_REQUEST_MAX_BYTES.
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > ATTACHMENT_REQUEST_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="Petición demasiado grande")
+
+    recibidos = 0
+
+    async def receive_limitado():
+        nonlocal recibidos
+        mensaje = await request.receive()
+        if mensaje["type"] == "http.request":
+            recibidos += len(mensaje.get("body", b""))
+            if recibidos > ATTACHMENT_REQUEST_MAX_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="Petición demasiado grande")
+        return mensaje
+
+    form = await Request(request.scope, receive_limitado).form(max_files=ATTACHMENT_MAX_FILES)
+    try:
+        imagenes = [f for f in form.getlist("imagenes") if isinstance(f, UploadFile) and f.filename]
+        archivos = [f for f in form.getlist("archivos") if isinstance(f, UploadFile) and f.filename]
+        result = await event_service.add_attachments(id, imagenes, archivos)
+    finally:
+        await form.close()
+
+    if not result:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Evento con ID {id} no encontrado")
+
+    updated, miniaturas = result
+    for digest in miniaturas:
+        background_tasks.add_task(event_service.generate_thumbnail, digest)
+    return updated
+
+
+# 13. GET /events/attachments/{digest} : Descargar un adjunto
+@router.get(
+    "/attachments/{digest}",
+    response_class=FileResponse,
+    response_description="Contenido del adjunto (admite peticiones Range)",
+)
+async def download_attachment(
+    request: Request,
+    event_service: EventServiceDep,
+    digest: str = Path(..., pattern=DIGEST_PATTERN.pattern),
+):
+    attachment = await event_service.get_attachment(digest)
+    if not attachment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Adjunto no encontrado")
+    metadata, ruta = attachment
+    return _attachment_response(request, ruta, digest, metadata["tipoContenido"], metadata.get("nombre"))
+
+
+# 14. GET /events/attachments/{digest}/thumbnail : Miniatura de una imagen
+@router.get(
+    "/attachments/{digest}/thumbnail",
+    response_class=FileResponse,
+    response_description="Miniatura JPEG de la imagen",
+)
+async def download_thumbnail(
+    request: Request,
+    event_service: EventServiceDep,
+    digest: str = Path(..., pattern=DIGEST_PATTERN.pattern),
+):
+    """Devuelve 404 mientras la miniatura no se ha generado (o si no se puede generar)."""
+    ruta = event_service.get_thumbnail_path(digest)
+    if not ruta:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Miniatura no disponible")
+    return _attachment_response(request, ruta, digest, "image/jpeg")
@@ -1,30 +1,232 @@
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 from uuid import UUID, uuid4
-from datetime import datetime
+from datetime import datetime, timedelta
+import csv
+import io
+import json
 import httpx
 from fastapi import HTTPException, status
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from pymongo import ASCENDING
 import os
+from starlette.datastructures import UploadFile
 
 # Importaciones de tu proyecto
-from ..model.event_model import EventCreate, EventInDB
+from ..model.event_model import (
+    EventCreate, EventInDB, FreeBusyRequest, FreeBusyResponse, Intervalo, Mapa, Bucket, BucketEvent,
+    BulkResult, BulkItemResult, EventChanges
+)
 from ..crud.event_crud import EventCRUD
+from ..recurrence_utils import fin_de_serie, expandir_ocurrencias
+from ..freebusy_utils import intervalos_ordenados, fusionar_intervalos, huecos_libres
+from ..ical_feed import FeedCache, Feed, render_vevent, build_calendar
+from ..sync_utils import encode_token, decode_token, hasta_tope, posterior_a, orden
+from ..blob_store import (
+    BlobStore, LocalBlobStore, AdjuntoDemasiadoGrande, generar_miniatura, ATTACHMENT_MAX_BYTES
+)
 
 # URL del servicio de calendarios
 CALENDAR_SERVICE_URL = os.getenv("CALENDAR_SERVICE_URL", "http://calendar_service:8000")
 
+# Ingesta masiva: tamaño por defecto de cada insert_many y máximo de elementos por petición
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+# Radio medio de la Tierra, para pasar metros a radianes en $centerSphere
+RADIO_TIERRA_METROS = 6378100
+
+# Prefijo de las URLs de descarga que se guardan en contenidoAdjunto (tal y como las ve el cliente)
+ATTACHMENTS_URL_PREFIX = os.getenv("ATTACHMENTS_URL_PREFIX", "/event/events/attachments")
+
+# Archivo frío: eventos terminados hace más de ARCHIVE_HORIZON_DAYS días salen de 'eventos'
+# (0 desactiva el job). Se mueven por lotes cada ARCHIVE_INTERVAL_SECONDS.
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# Exportación masiva: tamaño de lote del cursor (acota la memoria usada por petición)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CSV_COLUMNS = [
+    "_id", "idCalendario", "titulo", "horaComienzo", "horaFin", "duracionMinutos",
+    "lugar", "organizador", "emailOrganizador", "rrule", "fechasExcluidas", "contenidoAdjunto",
+]
+
+
+def calcular_hora_fin(hora_comienzo: datetime, duracion_minutos: int, rrule: Optional[str] = None) -> datetime:
+    """
+    Devuelve la hora de fin derivada de un evento (horaComienzo + duracionMinutos).
+    Para eventos recurrentes devuelve el fin de la última ocurrencia de la serie.
+    """
+    if rrule:
+        return fin_de_serie(hora_comienzo, duracion_minutos, rrule)
+    return hora_comienzo + timedelta(minutes=duracion_minutos)
+
+
+def ubicacion_desde_mapa(mapa: Optional[Mapa]) -> Optional[dict]:
+    """Convierte el mapa del evento en un punto GeoJSON (longitud primero) para el índice 2dsphere."""
+    if mapa is None:
+        return None
+    return {"type": "Point", "coordinates": [mapa.longitud, mapa.latitud]}
+
+
+def truncar_fecha(fecha: datetime, granularidad: str) -> datetime:
+    """Equivalente en Python de $dateTrunc (semanas empezando en lunes)."""
+    dia = fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularidad == "week":
+        return dia - timedelta(days=dia.weekday())
+    if granularidad == "month":
+        return dia.replace(day=1)
+    return dia
+
+
+def expandir_eventos(
+    events: List[EventInDB],
+    desde: Optional[datetime],
+    hasta: Optional[datetime],
+    solapamiento: bool = False,
+) -> List[EventInDB]:
+    """
+    Sustituye cada evento recurrente por sus ocurrencias dentro de la ventana pedida.
+    Las ocurrencias conservan el ID del evento original. Sin ventana no se expande nada.
+    """
+    if desde is None and hasta is None:
+        return events
+
+    resultado = []
+    for event in events:
+        if not event.rrule:
+            resultado.append(event)
+            continue
+        duracion = timedelta(minutes=event.duracion_minutos)
+        for comienzo in expandir_ocurrencias(
+            event.hora_comienzo, event.duracion_minutos, event.rrule,
+            event.fechas_excluidas, desde, hasta, solapamiento
+        ):
+            resultado.append(event.model_copy(update={"hora_comienzo": comienzo, "hora_fin": comienzo + duracion}))
+    return resultado
+
+
+def _batched(cursor: Iterable[dict]) -> Iterator[List[EventInDB]]:
+    """Agrupa el cursor en lotes de EXPORT_BATCH_SIZE eventos validados."""
+    lote = []
+    for doc in cursor:
+        lote.append(EventInDB.model_validate(doc))
+        if len(lote) >= EXPORT_BATCH_SIZE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _export_ndjson(cursor: Iterable[dict]) -> Iterator[str]:
+    for lote in _batched(cursor):
+        yield "".join(event.model_dump_json(by_alias=True) + "\n" for event in lote)
+
+
+def _export_csv(cursor: Iterable[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for lote in _batched(cursor):
+        for event in lote:
+            row = event.model_dump(mode="json", by_alias=True)
+            writer.writerow([
+                json.dumps(row[col], ensure_ascii=False) if isinstance(row.get(col), (dict, list)) else row.get(col)
+                for col in EXPORT_CSV_COLUMNS
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
 class EventService:
-    def __init__(self, crud_repository: EventCRUD):
+    def __init__(
+        self,
+        crud_repository: EventCRUD,
+        feed_cache: Optional[FeedCache] = None,
+        blob_store: Optional[BlobStore] = None,
+    ):
         self.crud = crud_repository
+        self.feed_cache = feed_cache if feed_cache is not None else FeedCache()
+        self.blob_store = blob_store if blob_store is not None else LocalBlobStore()
 
-    async def create_event(self, event: EventCreate) -> EventInDB:
+    def _build_event_doc(self, event: EventCreate, ancestros: List[UUID]) -> dict:
+        """Documento de MongoDB de un evento nuevo, con sus campos derivados."""
         event_dict = event.model_dump(by_alias=True)
         event_dict["_id"] = uuid4() 
-        return await self.crud.create(event_dict)
+        event_dict["horaFin"] = calcular_hora_fin(event.hora_comienzo, event.duracion_minutos, event.rrule)
+        event_dict["ubicacion"] = ubicacion_desde_mapa(event.contenido_adjunto.mapa)
+        event_dict["ancestrosCalendario"] = ancestros
+        return event_dict
 
-    async def get_event_by_id(self, event_id: UUID) -> Optional[EventInDB]:
-        return await self.crud.get_by_id(event_id)
+    async def create_event(self, event: EventCreate) -> EventInDB:
+        ancestros = await self._get_calendar_ancestry(event.id_calendario)
+        event_dict = self._build_event_doc(event, ancestros)
+        async with self.crud.reserve_sequence() as secuencia:
+            event_dict["secuencia"] = secuencia
+            created = await self.crud.create(event_dict)
+        self.feed_cache.invalidate_event(created.id, created.ancestros_calendario)
+        return created
 
-    async def list_events(
+    async def create_events_bulk(self, items: List[dict], chunk_size: int = BULK_CHUNK_SIZE) -> BulkResult:
+        """
+        Valida un lote de eventos elemento a elemento y los inserta con insert_many no
+        ordenado en trozos de chunk_size. Devuelve el resultado de cada posición sin
+        detenerse en el primer error.
+        """
+        resultados: List[BulkItemResult] = []
+        validos: List[tuple] = []  # (indice, documento)
+        ancestros_por_calendario: dict = {}
+
+        for indice, item in enumerate(items):
+            try:
+                event = EventCreate.model_validate(item)
+            except ValidationError as e:
+                errores = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                resultados.append(BulkItemResult(indice=indice, error=errores))
+                continue
+
+            # La ascendencia se pide una sola vez por calendario distinto del lote
+            if event.id_calendario not in ancestros_por_calendario:
+                try:
+                    ancestros_por_calendario[event.id_calendario] = await self._get_calendar_ancestry(event.id_calendario)
+                except HTTPException as e:
+                    ancestros_por_calendario[event.id_calendario] = str(e.detail)
+                except httpx.HTTPError as e:
+                    # Cualquier fallo hablando con el servicio de calendarios se queda en este calendario
+                    ancestros_por_calendario[event.id_calendario] = f"Error consultando el calendario: {e}"
+            ancestros = ancestros_por_calendario[event.id_calendario]
+            if isinstance(ancestros, str):
+                resultados.append(BulkItemResult(indice=indice, error=ancestros))
+                continue
+
+            validos.append((indice, self._build_event_doc(event, ancestros)))
+
+        for inicio in range(0, len(validos), chunk_size):
+            trozo = validos[inicio:inicio + chunk_size]
+            # Un bloque de secuencias consecutivas por trozo (una sola ida a MongoDB)
+            async with self.crud.reserve_sequence(len(trozo)) as ultima:
+                for posicion, (_, doc) in enumerate(trozo):
+                    doc["secuencia"] = ultima - len(trozo) + 1 + posicion
+                errores = await self.crud.create_many([doc for _, doc in trozo])
+            for posicion, (indice, doc) in enumerate(trozo):
+                if posicion in errores:
+                    resultados.append(BulkItemResult(indice=indice, error=errores[posicion]))
+                else:
+                    resultados.append(BulkItemResult(indice=indice, id=doc["_id"]))
+                    self.feed_cache.invalidate_event(doc["_id"], doc["ancestrosCalendario"])
+
+        resultados.sort(key=lambda r: r.indice)
+        insertados = sum(1 for r in resultados if r.error is None)
+        return BulkResult(insertados=insertados, fallidos=len(resultados) - insertados, resultados=resultados)
+
+    async def get_event_by_id(self, event_id: UUID, include_archived: bool = False) -> Optional[EventInDB]:
+        return await self.crud.get_by_id(event_id, include_archived)
+
+    def build_filter(
         self,
         fecha_inicio: Optional[datetime],
         fecha_fin: Optional[datetime],
@@ -33,12 +235,24 @@ class EventService:
         titulo: Optional[str],
         duration_minima: Optional[int],
         duration_maxima: Optional[int],
-    ) -> List[EventInDB]:
+        overlaps: bool = False,
+    ) -> dict:
+        """Construye el filtro de MongoDB a partir de los parámetros de consulta de la API."""
         filtro = {}
-        if fecha_inicio or fecha_fin:
-            filtro["horaComienzo"] = {}
-            if fecha_inicio: filtro["horaComienzo"]["$gte"] = fecha_inicio
-            if fecha_fin: filtro["horaComienzo"]["$lte"] = fecha_fin
+        if overlaps:
+            # Modo solapamiento: eventos que ocupan algún instante de [fecha_inicio, fecha_fin)
+            if fecha_inicio: filtro["horaFin"] = {"$gt": fecha_inicio}
+            if fecha_fin: filtro["horaComienzo"] = {"$lt": fecha_fin}
+        elif fecha_inicio or fecha_fin:
+            rango = {}
+            if fecha_inicio: rango["$gte"] = fecha_inicio
+            if fecha_fin: rango["$lte"] = fecha_fin
+            # Las series recurrentes se seleccionan por su intervalo completo
+            # (horaFin = fin de la serie) y se expanden después.
+            serie = {"rrule": {"$ne": None}}
+            if fecha_fin: serie["horaComienzo"] = {"$lte": fecha_fin}
+            if fecha_inicio: serie["horaFin"] = {"$gte": fecha_inicio}
+            filtro["$or"] = [{"horaComienzo": rango}, serie]
         
         if lugar: filtro["lugar"] = {"$regex": lugar, "$options": "i"}
         if organizador: filtro["organizador"] = {"$regex": organizador, "$options": "i"}
@@ -49,35 +263,457 @@ class EventService:
             if duration_minima: filtro["duracionMinutos"]["$gte"] = duration_minima
             if duration_maxima: filtro["duracionMinutos"]["$lte"] = duration_maxima
 
-        return await self.crud.list_by_filter(filtro)
+        return filtro
+
+    async def list_events(
+        self,
+        fecha_inicio: Optional[datetime],
+        fecha_fin: Optional[datetime],
+        lugar: Optional[str],
+        organizador: Optional[str],
+        titulo: Optional[str],
+        duration_minima: Optional[int],
+        duration_maxima: Optional[int],
+        overlaps: bool = False,
+        include_archived: bool = False,
+    ) -> List[EventInDB]:
+        filtro = self.build_filter(
+            fecha_inicio, fecha_fin, lugar, organizador, titulo, duration_minima, duration_maxima, overlaps
+        )
+        events = await self.crud.list_by_filter(filtro, include_archived)
+        return expandir_eventos(events, fecha_inicio, fecha_fin, overlaps)
+
+    async def list_events_near(
+        self,
+        lat: float,
+        lon: float,
+        radio_metros: float,
+        fecha_inicio: Optional[datetime] = None,
+        fecha_fin: Optional[datetime] = None,
+        overlaps: bool = False,
+        include_archived: bool = False,
+    ) -> List[EventInDB]:
+        """Eventos a menos de radio_metros del punto indicado, opcionalmente en una ventana temporal."""
+        filtro = self.build_filter(fecha_inicio, fecha_fin, None, None, None, None, None, overlaps)
+        # $geoWithin (a diferencia de $near) se puede combinar con el $or del filtro temporal
+        filtro["ubicacion"] = {
+            "$geoWithin": {"$centerSphere": [[lon, lat], radio_metros / RADIO_TIERRA_METROS]}
+        }
+        events = await self.crud.list_by_filter(filtro, include_archived)
+        return expandir_eventos(events, fecha_inicio, fecha_fin, overlaps)
+
+    async def list_events_in_box(
+        self,
+        sur: float,
+        oeste: float,
+        norte: float,
+        este: float,
+        fecha_inicio: Optional[datetime] = None,
+        fecha_fin: Optional[datetime] = None,
+        overlaps: bool = False,
+        include_archived: bool = False,
+    ) -> List[EventInDB]:
+        """Eventos dentro del rectángulo visible del mapa, opcionalmente en una ventana temporal."""
+        filtro = self.build_filter(fecha_inicio, fecha_fin, None, None, None, None, None, overlaps)
+        filtro["ubicacion"] = {"$geoWithin": {"$geometry": {
+            "type": "Polygon",
+            "coordinates": [[[oeste, sur], [este, sur], [este, norte], [oeste, norte], [oeste, sur]]],
+        }}}
+        events = await self.crud.list_by_filter(filtro, include_archived)
+        return expandir_eventos(events, fecha_inicio, fecha_fin, overlaps)
+
+    def export_events(
+        self,
+        filtro: dict,
+        formato: str = "ndjson",
+        after_hora: Optional[datetime] = None,
+        after_id: Optional[UUID] = None,
+        include_archived: bool = False,
+    ) -> Iterator[str]:
+        """
+        Generador que vuelca los eventos (sin expandir recurrencias) en NDJSON o CSV,
+        leyendo un cursor por lotes en orden (horaComienzo, _id). Para reanudar una
+        exportación se pasa la última pareja (horaComienzo, _id) recibida.
+        """
+        if after_hora is not None:
+            desde = {"horaComienzo": {"$gt": after_hora}}
+            if after_id is not None:
+                desde = {"$or": [desde, {"horaComienzo": after_hora, "_id": {"$gt": after_id}}]}
+            filtro = {"$and": [filtro, desde]}
+
+        cursor = self.crud.iter_by_filter(
+            filtro, sort=[("horaComienzo", ASCENDING), ("_id", ASCENDING)], batch_size=EXPORT_BATCH_SIZE,
+            include_archived=include_archived
+        )
+
+        if formato == "csv":
+            yield from _export_csv(cursor)
+        else:
+            yield from _export_ndjson(cursor)
 
     async def update_event(self, event_id: UUID, event_update: EventCreate) -> Optional[EventInDB]:
+        current = await self.crud.get_by_id(event_id)
+        if not current:
+            return None
+
         update_data = event_update.model_dump(by_alias=True, exclude_unset=True)
-        return await self.crud.update(event_id, update_data)
+        # Si la regla no viene en la petición, se conserva la guardada
+        rrule = event_update.rrule if "rrule" in update_data else current.rrule
+        update_data["horaFin"] = calcular_hora_fin(event_update.hora_comienzo, event_update.duracion_minutos, rrule)
+        if "contenidoAdjunto" in update_data:
+            update_data["ubicacion"] = ubicacion_desde_mapa(event_update.contenido_adjunto.mapa)
+        update_data["ancestrosCalendario"] = await self._get_calendar_ancestry(event_update.id_calendario)
+        async with self.crud.reserve_sequence() as secuencia:
+            update_data["secuencia"] = secuencia
+            updated = await self.crud.update(event_id, update_data)
+
+        # El evento puede haber cambiado de calendario: se invalidan los feeds de ambos árboles
+        self.feed_cache.invalidate_event(event_id, current.ancestros_calendario)
+        if updated:
+            self.feed_cache.invalidate_event(event_id, updated.ancestros_calendario)
+        return updated
 
     async def delete_event(self, event_id: UUID) -> bool:
+        current = await self.crud.get_by_id(event_id)
         deleted_count = await self.crud.delete(event_id)
+        if deleted_count > 0:
+            # Marca de borrado para que los clientes de /events/changes se enteren
+            async with self.crud.reserve_sequence() as secuencia:
+                await self.crud.add_tombstone(event_id, secuencia)
+        if current:
+            self.feed_cache.invalidate_event(event_id, current.ancestros_calendario)
         return deleted_count > 0
     
-    async def get_events_by_calendar_and_subcalendars(self, calendar_id: UUID) -> List[EventInDB]:
+    async def _get_calendar_ancestry(self, calendar_id: UUID) -> List[UUID]:
+        """
+        Devuelve [calendar_id, padre, ..., raíz] consultando al servicio de calendarios.
+        Solo se usa al escribir: las lecturas del árbol van directamente contra 'eventos'.
+        """
         try:
             async with httpx.AsyncClient() as client:
-                response = await client.get(f"{CALENDAR_SERVICE_URL}/calendars/{calendar_id}/subcalendars")
+                response = await client.get(f"{CALENDAR_SERVICE_URL}/calendars/{calendar_id}")
                 if response.status_code == 404:
-                    subcalendars = []
-                else:
-                    response.raise_for_status()
-                    subcalendars = response.json()
+                    return [calendar_id]
+                response.raise_for_status()
+                calendar = response.json()
         except httpx.RequestError as e:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail=f"No se pudo conectar al servicio de calendarios: {str(e)}"
             )
- 
-        subcalendar_ids = [UUID(sub["_id"]) for sub in subcalendars]
-        all_calendar_ids = [calendar_id] + subcalendar_ids
+        except httpx.HTTPStatusError as e:
+            # Un 5xx del servicio de calendarios es que no está disponible; cualquier otro
+            # código inesperado, una respuesta no válida de un servicio del que dependemos
+            codigo = e.response.status_code
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE if codigo >= 500 else status.HTTP_502_BAD_GATEWAY,
+                detail=f"El servicio de calendarios respondió {codigo}: {e.response.text}"
+            )
+
+        return [calendar_id] + [UUID(a) for a in calendar.get("ancestros", [])]
+
+    async def get_events_by_calendar_and_subcalendars(
+        self, calendar_id: UUID, include_archived: bool = False
+    ) -> List[EventInDB]:
+        # Una sola consulta indexada sobre la ascendencia desnormalizada del evento
+        filtro = {"ancestrosCalendario": calendar_id}
+        return await self.crud.list_by_filter(filtro, include_archived)
+
+    async def add_attachments(
+        self, event_id: UUID, imagenes: List[UploadFile], archivos: List[UploadFile]
+    ) -> Optional[Tuple[EventInDB, List[str]]]:
+        """
+        Guarda los ficheros subidos en el almacén de blobs (por trozos, en un hilo aparte)
+        y añade sus URLs al evento. Devuelve el evento y los digests de las imágenes
+        nuevas, para generar sus miniaturas fuera de la petición.
+
+        Todos los ficheros se validan antes de guardar ninguno. Si aun así uno falla al
+        guardarse, se deshace lo que esta petición había añadido al almacén: la subida es
+        todo o nada.
+        """
+        current = await self.crud.get_by_id(event_id)
+        if not current:
+            return None
+
+        for upload in imagenes:
+            if not (upload.content_type or "").startswith("image/"):
+                raise HTTPException(
+                    status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                    detail=f"'{upload.filename}' no es una imagen"
+                )
+        for upload in imagenes + archivos:
+            # Starlette ya conoce el tamaño de cada parte al terminar de leer el formulario
+            if upload.size is not None and upload.size > ATTACHMENT_MAX_BYTES:
+                raise self._adjunto_demasiado_grande(upload)
+
+        urls = {"imagenes": [], "archivos": []}
+        miniaturas = []
+        registrados: List[str] = []  # subidas en curso contadas en los metadatos
+        nuevos: List[Tuple[str, UploadFile]] = []  # contenido que no existía antes de esta petición
+        try:
+            for campo, uploads in (("imagenes", imagenes), ("archivos", archivos)):
+                for upload in uploads:
+                    blob = await self._guardar_blob(upload)
+                    await self.crud.save_attachment({
+                        "_id": blob.digest,
+                        "tipoContenido": upload.content_type or "application/octet-stream",
+                        "nombre": upload.filename,
+                        "tamano": blob.tamano,
+                        "creadoEn": datetime.utcnow(),
+                    })
+                    registrados.append(blob.digest)
+                    if not blob.nuevo and self.blob_store.path(blob.digest) is None:
+                        # Otra subida fallida lo borró entre put y el registro: se vuelve a guardar
+                        await upload.seek(0)
+                        blob = await self._guardar_blob(upload)
+                    if blob.nuevo:
+                        nuevos.append((blob.digest, upload))
+                    urls[campo].append(f"{ATTACHMENTS_URL_PREFIX}/{blob.digest}")
+                    if campo == "imagenes":
+                        miniaturas.append(blob.digest)
+
+            async with self.crud.reserve_sequence() as secuencia:
+                updated = await self.crud.add_attachment_urls(event_id, urls["imagenes"], urls["archivos"], secuencia)
+        except BaseException:
+            await self.crud.release_attachments(registrados)
+            await self._deshacer_adjuntos(nuevos)
+            raise
+        await self.crud.release_attachments(registrados)
+        if not updated:
+            # El evento se borró mientras se subía
+            await self._deshacer_adjuntos(nuevos)
+            return None
+        self.feed_cache.invalidate_event(event_id, updated.ancestros_calendario)
+        return updated, miniaturas
+
+    async def _guardar_blob(self, upload: UploadFile):
+        try:
+            return await run_in_threadpool(self.blob_store.put, upload.file, ATTACHMENT_MAX_BYTES)
+        except AdjuntoDemasiadoGrande:
+            raise self._adjunto_demasiado_grande(upload)
+
+    @staticmethod
+    def _adjunto_demasiado_grande(upload: UploadFile) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=f"'{upload.filename}' supera el tamaño máximo de {ATTACHMENT_MAX_BYTES} bytes"
+        )
+
+    async def _deshacer_adjuntos(self, nuevos: List[Tuple[str, UploadFile]]):
+        """
+        Borra blobs y metadatos que creó una subida que no ha llegado a completarse. El
+        almacén se direcciona por contenido, así que otra subida de los mismos bytes puede
+        estar usándolos: no se borra nada con subidas en curso ni enlazado por un evento, y
+        si otra subida lo registra mientras se borra el blob, se vuelve a guardar.
+        """
+        for digest, upload in nuevos:
+            metadatos = await self.crud.delete_attachment(digest)
+            if metadatos is None:
+                continue
+            if await self.crud.attachment_in_use(f"{ATTACHMENTS_URL_PREFIX}/{digest}"):
+                await self.crud.save_attachment(metadatos, subida=False)
+                continue
+            await run_in_threadpool(self.blob_store.delete, digest)
+            if await self.crud.get_attachment(digest) is not None:
+                await upload.seek(0)
+                await run_in_threadpool(self.blob_store.put, upload.file, ATTACHMENT_MAX_BYTES)
+
+
+    async def get_attachment(self, digest: str) -> Optional[Tuple[dict, str]]:
+        """Metadatos y ruta local de un adjunto, o None si no existe."""
+        attachment = await self.crud.get_attachment(digest)
+        ruta = self.blob_store.path(digest) if attachment else None
+        if not ruta:
+            return None
+        return attachment, ruta
+
+
+    def get_thumbnail_path(self, digest: str) -> Optional[str]:
+        """Ruta de la miniatura si ya se ha generado."""
+        ruta = self.blob_store.thumbnail_path(digest)
+        return ruta if os.path.exists(ruta) else None
+
+
+    def generate_thumbnail(self, digest: str):
+        """Tarea en segundo plano (síncrona: FastAPI la ejecuta en un hilo aparte)."""
+        generar_miniatura(self.blob_store, digest)
+
+
+    def archive_past_events(self, horizonte_dias: int = ARCHIVE_HORIZON_DAYS) -> int:
+        """
+        Mueve al archivo, por lotes, los eventos que terminaron hace más de horizonte_dias
+        días y devuelve cuántos se han movido. Es síncrono: se ejecuta en un hilo aparte.
+        Las series sin fin (horaFin = FIN_INDEFINIDO) nunca se archivan.
+        """
+        limite = datetime.now() - timedelta(days=horizonte_dias)
+        total = 0
+        while True:
+            movidos = self.crud.archive_batch(limite, ARCHIVE_BATCH_SIZE)
+            total += movidos
+            if movidos < ARCHIVE_BATCH_SIZE:
+                break
+        if total:
+            # Los feeds solo incluyen eventos en caliente
+            self.feed_cache.clear_feeds()
+        return total
+
+
+    async def get_changes(self, token: Optional[str], limit: int = 500) -> EventChanges:
+        """
+        Devuelve los eventos modificados y borrados después de la posición del token,
+        en orden (secuencia, _id), y un token nuevo para la siguiente llamada.
+        Lanza ValueError si el token no es válido y TokenCaducado si ha caducado.
+        """
+        secuencia, ultimo_id = decode_token(token)
+        # Nada a partir de una escritura que aún no se ha guardado: el token la saltaría
+        filtro = hasta_tope(posterior_a(secuencia, ultimo_id), await self.crud.sequence_limit())
+
+        # Se pide uno de más a cada colección para saber si quedan cambios pendientes
+        cambios = [(doc, False) for doc in await self.crud.list_changes(filtro, limit + 1)]
+        borrados = [(doc, True) for doc in await self.crud.list_tombstones(filtro, limit + 1)]
+        fusion = sorted(cambios + borrados, key=lambda par: orden(par[0]))
+        pagina = fusion[:limit]
+
+        if pagina:
+            ultimo = pagina[-1][0]
+            secuencia, ultimo_id = ultimo["secuencia"], ultimo["_id"]
+
+        return EventChanges(
+            cambios=[EventInDB.model_validate(doc) for doc, borrado in pagina if not borrado],
+            eliminados=[doc["_id"] for doc, borrado in pagina if borrado and not doc.get("archivado")],
+            archivados=[doc["_id"] for doc, borrado in pagina if borrado and doc.get("archivado")],
+            token=encode_token(secuencia, ultimo_id),
+            hay_mas=len(fusion) > limit,
+        )
+
+    async def get_calendar_buckets(
+        self,
+        calendar_id: UUID,
+        granularidad: str,
+        desde: datetime,
+        hasta: datetime,
+        top: int = 3,
+    ) -> List[Bucket]:
+        """
+        Agrupa en el servidor los eventos del árbol del calendario que empiezan en
+        [desde, hasta) por día, semana o mes: total por grupo y los 'top' primeros títulos.
+        """
+        pipeline = [
+            {"$match": {
+                "ancestrosCalendario": calendar_id,
+                "rrule": None,
+                "horaComienzo": {"$gte": desde, "$lt": hasta},
+            }},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$horaComienzo", "unit": granularidad, "startOfWeek": "monday"}},
+                "total": {"$sum": 1},
+                "eventos": {"$topN": {
+                    "n": top,
+                    "sortBy": {"horaComienzo": 1},
+                    "output": {"_id": "$_id", "titulo": "$titulo", "horaComienzo": "$horaComienzo"},
+                }},
+            }},
+        ]
+        buckets = {
+            doc["_id"]: {"total": doc["total"], "eventos": doc["eventos"]}
+            for doc in await self.crud.aggregate(pipeline)
+        }
+
+        # Las series recurrentes no se pueden expandir en el pipeline: se expanden aquí,
+        # solo dentro de la ventana pedida, y se suman a sus grupos.
+        series = await self.crud.list_by_filter({
+            "ancestrosCalendario": calendar_id,
+            "rrule": {"$ne": None},
+            "horaComienzo": {"$lt": hasta},
+            "horaFin": {"$gte": desde},
+        })
+        for event in series:
+            for comienzo in expandir_ocurrencias(
+                event.hora_comienzo, event.duracion_minutos, event.rrule,
+                event.fechas_excluidas, desde, hasta
+            ):
+                if comienzo >= hasta:
+                    continue
+                bucket = buckets.setdefault(truncar_fecha(comienzo, granularidad), {"total": 0, "eventos": []})
+                bucket["total"] += 1
+                bucket["eventos"].append({"_id": event.id, "titulo": event.titulo, "horaComienzo": comienzo})
+
+        return [
+            Bucket(
+                inicio=inicio,
+                total=bucket["total"],
+                eventos=[
+                    BucketEvent.model_validate(e)
+                    for e in sorted(bucket["eventos"], key=lambda e: e["horaComienzo"])[:top]
+                ],
+            )
+            for inicio, bucket in sorted(buckets.items())
+        ]
+
+    async def update_calendar_ancestry(self, calendar_id: UUID, new_ancestors: List[UUID]) -> int:
+        """Un calendario ha cambiado de padre: actualiza la ascendencia de los eventos de su subárbol."""
+        async with self.crud.reserve_sequence() as secuencia:
+            updated = await self.crud.replace_calendar_ancestry(calendar_id, new_ancestors, secuencia)
+        self.feed_cache.clear_feeds()
+        return updated
+
+    async def detach_calendar(self, calendar_id: UUID) -> int:
+        """Un calendario se ha eliminado: deja de ser ancestro de los eventos de su subárbol."""
+        async with self.crud.reserve_sequence() as secuencia:
+            updated = await self.crud.detach_calendar(calendar_id, secuencia)
+        self.feed_cache.clear_feeds()
+        return updated
+
+    async def get_calendar_feed(self, calendar_id: UUID, incluir_subcalendarios: bool = True) -> Feed:
+        """
+        Devuelve el feed iCalendar de un calendario desde la caché. Si no está, lo
+        regenera de forma incremental: solo se leen y renderizan los eventos cuyo
+        VEVENT no está ya cacheado.
+        """
+        key = (calendar_id, incluir_subcalendarios)
+        feed = self.feed_cache.get_feed(key)
+        if feed:
+            return feed
+
+        campo = "ancestrosCalendario" if incluir_subcalendarios else "idCalendario"
+        event_ids = await self.crud.list_ids({campo: calendar_id})
+
+        fragments = {event_id: self.feed_cache.get_fragment(event_id) for event_id in event_ids}
+        missing = [event_id for event_id, fragment in fragments.items() if fragment is None]
+        if missing:
+            for event in await self.crud.list_by_filter({"_id": {"$in": missing}}):
+                fragments[event.id] = render_vevent(event)
+                self.feed_cache.store_fragment(event.id, fragments[event.id])
+
+        body = build_calendar(
+            f"Kalendas {calendar_id}",
+            (fragments[event_id] for event_id in event_ids if fragments.get(event_id) is not None)
+        )
+        return self.feed_cache.store_feed(key, body)
+
+    async def get_freebusy(self, request: FreeBusyRequest) -> FreeBusyResponse:
+        """
+        Calcula los bloques ocupados (fusionados) y los huecos libres de un conjunto
+        de calendarios en [desde, hasta), recorriendo un cursor ordenado por índice.
+        """
+        campo = "ancestrosCalendario" if request.incluir_subcalendarios else "idCalendario"
+        filtro = {
+            campo: {"$in": request.ids_calendario},
+            "horaComienzo": {"$lt": request.hasta},
+            "horaFin": {"$gt": request.desde},
+        }
 
-        filtro = {"idCalendario": {"$in": all_calendar_ids}}
-        events = await self.crud.list_by_filter(filtro)
+        def sweep():
+            docs = self.crud.iter_intervals(filtro)
+            intervalos = intervalos_ordenados(docs, request.desde, request.hasta)
+            return fusionar_intervalos(intervalos, request.desde, request.hasta)
 
-        return events
\ No newline at end of file
+        # El recorrido del cursor es bloqueante: se ejecuta fuera del event loop
+        ocupados = await run_in_threadpool(sweep)
+        libres = huecos_libres(
+            ocupados, request.desde, request.hasta, timedelta(minutes=request.duracion_minima_minutos)
+        )
+        return FreeBusyResponse(
+            ocupado=[Intervalo(inicio=i, fin=f) for i, f in ocupados],
+            libre=[Intervalo(inicio=i, fin=f) for i, f in libres],
+        )
@@ -0,0 +1,105 @@
+import asyncio
+import os
+from typing import Callable, List, Optional, Set, Tuple
+
+import httpx
+
+# Eventos por petición a POST /events/bulk y lotes en vuelo a la vez
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "4"))
+# Tiempo máximo de cada petición de lote (segundos)
+IMPORT_BATCH_TIMEOUT = float(os.getenv("IMPORT_BATCH_TIMEOUT", "60"))
+
+
+class EnvioPorLotes:
+    """
+    Envía eventos a EventService en lotes (POST /events/bulk) con un número acotado de
+    lotes en vuelo. add() solo espera cuando ya hay IMPORT_CONCURRENCY lotes enviándose,
+    así que quien lee el feed se frena al ritmo de EventService y en memoria hay como
+    mucho (concurrency + 1) lotes. Cuenta insertados y fallidos evento a evento.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        batch_size: int = IMPORT_BATCH_SIZE,
+        concurrency: int = IMPORT_CONCURRENCY,
+        progreso=None,
+        tras_lote: Optional[Callable[[], None]] = None,
+    ):
+        self.client = client
+        # Opcional: jobs.Progreso del trabajo de importación, que se actualiza evento a evento
+        self.progreso = progreso
+        # Opcional: se llama tras los al_crear de cada lote insertado (p. ej. para guardarlos juntos)
+        self.tras_lote = tras_lote
+        self.url = url
+        self.batch_size = batch_size
+        self.insertados = 0
+        self.fallidos = 0
+        self._semaforo = asyncio.Semaphore(concurrency)
+        self._lote: List[Tuple[dict, Optional[Callable[[str], None]], Optional[str]]] = []
+        self._tareas: Set[asyncio.Task] = set()
+
+    async def add(
+        self, payload: dict, al_crear: Optional[Callable[[str], None]] = None, etiqueta: Optional[str] = None
+    ):
+        """
+        Encola un evento; al_crear recibe su _id cuando EventService lo inserta. Si falla,
+        el error se identifica con la etiqueta (p. ej. "Fila 12") o, si no hay, con el título.
+        """
+        self._lote.append((payload, al_crear, etiqueta))
+        if len(self._lote) >= self.batch_size:
+            await self._despachar()
+
+    async def close(self):
+        """Envía lo que quede y espera a que terminen todos los lotes."""
+        if self._lote:
+            await self._despachar()
+        if self._tareas:
+            await asyncio.gather(*list(self._tareas))
+
+    async def _despachar(self):
+        lote, self._lote = self._lote, []
+        await self._semaforo.acquire()
+        tarea = asyncio.create_task(self._enviar(lote))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def _enviar(self, lote: List[Tuple[dict, Optional[Callable[[str], None]], Optional[str]]]):
+        try:
+            response = await self.client.post(
+                self.url, json=[payload for payload, _, _ in lote], timeout=IMPORT_BATCH_TIMEOUT
+            )
+            if response.status_code != 200:
+                self._lote_fallido(lote, f"{response.status_code} - {response.text}")
+                return
+            resultados = response.json()["resultados"]
+        except Exception as e:
+            self._lote_fallido(lote, str(e))
+            return
+        finally:
+            self._semaforo.release()
+
+        for resultado in resultados:
+            payload, al_crear, etiqueta = lote[resultado["indice"]]
+            if resultado.get("error"):
+                self.fallidos += 1
+                etiqueta = etiqueta or f"'{payload['titulo']}'"
+                print(f"⚠️ Fallo al importar evento {etiqueta}: {resultado['error']}")
+                if self.progreso:
+                    self.progreso.error(f"{etiqueta}: {resultado['error']}")
+            else:
+                self.insertados += 1
+                if self.progreso:
+                    self.progreso.importado()
+                if al_crear:
+                    al_crear(resultado["id"])
+        if self.tras_lote:
+            self.tras_lote()
+
+    def _lote_fallido(self, lote, error: str):
+        self.fallidos += len(lote)
+        print(f"⚠️ Fallo al importar un lote de {len(lote)} eventos: {error}")
+        if self.progreso:
+            self.progreso.error(f"Lote de {len(lote)} eventos: {error}", n=len(lote))
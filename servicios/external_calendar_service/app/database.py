@@ -0,0 +1,36 @@
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from pymongo import ASCENDING
+from dotenv import load_dotenv
+import os
+
+from .jobs import IMPORT_JOB_RETENTION_SECONDS
+
+load_dotenv()
+
+uri = os.getenv('MONGODB_URI')
+client = MongoClient(uri, server_api=ServerApi('1'), uuidRepresentation='standard')
+db = client['KalendasDB']
+# Trabajos de importación (estado y progreso sobreviven a los reinicios del servicio)
+importaciones_collection = db['importaciones']
+# Feeds suscritos (URL, hash del último contenido aplicado, próxima sincronización) y, por cada uno,
+# la correspondencia UID del VEVENT -> evento de Kalendas con la huella de su contenido
+suscripciones_collection = db['suscripciones']
+eventos_importados_collection = db['eventos_importados']
+
+
+def ensure_indexes():
+    """Crea (si no existen) los índices de los trabajos de importación y de las suscripciones."""
+    # Reserva del siguiente trabajo pendiente por orden de llegada
+    importaciones_collection.create_index([("estado", ASCENDING), ("creadaEn", ASCENDING)], name="estado_creada_en")
+    # Los trabajos terminados se borran solos pasado el tiempo de retención
+    importaciones_collection.create_index(
+        [("terminadaEn", ASCENDING)], name="caducidad", expireAfterSeconds=IMPORT_JOB_RETENTION_SECONDS
+    )
+    # El planificador busca las suscripciones cuya sincronización ha vencido
+    suscripciones_collection.create_index([("proximaSync", ASCENDING)], name="proxima_sync")
+    suscripciones_collection.create_index([("calendar_id", ASCENDING)], name="calendario")
+    # Un evento importado por clave (UID + RECURRENCE-ID) dentro de cada suscripción
+    eventos_importados_collection.create_index(
+        [("suscripcion", ASCENDING), ("clave", ASCENDING)], name="suscripcion_clave", unique=True
+    )
@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, IO, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from .ical_stream import ICAL_MAX_BYTES, FeedDemasiadoGrande
+from .parse_pool import analizar
+
+# Directorio de la caché de feeds (en Docker, un volumen) y tamaño máximo que ocupa en disco
+FEED_CACHE_DIR = os.getenv("FEED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kalendas_feeds"))
+FEED_CACHE_MAX_BYTES = int(os.getenv("FEED_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+# Durante este tiempo tras descargar o revalidar un feed se usa sin preguntar al servidor
+FEED_CACHE_FRESH_SECONDS = float(os.getenv("FEED_CACHE_FRESH_SECONDS", "300"))
+
+# Bytes de registros que se leen de cada vez (en un hilo, para no bloquear el bucle de eventos)
+FEED_CACHE_READ_BYTES = 1024 * 1024
+
+# Versión del formato de los registros analizados: si cambia, los guardados se vuelven a
+# generar a partir del .ics en caché (sin descargarlo)
+FORMATO_REGISTROS = 1
+
+
+def normalizar_url(url: str) -> str:
+    """
+    URL canónica de un feed: esquema y host en minúsculas, sin puerto por defecto, sin
+    fragmento y sin credenciales (no se guardan en la caché ni forman parte de la clave).
+    """
+    partes = urlsplit(url.strip())
+    esquema = partes.scheme.lower()
+    host = (partes.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    if partes.port and (esquema, partes.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{partes.port}"
+    return urlunsplit((esquema, host, partes.path or "/", partes.query, ""))
+
+
+def _borrar(rutas: List[str]):
+    for ruta in rutas:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+class FeedEnCache:
+    """
+    Un feed servido desde la caché: su hash de contenido y sus registros analizados. El
+    archivo de registros se abre al crearlo, así que sigue siendo legible aunque la caché
+    lo expulse mientras tanto; hay que recorrer registros() o llamar a cerrar().
+    """
+
+    def __init__(self, contenido: str, ruta_registros: str):
+        self.contenido = contenido
+        self._archivo: IO[str] = open(ruta_registros, encoding="utf-8")
+
+    async def registros(self) -> AsyncIterator[dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                lineas = await loop.run_in_executor(None, self._archivo.readlines, FEED_CACHE_READ_BYTES)
+                if not lineas:
+                    break
+                for linea in lineas:
+                    yield json.loads(linea)
+        finally:
+            self.cerrar()
+
+    def cerrar(self):
+        self._archivo.close()
+
+
+class FeedCache:
+    """
+    Caché en disco de los feeds descargados, compartida por todas las suscripciones.
+
+    Por cada URL (normalizada) se guarda un índice feeds/<hash URL>.json con ETag,
+    Last-Modified, cuándo se revisó y cuándo se usó por última vez. El contenido va aparte
+    y direccionado por su hash: contenido/<sha256>.ics con los bytes descargados y, al
+    lado, contenido/<sha256>.v<formato>.ndjson con los eventos ya analizados. Dos URL con
+    el mismo contenido lo comparten, y un feed popular se descarga y se analiza una vez
+    por revisión en vez de una vez por usuario.
+
+    Cuando el contenido supera max_bytes se expulsan las URL usadas hace más tiempo (LRU)
+    y los archivos que dejan de estar referenciados; el tamaño de cada contenido va en el
+    índice, así que decidirlo no lee el disco, y los archivos se borran en un hilo. Pensada
+    para un único proceso: los cerrojos que evitan descargas simultáneas de la misma URL
+    son de asyncio.
+
+    Las URL con credenciales comparten la caché con la misma URL sin ellas, pero lo que se
+    descarga con credenciales queda marcado como privado y nunca se sirve como fresco: con
+    o sin credenciales se revalida con el servidor, que es quien decide el acceso.
+    """
+
+    def __init__(
+        self,
+        directorio: str = FEED_CACHE_DIR,
+        max_bytes: int = FEED_CACHE_MAX_BYTES,
+        fresco_segundos: float = FEED_CACHE_FRESH_SECONDS,
+    ):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.fresco_segundos = fresco_segundos
+        self._indice: Optional[Dict[str, dict]] = None
+        # Se crea dentro del bucle de eventos (en Python 3.9 un Lock se liga al bucle al crearlo)
+        self._cargando: Optional[asyncio.Lock] = None
+        # Cerrojo por URL y cuántas tareas lo usan: se quita cuando nadie lo tiene
+        self._cerrojos: Dict[str, List] = {}
+
+    async def obtener(self, client: httpx.AsyncClient, url: str) -> FeedEnCache:
+        """
+        Devuelve el feed de la URL: desde la caché si está fresco, tras una petición
+        condicional si el servidor responde 304, o descargándolo y analizándolo (a la vez,
+        según llegan los bytes) si ha cambiado o no estaba.
+
+        Lanza httpx.HTTPError si la descarga falla, y FeedInvalido o FeedDemasiadoGrande
+        como parse_pool.analizar; en ese caso no se guarda nada.
+        """
+        clave = hashlib.sha256(normalizar_url(url).encode()).hexdigest()
+        partes = urlsplit(url.strip())
+        privado = bool(partes.username or partes.password)
+        await self._cargar()
+        async with self._cerrojo(clave):
+            entrada = self._entradas().get(clave)
+            if entrada is not None and not os.path.exists(self._ruta_ics(entrada["contenido"])):
+                entrada = None
+            fresco = entrada is not None and time.time() - entrada["revisadoEn"] < self.fresco_segundos
+            if fresco and not privado and not entrada.get("privado"):
+                return await self._usar(clave, entrada)
+
+            headers = {}
+            if entrada is not None:
+                if entrada.get("etag"):
+                    headers["If-None-Match"] = entrada["etag"]
+                if entrada.get("lastModified"):
+                    headers["If-Modified-Since"] = entrada["lastModified"]
+
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and entrada is not None:
+                    entrada["revisadoEn"] = time.time()
+                    return await self._usar(clave, entrada)
+                response.raise_for_status()
+
+                longitud = response.headers.get("content-length")
+                if longitud and longitud.isdigit() and int(longitud) > ICAL_MAX_BYTES:
+                    raise FeedDemasiadoGrande(f"El feed supera el máximo de {ICAL_MAX_BYTES} bytes")
+
+                contenido = await self._guardar_contenido(response.aiter_bytes())
+                entrada = {
+                    "url": normalizar_url(url),
+                    "contenido": contenido,
+                    "tamaño": self._tamaño(contenido),
+                    "formato": FORMATO_REGISTROS,
+                    "etag": response.headers.get("etag"),
+                    "lastModified": response.headers.get("last-modified"),
+                    "revisadoEn": time.time(),
+                    "usadoEn": time.time(),
+                    "privado": privado,
+                }
+                # Al índice antes de ceder el control: si no, otra limpieza vería el contenido huérfano
+                self._guardar_entrada(clave, entrada)
+            print(f"📥 [feeds] Descargado {entrada['url']} ({contenido[:12]})")
+            return await self._usar(clave, entrada)
+
+    # --- Índice -----------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def _cerrojo(self, clave: str):
+        cerrojo = self._cerrojos.setdefault(clave, [asyncio.Lock(), 0])
+        cerrojo[1] += 1
+        try:
+            async with cerrojo[0]:
+                yield
+        finally:
+            cerrojo[1] -= 1
+            if cerrojo[1] == 0:
+                del self._cerrojos[clave]
+
+    async def _cargar(self):
+        """Lee el índice del disco (en un hilo) la primera vez que se usa la caché."""
+        if self._indice is not None:
+            return
+        if self._cargando is None:
+            self._cargando = asyncio.Lock()
+        async with self._cargando:
+            if self._indice is None:
+                self._indice = await asyncio.get_running_loop().run_in_executor(None, self._leer_indice)
+
+    def _leer_indice(self) -> Dict[str, dict]:
+        """
+        Carga las entradas del índice y borra lo que dejó a medias un arranque anterior:
+        temporales, archivos sin referenciar y registros de un formato anterior.
+        """
+        for carpeta in ("feeds", "contenido", "tmp"):
+            os.makedirs(os.path.join(self.directorio, carpeta), exist_ok=True)
+        indice = {}
+        for nombre in os.listdir(os.path.join(self.directorio, "feeds")):
+            if not nombre.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directorio, "feeds", nombre), encoding="utf-8") as f:
+                    indice[nombre[:-len(".json")]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+        referenciados = {e["contenido"] for e in indice.values()}
+        vigentes = {f"{c}.ics" for c in referenciados} | {os.path.basename(self._ruta_registros(c)) for c in referenciados}
+        carpeta = os.path.join(self.directorio, "contenido")
+        _borrar([os.path.join(carpeta, n) for n in os.listdir(carpeta) if n not in vigentes])
+        tmp = os.path.join(self.directorio, "tmp")
+        _borrar([os.path.join(tmp, n) for n in os.listdir(tmp)])
+        for entrada in indice.values():
+            if "tamaño" not in entrada:
+                entrada["tamaño"] = self._tamaño(entrada["contenido"])
+        return indice
+
+    def _entradas(self) -> Dict[str, dict]:
+        return self._indice
+
+    def _guardar_entrada(self, clave: str, entrada: dict):
+        ruta = os.path.join(self.directorio, "feeds", f"{clave}.json")
+        with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entrada, f)
+        os.replace(ruta + ".tmp", ruta)
+        self._entradas()[clave] = entrada
+
+    async def _usar(self, clave: str, entrada: dict) -> FeedEnCache:
+        if entrada.get("formato") != FORMATO_REGISTROS or not os.path.exists(self._ruta_registros(entrada["contenido"])):
+            await self._reanalizar(entrada["contenido"])
+            entrada["formato"] = FORMATO_REGISTROS
+            entrada["tamaño"] = self._tamaño(entrada["contenido"])
+        entrada["usadoEn"] = time.time()
+        self._guardar_entrada(clave, entrada)
+        feed = FeedEnCache(entrada["contenido"], self._ruta_registros(entrada["contenido"]))
+        await self._liberar_espacio()
+        return feed
+
+    # --- Contenido --------------------------------------------------------------------
+
+    def _ruta_ics(self, contenido: str) -> str:
+        return os.path.join(self.directorio, "contenido", f"{contenido}.ics")
+
+    def _ruta_registros(self, contenido: str) -> str:
+        return os.path.join(self.directorio, "contenido", f"{contenido}.v{FORMATO_REGISTROS}.ndjson")
+
+    def _tamaño(self, contenido: str) -> int:
+        """Bytes en disco de un contenido (el .ics y sus registros)."""
+        total = 0
+        for ruta in (self._ruta_ics(contenido), self._ruta_registros(contenido)):
+            try:
+                total += os.path.getsize(ruta)
+            except FileNotFoundError:
+                pass
+        return total
+
+    async def _guardar_contenido(self, chunks: AsyncIterator[bytes]) -> str:
+        """Guarda los bytes y sus registros analizados a la vez; devuelve el hash del contenido."""
+        sha = hashlib.sha256()
+        tmp = os.path.join(self.directorio, "tmp")
+        ics = tempfile.NamedTemporaryFile("wb", dir=tmp, delete=False)
+        registros = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=tmp, delete=False)
+
+        async def _copiar():
+            async for chunk in chunks:
+                sha.update(chunk)
+                ics.write(chunk)
+                yield chunk
+
+        try:
+            with ics, registros:
+                async for registro in analizar(_copiar()):
+                    registros.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            contenido = sha.hexdigest()
+            os.replace(ics.name, self._ruta_ics(contenido))
+            os.replace(registros.name, self._ruta_registros(contenido))
+            return contenido
+        finally:
+            for nombre in (ics.name, registros.name):
+                if os.path.exists(nombre):
+                    os.remove(nombre)
+
+    async def _reanalizar(self, contenido: str):
+        """Vuelve a generar los registros de un .ics en caché (p. ej. tras cambiar FORMATO_REGISTROS)."""
+        async def _leer():
+            with open(self._ruta_ics(contenido), "rb") as f:
+                while True:
+                    chunk = f.read(64 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.join(self.directorio, "tmp"), delete=False) as f:
+            try:
+                async for registro in analizar(_leer()):
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, self._ruta_registros(contenido))
+
+    async def _liberar_espacio(self):
+        """Expulsa las URL menos usadas hasta que el contenido quepa en max_bytes."""
+        entradas = self._entradas()
+        tamaños = {e["contenido"]: e.get("tamaño", 0) for e in entradas.values()}
+        total = sum(tamaños.values())
+        if total <= self.max_bytes:
+            return
+
+        rutas = []
+        for clave, entrada in sorted(entradas.items(), key=lambda e: e[1].get("usadoEn", 0)):
+            if total <= self.max_bytes:
+                break
+            del entradas[clave]
+            rutas.append(os.path.join(self.directorio, "feeds", f"{clave}.json"))
+            contenido = entrada["contenido"]
+            if all(e["contenido"] != contenido for e in entradas.values()):
+                total -= tamaños[contenido]
+                rutas += [self._ruta_ics(contenido), self._ruta_registros(contenido)]
+            print(f"🧹 [feeds] Expulsado de la caché: {entrada['url']}")
+        await asyncio.get_running_loop().run_in_executor(None, _borrar, rutas)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from pymongo.errors import BulkWriteError
+
+from .bulk_utils import EnvioPorLotes, IMPORT_CONCURRENCY
+from .jobs import Progreso
+from .parse_pool import huella
+
+# URL del microservicio de eventos
+EVENT_SERVICE_URL = os.getenv("EVENT_SERVICE_URL", "http://event_service:8000")
+
+
+async def sincronizar_feed(
+    client: httpx.AsyncClient,
+    registros: AsyncIterator[dict],
+    suscripcion: dict,
+    calendario: Callable[[], Awaitable[str]],
+    mapeo_collection,
+    progreso: Progreso,
+):
+    """
+    Aplica un feed ya analizado (registros de parse_pool.analizar) al calendario de una suscripción comparándolo con lo importado
+    la última vez (colección 'eventos_importados': clave -> idEvento + huella). Solo se
+    insertan los eventos nuevos, se actualizan los que cambian y, si el feed se ha leído
+    entero, se borran los que ya no están. Una importación nueva es el mismo proceso con
+    el mapeo vacío.
+
+    'calendario' devuelve el ID del calendario destino; se llama con el primer evento
+    del feed, así que una importación nueva no crea calendario si el feed no es válido.
+
+    El mapeo se guarda según avanza (cada lote insertado, cada actualización y cada
+    borrado), así que una sincronización interrumpida no deja eventos sin registrar.
+
+    Las series recurrentes se guardan hasta el final del feed para sumarles como
+    excepciones las ocurrencias modificadas (RECURRENCE-ID), lleguen antes o después.
+    """
+    suscripcion_id = suscripcion["_id"]
+    existentes: Dict[str, dict] = {
+        doc["clave"]: doc
+        for doc in mapeo_collection.find({"suscripcion": suscripcion_id}, {"clave": 1, "idEvento": 1, "huella": 1})
+    }
+    vistos: Set[str] = set()
+    calendar_id: Optional[str] = None
+    series: List[Tuple[str, str, dict, str]] = []    # (clave, uid, payload, huella) de las series recurrentes
+    overrides: Dict[str, List[str]] = {}    # uid -> fechas (ISO) de sus ocurrencias modificadas
+    creados: List[Tuple[str, str, str]] = []     # (clave, idEvento, huella) del lote en curso, aún sin guardar
+
+    def guardar_creados():
+        # El mapeo de un lote se guarda en cuanto EventService lo inserta: si la
+        # sincronización se corta después, la siguiente no vuelve a crear esos eventos
+        lote, creados[:] = list(creados), []
+        nuevos = [
+            {"suscripcion": suscripcion_id, "clave": clave, "idEvento": event_id, "huella": h}
+            for clave, event_id, h in lote if clave not in existentes
+        ]
+        if nuevos:
+            try:
+                mapeo_collection.insert_many(nuevos, ordered=False)
+            except BulkWriteError as e:
+                print(f"⚠️ Mapeo de importación no guardado: {len(e.details.get('writeErrors', []))} claves repetidas")
+        for clave, event_id, h in lote:
+            if clave in existentes:
+                guardar(clave, event_id, h)
+
+    def guardar(clave: str, event_id: str, h: str):
+        mapeo_collection.update_one(
+            {"suscripcion": suscripcion_id, "clave": clave},
+            {"$set": {"idEvento": event_id, "huella": h}},
+            upsert=True
+        )
+
+    envio = EnvioPorLotes(client, f"{EVENT_SERVICE_URL}/events/bulk", progreso=progreso, tras_lote=guardar_creados)
+    semaforo = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    tareas: Set[asyncio.Task] = set()
+
+    async def en_paralelo(corrutina):
+        # Como en EnvioPorLotes: se espera turno antes de crear la tarea (memoria acotada)
+        await semaforo.acquire()
+
+        async def ejecutar():
+            try:
+                await corrutina
+            finally:
+                semaforo.release()
+
+        tarea = asyncio.create_task(ejecutar())
+        tareas.add(tarea)
+        tarea.add_done_callback(tareas.discard)
+
+    async def insertar(clave: str, payload: dict, h: str):
+        await envio.add(payload, lambda event_id: creados.append((clave, event_id, h)))
+
+    async def actualizar(clave: str, event_id: str, payload: dict, h: str):
+        try:
+            resp = await client.put(f"{EVENT_SERVICE_URL}/events/{event_id}", json=payload)
+        except httpx.RequestError as e:
+            progreso.error(f"'{payload['titulo']}': {e}")
+            return
+        if resp.status_code == 200:
+            progreso.actualizados += 1
+            guardar(clave, event_id, h)
+        elif resp.status_code == 404:
+            # Lo borraron a mano en Kalendas: se vuelve a crear
+            await insertar(clave, payload, h)
+        else:
+            progreso.error(f"'{payload['titulo']}': {resp.status_code} - {resp.text}")
+
+    async def borrar(clave: str, event_id: str):
+        try:
+            resp = await client.delete(f"{EVENT_SERVICE_URL}/events/{event_id}")
+        except httpx.RequestError as e:
+            progreso.error(f"Borrando {event_id}: {e}")
+            return
+        if resp.status_code in (200, 204, 404):
+            progreso.eliminados += 1
+            mapeo_collection.delete_one({"suscripcion": suscripcion_id, "clave": clave})
+        else:
+            progreso.error(f"Borrando {event_id}: {resp.status_code} - {resp.text}")
+
+    async def aplicar(clave: str, payload: dict, h: str):
+        if clave in vistos:
+            progreso.error(f"'{payload['titulo']}': UID repetido en el feed")
+            return
+        vistos.add(clave)
+        actual = existentes.get(clave)
+        if actual is None:
+            await insertar(clave, payload, h)
+        elif actual["huella"] == h:
+            progreso.sin_cambios += 1
+        else:
+            await en_paralelo(actualizar(clave, actual["idEvento"], payload, h))
+
+    completo = False
+    try:
+        async for registro in registros:
+            if calendar_id is None:
+                calendar_id = await calendario()
+
+            progreso.analizados += 1
+            if registro.get("error"):
+                progreso.error(registro["error"])
+                print(f"⚠️ {registro['error']}")
+                continue
+
+            uid, payload = registro["uid"], registro["payload"]
+            payload.update({
+                "idCalendario": calendar_id,
+                "organizador": suscripcion["organizador"],
+                "emailOrganizador": suscripcion["email_organizador"],
+            })
+            if registro["override"] and uid:
+                overrides.setdefault(uid, []).append(registro["override"])
+            if payload["rrule"] and uid and not registro["override"]:
+                series.append((registro["clave"], uid, payload, registro["huella"]))
+            else:
+                await aplicar(registro["clave"], payload, registro["huella"])
+
+        if calendar_id is None:
+            calendar_id = await calendario()
+
+        # Series recurrentes con todas sus excepciones ya conocidas
+        for clave, uid, payload, h in series:
+            if uid in overrides:
+                payload["fechasExcluidas"].extend(overrides[uid])
+                h = huella(payload)
+            await aplicar(clave, payload, h)
+        completo = True
+    finally:
+        # Primero las actualizaciones en curso: un 404 vuelve a crear el evento y lo encola.
+        # Lo ya encolado se envía siempre (también si el feed se corta)
+        if tareas:
+            await asyncio.gather(*list(tareas))
+        await envio.close()
+
+        # Solo con el feed completo se sabe qué eventos han desaparecido
+        if completo:
+            for clave in existentes.keys() - vistos:
+                await en_paralelo(borrar(clave, existentes[clave]["idEvento"]))
+            if tareas:
+                await asyncio.gather(*list(tareas))
+
@@ -0,0 +1,90 @@
+import codecs
+import os
+from typing import AsyncIterator, List, Optional
+
+# Tamaño máximo de un feed .ics (bytes descargados)
+ICAL_MAX_BYTES = int(os.getenv("ICAL_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+class FeedDemasiadoGrande(Exception):
+    """El feed supera ICAL_MAX_BYTES."""
+
+
+class FeedInvalido(Exception):
+    """El contenido descargado no es un iCalendar."""
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_bytes: int = ICAL_MAX_BYTES) -> AsyncIterator[str]:
+    """
+    Líneas lógicas de un iCalendar a partir de los trozos de la descarga: decodifica de
+    forma incremental, acepta CRLF o LF y "desdobla" las líneas de continuación (las que
+    empiezan por espacio o tabulador se pegan a la anterior, RFC 5545 §3.1).
+    """
+    # utf-8-sig: quita el BOM que añaden algunos exportadores
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    leidos = 0
+    resto = ""
+    actual: Optional[str] = None
+
+    async def _trozos():
+        nonlocal leidos
+        async for chunk in chunks:
+            leidos += len(chunk)
+            if leidos > max_bytes:
+                raise FeedDemasiadoGrande(f"El feed supera el máximo de {max_bytes} bytes")
+            yield decoder.decode(chunk)
+        # Salto final para cerrar la última línea aunque el archivo no termine en uno
+        yield decoder.decode(b"", final=True) + "\n"
+
+    async for texto in _trozos():
+        *lineas, resto = (resto + texto).split("\n")
+        for linea in lineas:
+            linea = linea.rstrip("\r")
+            if not linea:
+                continue
+            if linea[0] in (" ", "\t") and actual is not None:
+                actual += linea[1:]
+                continue
+            if actual is not None:
+                yield actual
+            actual = linea
+
+    if actual is not None:
+        yield actual
+
+
+async def iter_vevent_blocks(chunks: AsyncIterator[bytes], max_bytes: int = ICAL_MAX_BYTES) -> AsyncIterator[str]:
+    """
+    Recorre el feed y devuelve el texto de cada VEVENT (líneas ya desdobladas, unidas con
+    CRLF) según se descarga, sin interpretarlo. En memoria solo está el evento que se está
+    leyendo.
+
+    Lanza FeedInvalido si el contenido no empieza por BEGIN:VCALENDAR y
+    FeedDemasiadoGrande si supera max_bytes.
+    """
+    empezado = False
+    bloque: List[str] = []
+
+    async for linea in iter_lines(chunks, max_bytes):
+        if not empezado:
+            if linea.strip().upper() != "BEGIN:VCALENDAR":
+                raise FeedInvalido("El archivo no es un .ics válido")
+            empezado = True
+            continue
+
+        marca = linea.strip().upper()
+        if not bloque:
+            if marca == "BEGIN:VEVENT":
+                bloque.append(linea)
+            continue
+
+        bloque.append(linea)
+        # Los VEVENT no se anidan: END:VEVENT cierra siempre el bloque, así un subcomponente
+        # sin cerrar solo estropea su evento y no se come el resto del feed
+        if marca == "END:VEVENT":
+            yield "\r\n".join(bloque)
+            bloque = []
+
+    if not empezado:
+        raise FeedInvalido("El archivo no es un .ics válido")
+
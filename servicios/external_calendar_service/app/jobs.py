@@ -0,0 +1,205 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+
+# Importaciones que se ejecutan a la vez en este proceso
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", "2"))
+# Cada cuánto se guarda el progreso (y se renueva la reserva) de un trabajo en curso
+IMPORT_PROGRESS_SECONDS = float(os.getenv("IMPORT_PROGRESS_SECONDS", "2"))
+# Si un trabajo en curso no renueva su reserva en este tiempo se da por interrumpido
+IMPORT_JOB_LEASE_SECONDS = int(os.getenv("IMPORT_JOB_LEASE_SECONDS", "60"))
+# Cada cuánto se mira la cola si no hay avisos
+IMPORT_JOB_POLL_SECONDS = float(os.getenv("IMPORT_JOB_POLL_SECONDS", "5"))
+# Mensajes de error que se guardan por trabajo (el contador 'fallidos' los cuenta todos)
+IMPORT_JOB_MAX_ERRORS = int(os.getenv("IMPORT_JOB_MAX_ERRORS", "50"))
+# Los trabajos terminados se borran solos pasado este tiempo (índice TTL)
+IMPORT_JOB_RETENTION_SECONDS = int(os.getenv("IMPORT_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Estados de un trabajo
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADA = "completada"
+FALLIDA = "fallida"
+
+# Aviso en proceso para no esperar al siguiente sondeo cuando se encola algo
+_hay_trabajo = asyncio.Event()
+
+
+class Progreso:
+    """Contadores de una importación en curso (se copian al documento del trabajo)."""
+
+    def __init__(self, max_errores: int = IMPORT_JOB_MAX_ERRORS):
+        self.max_errores = max_errores
+        self.calendar_id: Optional[str] = None
+        self.analizados = 0
+        self.importados = 0
+        # Solo en resincronizaciones: eventos que cambiaron, que desaparecieron del feed o iguales
+        self.actualizados = 0
+        self.eliminados = 0
+        self.sin_cambios = 0
+        self.fallidos = 0
+        self.errores: List[str] = []
+
+    def importado(self, n: int = 1):
+        self.importados += n
+
+    def error(self, mensaje: str, n: int = 1):
+        self.fallidos += n
+        if len(self.errores) < self.max_errores:
+            self.errores.append(mensaje)
+
+    def as_dict(self) -> dict:
+        return {
+            "calendar_id": self.calendar_id,
+            "analizados": self.analizados,
+            "importados": self.importados,
+            "actualizados": self.actualizados,
+            "eliminados": self.eliminados,
+            "sin_cambios": self.sin_cambios,
+            "fallidos": self.fallidos,
+            "errores": list(self.errores),
+        }
+
+
+def nuevo_trabajo(tipo: str, solicitud: dict) -> dict:
+    """Documento de un trabajo de importación nuevo."""
+    return {
+        "_id": uuid4(),
+        "tipo": tipo,
+        "solicitud": solicitud,
+        "estado": PENDIENTE,
+        "creadaEn": datetime.utcnow(),
+        **Progreso().as_dict(),
+    }
+
+
+def despertar():
+    """Avisa a los workers de que hay un trabajo nuevo."""
+    _hay_trabajo.set()
+
+
+class ImportWorker:
+    """
+    Workers que ejecutan los trabajos de importación (colección 'importaciones').
+
+    Cada worker reserva un trabajo pendiente con find_one_and_update, lo ejecuta y guarda
+    su progreso cada IMPORT_PROGRESS_SECONDS, renovando a la vez la reserva. Un trabajo
+    'en_curso' cuya reserva caduca (el proceso murió a mitad) se marca como fallido en
+    vez de repetirse, porque repetirlo duplicaría los eventos ya creados.
+
+    Cada reserva lleva su propio identificador (reservadaPor) y las escrituras del worker
+    solo se aplican si el trabajo sigue en curso con esa reserva: si se ha dado por
+    interrumpido entretanto, el worker deja de ejecutarlo en vez de pisar su estado.
+    """
+
+    def __init__(
+        self, collection, handler: Callable[[dict, Progreso], Awaitable[None]], workers: int = IMPORT_JOB_WORKERS
+    ):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _marcar_interrumpidos(self):
+        ahora = datetime.utcnow()
+        self.collection.update_many(
+            {"estado": EN_CURSO, "reservadaHasta": {"$lt": ahora}},
+            {"$set": {"estado": FALLIDA, "terminadaEn": ahora, "error": "Importación interrumpida (reinicio del servicio)"},
+             "$unset": {"reservadaHasta": "", "reservadaPor": ""}}
+        )
+
+    def _reservar(self) -> Optional[dict]:
+        ahora = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"estado": PENDIENTE},
+            {"$set": {
+                "estado": EN_CURSO,
+                "empezadaEn": ahora,
+                "reservadaPor": uuid4(),
+                "reservadaHasta": ahora + timedelta(seconds=IMPORT_JOB_LEASE_SECONDS),
+            }},
+            sort=[("creadaEn", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                self._marcar_interrumpidos()
+                trabajo = self._reservar()
+            except Exception as e:
+                print(f"⚠️ [importaciones] Error leyendo la cola de trabajos: {e}")
+                trabajo = None
+
+            if trabajo is None:
+                _hay_trabajo.clear()
+                try:
+                    await asyncio.wait_for(_hay_trabajo.wait(), timeout=IMPORT_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._procesar(trabajo)
+
+    def _guardar(self, trabajo: dict, cambios: dict) -> bool:
+        """Escribe en el trabajo si sigue siendo nuestro; devuelve False si se ha perdido la reserva."""
+        resultado = self.collection.update_one(
+            {"_id": trabajo["_id"], "estado": EN_CURSO, "reservadaPor": trabajo["reservadaPor"]}, cambios
+        )
+        return resultado.matched_count > 0
+
+    async def _guardar_periodicamente(self, trabajo: dict, progreso: Progreso, ejecucion: asyncio.Task):
+        while True:
+            await asyncio.sleep(IMPORT_PROGRESS_SECONDS)
+            try:
+                vigente = self._guardar(trabajo, {"$set": {
+                    **progreso.as_dict(),
+                    "reservadaHasta": datetime.utcnow() + timedelta(seconds=IMPORT_JOB_LEASE_SECONDS),
+                }})
+            except Exception as e:
+                print(f"⚠️ [importaciones] No se pudo guardar el progreso de {trabajo['_id']}: {e}")
+                continue
+            if not vigente:
+                print(f"⚠️ [importaciones] Trabajo {trabajo['_id']} dado por interrumpido: se deja de ejecutar")
+                ejecucion.cancel()
+                return
+
+    async def _procesar(self, trabajo: dict):
+        progreso = Progreso()
+        ejecucion = asyncio.create_task(self.handler(trabajo, progreso))
+        latido = asyncio.create_task(self._guardar_periodicamente(trabajo, progreso, ejecucion))
+        final = {"estado": COMPLETADA}
+        try:
+            await ejecucion
+            print(f"✅ [importaciones] Trabajo {trabajo['_id']} terminado: {progreso.importados} importados, {progreso.fallidos} fallidos")
+        except asyncio.CancelledError:
+            if latido.done() and not latido.cancelled():
+                return  # reserva perdida: el trabajo ya tiene su estado final
+            raise
+        except Exception as e:
+            # HTTPException trae el motivo en 'detail'
+            error = str(getattr(e, "detail", e))
+            print(f"❌ [importaciones] Trabajo {trabajo['_id']} fallido: {error}")
+            final = {"estado": FALLIDA, "error": error}
+        finally:
+            latido.cancel()
+            if not ejecucion.done():
+                ejecucion.cancel()
+        if not self._guardar(trabajo, {
+            "$set": {**progreso.as_dict(), **final, "terminadaEn": datetime.utcnow()},
+            "$unset": {"reservadaHasta": "", "reservadaPor": ""},
+        }):
+            print(f"⚠️ [importaciones] Trabajo {trabajo['_id']} ya no era de este worker: no se guarda su resultado")
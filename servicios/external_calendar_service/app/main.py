@@ -1,64 +1,374 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response, status
 from pydantic import BaseModel, HttpUrl, ConfigDict
+from pymongo import ReturnDocument
+from typing import Optional, Set
+from uuid import UUID, uuid4
 import httpx
-from icalendar import Calendar # type: ignore
+import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
-app = FastAPI(title="External Calendar Adapter")
+from .ical_stream import FeedDemasiadoGrande, FeedInvalido
+from .feed_cache import FeedCache
+from .bulk_utils import EnvioPorLotes
+from .tabular import FORMATOS, TABULAR_MAX_ERRORS, ArchivoInvalido, iter_eventos
+from .feed_sync import sincronizar_feed
+from .parse_pool import cerrar_pool
+from . import database, jobs
+from .jobs import ImportWorker, Progreso
 
 # URLs de tus otros microservicios
 CALENDAR_SERVICE_URL = os.getenv("CALENDAR_SERVICE_URL", "http://calendar_service:8000")
 EVENT_SERVICE_URL = os.getenv("EVENT_SERVICE_URL", "http://event_service:8000")
 
+# Resincronización de los calendarios importados: cada cuánto se vuelve a pedir cada feed,
+# cada cuánto se buscan suscripciones pendientes y cuántas se sincronizan a la vez
+SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", "3600"))
+SYNC_POLL_SECONDS = float(os.getenv("SYNC_POLL_SECONDS", "60"))
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "5"))
+
+# Feeds descargados y analizados, compartidos por todas las suscripciones a la misma URL
+FEED_CACHE = FeedCache()
+
+# Header User-Agent para evitar bloqueo de Google
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
 class ImportRequest(BaseModel):
     url: HttpUrl
     titulo_importado: str
     organizador: str
+    email_organizador: str  # EventService lo exige en cada evento
 
     model_config = ConfigDict(
         json_schema_extra={
             "example": {
                 "url": "https://www.officeholidays.com/ics/spain",
                 "titulo_importado": "Festivos España 2025",
-                "organizador": "OfficeHolidays"
+                "organizador": "OfficeHolidays",
+                "email_organizador": "usuario@gmail.com"
             }
         }
     )
 
-@app.post("/import/ical")
-async def import_from_ical(request: ImportRequest):
+async def run_import_job(trabajo: dict, progreso: Progreso):
+    """Manejador de los workers de importación (ver jobs.ImportWorker)."""
+    if trabajo["tipo"] == "ical":
+        request = ImportRequest.model_validate(trabajo["solicitud"])
+        # Toda importación queda como suscripción: el planificador la resincroniza después
+        suscripcion = {
+            "_id": uuid4(),
+            "url": str(request.url),
+            "titulo": request.titulo_importado,
+            "organizador": request.organizador,
+            "email_organizador": request.email_organizador,
+            "calendar_id": None,
+            "creadaEn": datetime.utcnow(),
+        }
+        await _sincronizar(suscripcion, progreso, nueva=True)
+    else:
+        raise ValueError(f"Tipo de importación desconocido: {trabajo['tipo']}")
+
+
+async def _sincronizar_con_turno(suscripcion: dict, semaforo: asyncio.Semaphore):
+    try:
+        progreso = Progreso()
+        if await _sincronizar(suscripcion, progreso):
+            print(f"🔄 Suscripción '{suscripcion['titulo']}': {progreso.importados} nuevos, "
+                  f"{progreso.actualizados} actualizados, {progreso.eliminados} eliminados, {progreso.fallidos} fallidos")
+    except Exception as e:
+        error = str(getattr(e, "detail", e))
+        print(f"⚠️ Error sincronizando '{suscripcion['titulo']}': {error}")
+        database.suscripciones_collection.update_one({"_id": suscripcion["_id"]}, {"$set": {"ultimoError": error}})
+    finally:
+        semaforo.release()
+
+
+# Sincronizaciones en curso del planificador (el lifespan las cancela al parar)
+SINCRONIZACIONES: Set[asyncio.Task] = set()
+
+
+async def sincronizar_periodicamente():
     """
-    Importa un calendario y muestra errores detallados si fallan los eventos.
+    Job en segundo plano: reserva las suscripciones cuya proximaSync ha vencido (moviéndola
+    ya al siguiente intervalo, así otra instancia no la coge) y las sincroniza, como mucho
+    SYNC_CONCURRENCY a la vez.
     """
-    # Header User-Agent para evitar bloqueo de Google
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    semaforo = asyncio.Semaphore(SYNC_CONCURRENCY)
+    while True:
+        try:
+            while True:
+                ahora = datetime.utcnow()
+                suscripcion = database.suscripciones_collection.find_one_and_update(
+                    {"proximaSync": {"$lte": ahora}},
+                    {"$set": {"proximaSync": ahora + timedelta(seconds=SYNC_INTERVAL_SECONDS)}},
+                    sort=[("proximaSync", 1)],
+                    return_document=ReturnDocument.AFTER
+                )
+                if suscripcion is None:
+                    break
+                await semaforo.acquire()
+                tarea = asyncio.create_task(_sincronizar_con_turno(suscripcion, semaforo))
+                SINCRONIZACIONES.add(tarea)
+                tarea.add_done_callback(SINCRONIZACIONES.discard)
+        except Exception as e:
+            print(f"⚠️ Error buscando suscripciones pendientes: {e}")
+        await asyncio.sleep(SYNC_POLL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Índices de MongoDB, workers de los trabajos de importación y planificador de resincronización
+    # (el pool de procesos que analiza los feeds se crea con la primera importación)
+    database.ensure_indexes()
+    worker = ImportWorker(database.importaciones_collection, run_import_job)
+    worker.start()
+    planificador = asyncio.create_task(sincronizar_periodicamente())
+    yield
+    for tarea in (planificador, *SINCRONIZACIONES):
+        tarea.cancel()
+    await asyncio.gather(planificador, *SINCRONIZACIONES, return_exceptions=True)
+    await worker.stop()
+    await cerrar_pool()
+
+
+app = FastAPI(title="External Calendar Adapter", lifespan=lifespan)
+
+
+def _job_response(trabajo: dict) -> dict:
+    """Estado público de un trabajo de importación."""
+    return {
+        "id": trabajo["_id"],
+        "tipo": trabajo["tipo"],
+        "estado": trabajo["estado"],
+        "creadaEn": trabajo["creadaEn"],
+        "empezadaEn": trabajo.get("empezadaEn"),
+        "terminadaEn": trabajo.get("terminadaEn"),
+        "calendar_id": trabajo.get("calendar_id"),
+        "analizados": trabajo.get("analizados", 0),
+        "importados": trabajo.get("importados", 0),
+        "actualizados": trabajo.get("actualizados", 0),
+        "eliminados": trabajo.get("eliminados", 0),
+        "sin_cambios": trabajo.get("sin_cambios", 0),
+        "fallidos": trabajo.get("fallidos", 0),
+        "errores": trabajo.get("errores", []),
+        "error": trabajo.get("error"),
     }
-    
-    client = httpx.AsyncClient(follow_redirects=True, headers=headers)
-    
-    # 1. Descargar .ics
+
+
+def _subscription_response(suscripcion: dict) -> dict:
+    """Estado público de una suscripción (sin el hash del último contenido aplicado)."""
+    return {
+        "id": suscripcion["_id"],
+        "url": suscripcion["url"],
+        "titulo": suscripcion["titulo"],
+        "calendar_id": suscripcion["calendar_id"],
+        "ultimaSync": suscripcion.get("ultimaSync"),
+        "proximaSync": suscripcion.get("proximaSync"),
+        "ultimoResultado": suscripcion.get("ultimoResultado"),
+        "ultimoError": suscripcion.get("ultimoError"),
+    }
+
+
+@app.post("/import/ical", status_code=status.HTTP_202_ACCEPTED)
+async def import_from_ical(request: ImportRequest):
+    """
+    Encola la importación de un calendario y responde al momento (202) con el ID del
+    trabajo; el progreso se consulta en GET /import/jobs/{id}. El calendario importado
+    queda suscrito al feed y se resincroniza cada SYNC_INTERVAL_SECONDS.
+    """
+    trabajo = jobs.nuevo_trabajo("ical", request.model_dump(mode="json"))
+    database.importaciones_collection.insert_one(trabajo)
+    jobs.despertar()
+    return {"job_id": trabajo["_id"], "estado": trabajo["estado"], "url_estado": f"/import/jobs/{trabajo['_id']}"}
+
+
+@app.get("/import/jobs/{job_id}")
+async def get_import_job(job_id: UUID):
+    """Estado y progreso (analizados, importados, fallidos, errores) de una importación."""
+    trabajo = database.importaciones_collection.find_one({"_id": job_id})
+    if not trabajo:
+        raise HTTPException(status_code=404, detail=f"Importación {job_id} no encontrada")
+    return _job_response(trabajo)
+
+
+@app.post("/import/tabular")
+async def import_tabular(
+    request: Request,
+    titulo_importado: str = Query(..., min_length=1),
+    organizador: str = Query(...),
+    email_organizador: str = Query(...),
+    formato: Optional[str] = Query(None, description="csv o ndjson; si no se indica, según el Content-Type"),
+    separador: str = Query(",", min_length=1, max_length=1, description="Separador de columnas del CSV"),
+    columnas: Optional[str] = Query(
+        None, description='Mapeo JSON campo -> columna, p. ej. {"titulo": "Asunto", "horaComienzo": "Inicio"}'
+    ),
+):
+    """
+    Importa eventos de un CSV (con cabecera) o NDJSON enviado como cuerpo de la petición,
+    p. ej. `curl --data-binary @eventos.csv -H "Content-Type: text/csv" ...`.
+
+    El archivo se lee según llega: cada fila se valida y los eventos válidos se insertan
+    en lotes (POST /events/bulk) mientras se sigue leyendo, así que la memoria no depende
+    del tamaño del archivo. Las filas no válidas o rechazadas por EventService se informan
+    por número de línea sin detener la importación. El calendario contenedor se crea con
+    la primera fila válida.
+    """
+    if formato is None:
+        tipo = request.headers.get("content-type", "")
+        formato = "csv" if "csv" in tipo else "ndjson" if ("ndjson" in tipo or "jsonl" in tipo) else None
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=415, detail=f"Formato no soportado: indica formato={' o '.join(FORMATOS)} o el Content-Type")
     try:
-        response = await client.get(str(request.url))
-        response.raise_for_status()
-    except Exception as e:
+        mapeo = json.loads(columnas) if columnas else {}
+    except ValueError:
+        mapeo = None
+    if not isinstance(mapeo, dict) or not all(isinstance(v, str) for v in mapeo.values()):
+        raise HTTPException(status_code=422, detail="columnas debe ser un objeto JSON campo -> nombre de columna")
+
+    importacion = {"titulo": titulo_importado, "organizador": organizador, "email_organizador": email_organizador}
+    progreso = Progreso(max_errores=TABULAR_MAX_ERRORS)
+    client = httpx.AsyncClient()
+    envio = EnvioPorLotes(client, f"{EVENT_SERVICE_URL}/events/bulk", progreso=progreso)
+    try:
+        try:
+            async for numero, evento, error in iter_eventos(request.stream(), formato, mapeo, separador):
+                progreso.analizados += 1
+                if error is not None:
+                    progreso.error(f"Fila {numero}: {error}")
+                    continue
+                if progreso.calendar_id is None:
+                    progreso.calendar_id = await _create_calendar(client, importacion)
+                evento.update({
+                    "idCalendario": progreso.calendar_id,
+                    "organizador": organizador,
+                    "emailOrganizador": email_organizador,
+                })
+                await envio.add(evento, etiqueta=f"Fila {numero}")
+        finally:
+            # Lo ya encolado se envía siempre (también si el archivo se corta)
+            await envio.close()
+    except ArchivoInvalido as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except FeedDemasiadoGrande as e:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{e}. Importados hasta el corte: {progreso.importados} (calendario {progreso.calendar_id})"
+        )
+    finally:
         await client.aclose()
-        print(f"❌ Error descargando ICS: {e}")
-        raise HTTPException(status_code=400, detail=f"Error descargando URL externa: {str(e)}")
 
-    # 2. Parsear
+    print(f"✅ Importación tabular '{titulo_importado}': {progreso.importados} importados, {progreso.fallidos} fallidos")
+    return {
+        k: v for k, v in progreso.as_dict().items()
+        if k in ("calendar_id", "analizados", "importados", "fallidos", "errores")
+    }
+
+
+@app.get("/import/subscriptions")
+async def list_subscriptions(calendar_id: Optional[str] = None):
+    """Feeds suscritos (opcionalmente, el de un calendario) y el resultado de su última sincronización."""
+    filtro = {"calendar_id": calendar_id} if calendar_id else {}
+    return [_subscription_response(s) for s in database.suscripciones_collection.find(filtro)]
+
+
+@app.delete("/import/subscriptions/{subscription_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_subscription(subscription_id: UUID):
+    """Deja de sincronizar un calendario importado (sus eventos se conservan)."""
+    result = database.suscripciones_collection.delete_one({"_id": subscription_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail=f"Suscripción {subscription_id} no encontrada")
+    database.eventos_importados_collection.delete_many({"suscripcion": subscription_id})
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def _sincronizar(suscripcion: dict, progreso: Progreso, nueva: bool = False) -> bool:
+    """
+    Obtiene el feed de una suscripción (de la caché compartida, que lo revalida con
+    ETag/Last-Modified) y aplica los cambios a su calendario. Devuelve False si el
+    contenido es el mismo que se aplicó la última vez: un feed sin cambios no cuesta
+    nada más que, como mucho, una petición condicional.
+
+    Con nueva=True es la primera importación: se crea el calendario y la suscripción.
+    """
+    client = httpx.AsyncClient(follow_redirects=True, headers={"User-Agent": USER_AGENT})
     try:
-        cal_content = Calendar.from_ical(response.content)
-    except Exception as e:
+        # 1. Descargar (o revalidar) y analizar el feed, una vez para todos sus suscriptores
+        try:
+            feed = await FEED_CACHE.obtener(client, suscripcion["url"])
+        except httpx.HTTPError as e:
+            print(f"❌ Error descargando ICS: {e}")
+            raise HTTPException(status_code=400, detail=f"Error descargando URL externa: {str(e)}")
+        except FeedInvalido as e:
+            print(f"❌ Error parseando ICS: {e}")
+            raise HTTPException(status_code=422, detail="El archivo no es un .ics válido")
+        except FeedDemasiadoGrande as e:
+            print(f"❌ {e}")
+            raise HTTPException(status_code=413, detail=str(e))
+
+        try:
+            if not nueva and feed.contenido == suscripcion.get("contenido"):
+                database.suscripciones_collection.update_one(
+                    {"_id": suscripcion["_id"]},
+                    {"$set": {"ultimaSync": datetime.utcnow()}, "$unset": {"ultimoError": ""}}
+                )
+                return False
+
+            if not nueva and not await _calendar_exists(client, suscripcion["calendar_id"]):
+                # Borraron el calendario en Kalendas: la suscripción ya no tiene destino
+                print(f"🗑️ El calendario de '{suscripcion['titulo']}' ya no existe; se elimina la suscripción")
+                database.suscripciones_collection.delete_one({"_id": suscripcion["_id"]})
+                database.eventos_importados_collection.delete_many({"suscripcion": suscripcion["_id"]})
+                return False
+
+            async def calendario() -> str:
+                # El calendario se crea con el primer evento del feed, no antes
+                if suscripcion["calendar_id"] is None:
+                    suscripcion["calendar_id"] = await _create_calendar(client, suscripcion)
+                    suscripcion["proximaSync"] = datetime.utcnow() + timedelta(seconds=SYNC_INTERVAL_SECONDS)
+                    database.suscripciones_collection.insert_one(suscripcion)
+                progreso.calendar_id = suscripcion["calendar_id"]
+                return suscripcion["calendar_id"]
+
+            # 2. Aplicar los eventos ya analizados
+            await sincronizar_feed(
+                client, feed.registros(), suscripcion, calendario,
+                database.eventos_importados_collection, progreso
+            )
+        finally:
+            feed.cerrar()
+
+        # 3. Contenido aplicado: si no cambia, la próxima sincronización no hace nada
+        database.suscripciones_collection.update_one(
+            {"_id": suscripcion["_id"]},
+            {"$set": {
+                "contenido": feed.contenido,
+                "ultimaSync": datetime.utcnow(),
+                "ultimoResultado": {k: v for k, v in progreso.as_dict().items() if k not in ("calendar_id", "errores")},
+            }, "$unset": {"ultimoError": "", "etag": "", "lastModified": ""}}
+        )
+    finally:
         await client.aclose()
-        print(f"❌ Error parseando ICS: {e}")
-        raise HTTPException(status_code=422, detail="El archivo no es un .ics válido")
 
-    # 3. Crear Calendario Padre
+    print(f"✅ Feed '{suscripcion['titulo']}': {progreso.importados} nuevos, {progreso.actualizados} actualizados, "
+          f"{progreso.eliminados} eliminados, {progreso.fallidos} fallidos")
+    return True
+
+
+async def _calendar_exists(client: httpx.AsyncClient, calendar_id: str) -> bool:
+    try:
+        resp = await client.get(f"{CALENDAR_SERVICE_URL}/calendars/{calendar_id}")
+    except httpx.RequestError:
+        return True  # ante la duda no se borra nada
+    return resp.status_code != 404
+
+
+async def _create_calendar(client: httpx.AsyncClient, suscripcion: dict) -> str:
+    """Crea el calendario contenedor de la importación y devuelve su ID."""
     new_calendar_payload = {
-        "titulo": request.titulo_importado,
-        "organizador": request.organizador,
+        "titulo": suscripcion["titulo"],
+        "organizador": suscripcion["organizador"],
         "palabras_clave": ["importado", "externo"],
         "es_publico": True,
         "idCalendarioPadre": None
@@ -67,83 +377,13 @@ async def import_from_ical(request: ImportRequest):
     try:
         cal_response = await client.post(f"{CALENDAR_SERVICE_URL}/calendars/", json=new_calendar_payload)
         cal_response.raise_for_status() # Lanza error si falla
-    except Exception as e:
-        await client.aclose()
-        print(f"❌ Error creando calendario contenedor: {cal_response.text}")
-        raise HTTPException(status_code=500, detail=f"Error creando calendario interno: {cal_response.text}")
+    except httpx.HTTPStatusError as e:
+        print(f"❌ Error creando calendario contenedor: {e.response.text}")
+        raise HTTPException(status_code=500, detail=f"Error creando calendario interno: {e.response.text}")
+    except httpx.RequestError as e:
+        print(f"❌ Error creando calendario contenedor: {e}")
+        raise HTTPException(status_code=500, detail=f"Error creando calendario interno: {str(e)}")
     
-    calendar_data = cal_response.json()
-    calendar_id = calendar_data["_id"]
+    calendar_id = cal_response.json()["_id"]
     print(f"✅ Calendario creado: {calendar_id}")
-
-    # 4. Procesar Eventos con Control de Errores
-    imported_count = 0
-    errors_count = 0
-    
-    for component in cal_content.walk():
-        if component.name == "VEVENT":
-            try:
-                summary = str(component.get('summary', 'Sin título'))
-                # Validación básica: Si no tiene título o es muy corto, EventService podría rechazarlo
-                if len(summary) < 3: summary += " (Importado)"
-
-                dtstart = component.get('dtstart').dt
-                
-                # Normalización de Fechas (datetime vs date)
-                if not isinstance(dtstart, datetime):
-                    dtstart = datetime.combine(dtstart, datetime.min.time())
-                
-                # Normalización de Timezone (MongoDB prefiere naive o UTC)
-                if dtstart.tzinfo is not None:
-                    dtstart = dtstart.replace(tzinfo=None)
-
-                # Duración
-                dtend = component.get('dtend')
-                duration_min = 60
-                if dtend:
-                    dtend = dtend.dt
-                    if not isinstance(dtend, datetime):
-                        dtend = datetime.combine(dtend, datetime.min.time())
-                    # Quitar timezone también en fin
-                    if dtend.tzinfo is not None:
-                        dtend = dtend.replace(tzinfo=None)
-                        
-                    duration_min = int((dtend - dtstart).total_seconds() / 60)
-                
-                if duration_min <= 0: duration_min = 30 # Evitar duraciones negativas/cero
-
-                location = str(component.get('location', 'Remoto'))
-
-                event_payload = {
-                    "idCalendario": calendar_id,
-                    "titulo": summary[:100], # Cortar si es muy largo
-                    "horaComienzo": dtstart.isoformat(),
-                    "duracionMinutos": duration_min,
-                    "lugar": location[:100],
-                    "organizador": request.organizador,
-                    "contenidoAdjunto": {
-                        "imagenes": [], "archivos": [], "mapa": None
-                    }
-                }
-
-                # INSERTAR Y VERIFICAR RESPUESTA
-                evt_resp = await client.post(f"{EVENT_SERVICE_URL}/events/", json=event_payload)
-                
-                if evt_resp.status_code == 201:
-                    imported_count += 1
-                else:
-                    errors_count += 1
-                    print(f"⚠️ Fallo al importar evento '{summary}': {evt_resp.status_code} - {evt_resp.text}")
-
-            except Exception as e:
-                errors_count += 1
-                print(f"⚠️ Excepción procesando evento: {str(e)}")
-
-    await client.aclose()
-    
-    return {
-        "message": f"Proceso finalizado. Importados: {imported_count}. Fallidos: {errors_count}",
-        "calendar_id": calendar_id,
-        "events_imported": imported_count,
-        "events_failed": errors_count
-    }
\ No newline at end of file
+    return calendar_id
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from collections import deque
+from typing import AsyncIterator, Deque, List, Optional, Tuple
+
+from icalendar import Event # type: ignore
+
+from .ical_stream import ICAL_MAX_BYTES, iter_vevent_blocks
+
+# Procesos que interpretan y normalizan los VEVENT (0 = en el propio proceso, sin pool)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# VEVENT que se mandan juntos a un proceso y trozos en vuelo por importación
+PARSE_CHUNK_EVENTS = int(os.getenv("PARSE_CHUNK_EVENTS", "200"))
+PARSE_MAX_PENDING = int(os.getenv("PARSE_MAX_PENDING", str(max(2, PARSE_WORKERS * 2))))
+
+# Campos que pone cada suscripción al enviar el evento: no forman parte del resultado del
+# análisis (que se comparte entre suscripciones del mismo feed) ni de su huella
+CAMPOS_SUSCRIPCION = ("idCalendario", "organizador", "emailOrganizador")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _to_naive_datetime(value) -> datetime:
+    """Normaliza date/datetime de iCal a datetime sin zona horaria (lo que guarda MongoDB)."""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    return value
+
+
+def _extract_recurrence(component):
+    """
+    Devuelve (rrule, fechas_excluidas) de un VEVENT. El UNTIL se pasa a hora local
+    sin zona para que sea coherente con horaComienzo.
+    """
+    rrule = component.get('rrule')
+    if not rrule:
+        return None, []
+
+    if 'UNTIL' in rrule:
+        rrule['UNTIL'] = [_to_naive_datetime(until) for until in rrule['UNTIL']]
+    rrule_str = rrule.to_ical().decode()
+
+    exdates = component.get('exdate') or []
+    if not isinstance(exdates, list):
+        exdates = [exdates]
+    fechas = [_to_naive_datetime(d.dt) for exdate in exdates for d in exdate.dts]
+    return rrule_str, [f.isoformat() for f in fechas]
+
+
+def _event_payload(component) -> dict:
+    """
+    Convierte un VEVENT en el cuerpo que espera EventService, sin los campos que pone cada
+    suscripción (CAMPOS_SUSCRIPCION): así el mismo resultado sirve para todas.
+    """
+    summary = str(component.get('summary', 'Sin título'))
+    # Validación básica: Si no tiene título o es muy corto, EventService podría rechazarlo
+    if len(summary) < 3: summary += " (Importado)"
+
+    # Normalización de Fechas (datetime vs date) y de Timezone (MongoDB prefiere naive o UTC)
+    dtstart = _to_naive_datetime(component.get('dtstart').dt)
+
+    # Duración
+    dtend = component.get('dtend')
+    duration_min = 60
+    if dtend:
+        dtend = _to_naive_datetime(dtend.dt)
+        duration_min = int((dtend - dtstart).total_seconds() / 60)
+    
+    if duration_min <= 0: duration_min = 30 # Evitar duraciones negativas/cero
+
+    location = str(component.get('location', 'Remoto'))
+
+    rrule, exdates = _extract_recurrence(component)
+
+    return {
+        "titulo": summary[:100], # Cortar si es muy largo
+        "horaComienzo": dtstart.isoformat(),
+        "duracionMinutos": duration_min,
+        "lugar": location[:100],
+        "contenidoAdjunto": {
+            "imagenes": [], "archivos": [], "mapa": None
+        },
+        "rrule": rrule,
+        "fechasExcluidas": exdates
+    }
+
+
+def clave_evento(component, payload: dict) -> str:
+    """
+    Identificador estable de un VEVENT dentro de su feed: el UID (más el RECURRENCE-ID en
+    las ocurrencias modificadas). Los eventos sin UID se identifican por su contenido.
+    """
+    uid = component.get('uid')
+    if not uid:
+        return f"sin-uid:{huella(payload)}"
+    recurrence_id = component.get('recurrence-id')
+    if recurrence_id:
+        return f"{uid}|{_to_naive_datetime(recurrence_id.dt).isoformat()}"
+    return str(uid)
+
+
+def huella(payload: dict) -> str:
+    """Hash del contenido de un evento: si no cambia, el evento no se toca al sincronizar."""
+    contenido = {k: v for k, v in payload.items() if k not in CAMPOS_SUSCRIPCION}
+    return hashlib.sha256(json.dumps(contenido, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def normalizar_bloques(bloques: List[str]) -> List[dict]:
+    """
+    Se ejecuta en el pool: interpreta cada VEVENT (texto ya desdoblado) y devuelve por
+    cada uno un registro compacto {clave, uid, override, payload, huella} o {error}.
+    """
+    resultados = []
+    for bloque in bloques:
+        try:
+            component = Event.from_ical(bloque)
+            payload = _event_payload(component)
+            recurrence_id = component.get('recurrence-id')
+            resultados.append({
+                "clave": clave_evento(component, payload),
+                "uid": str(component.get('uid')) if component.get('uid') else None,
+                "override": _to_naive_datetime(recurrence_id.dt).isoformat() if recurrence_id else None,
+                "payload": payload,
+                "huella": huella(payload),
+            })
+        except Exception as e:
+            resultados.append({"error": f"Evento con formato no válido: {e}"})
+    return resultados
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # 'spawn': los procesos hijos no heredan los hilos del servicio (cliente de MongoDB, etc.)
+        _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _reiniciar_pool(roto: Optional[ProcessPoolExecutor]):
+    """Descarta un pool roto (murió uno de sus procesos); el siguiente _get_pool crea otro."""
+    global _pool
+    if roto is None:
+        return
+    if _pool is roto:
+        _pool = None
+        print("⚠️ [parse] Un proceso de análisis ha muerto: se crea un pool nuevo")
+    roto.shutdown(wait=False, cancel_futures=True)
+
+
+def _normalizar_en_pool(bloques: List[str]) -> Tuple[Optional[ProcessPoolExecutor], "asyncio.Future[List[dict]]"]:
+    """Manda un trozo al pool; devuelve el pool usado (None si no hay) y el futuro de su resultado."""
+    loop = asyncio.get_running_loop()
+    if PARSE_WORKERS <= 0:
+        futuro = loop.create_future()
+        futuro.set_result(normalizar_bloques(bloques))
+        return None, futuro
+    pool = _get_pool()
+    try:
+        return pool, loop.run_in_executor(pool, normalizar_bloques, bloques)
+    except BrokenProcessPool:
+        _reiniciar_pool(pool)
+        pool = _get_pool()
+        return pool, loop.run_in_executor(pool, normalizar_bloques, bloques)
+
+
+async def _resultado(bloques: List[str], pool: Optional[ProcessPoolExecutor], futuro) -> List[dict]:
+    """
+    Espera el resultado de un trozo. Si el pool se ha roto, se rehace y el trozo se
+    reintenta una vez; si vuelve a fallar, la importación falla con BrokenProcessPool.
+    """
+    try:
+        return await futuro
+    except BrokenProcessPool:
+        _reiniciar_pool(pool)
+        _, futuro = _normalizar_en_pool(bloques)
+        return await futuro
+
+
+async def analizar(chunks: AsyncIterator[bytes], max_bytes: int = ICAL_MAX_BYTES) -> AsyncIterator[dict]:
+    """
+    Registros normalizados (ver normalizar_bloques) de un feed, en el orden del feed. El
+    análisis va al pool en trozos de PARSE_CHUNK_EVENTS VEVENT; aquí solo se lee la
+    descarga. Como mucho hay PARSE_MAX_PENDING trozos en vuelo, así que la memoria no
+    depende del tamaño del feed.
+
+    Lanza FeedInvalido y FeedDemasiadoGrande como iter_vevent_blocks.
+    """
+    pendientes: Deque[Tuple[List[str], Optional[ProcessPoolExecutor], "asyncio.Future[List[dict]]"]] = deque()
+    trozo: List[str] = []
+    try:
+        async for bloque in iter_vevent_blocks(chunks, max_bytes):
+            trozo.append(bloque)
+            if len(trozo) >= PARSE_CHUNK_EVENTS:
+                pendientes.append((trozo, *_normalizar_en_pool(trozo)))
+                trozo = []
+                if len(pendientes) >= PARSE_MAX_PENDING:
+                    for registro in await _resultado(*pendientes.popleft()):
+                        yield registro
+        if trozo:
+            pendientes.append((trozo, *_normalizar_en_pool(trozo)))
+        while pendientes:
+            for registro in await _resultado(*pendientes.popleft()):
+                yield registro
+    finally:
+        # Trozos que ya no se van a atender (el feed se cortó o se dejó de leer)
+        for _, _, futuro in pendientes:
+            futuro.cancel()
+
+
+async def cerrar_pool():
+    """Para el pool al apagar el servicio; shutdown espera a los procesos, así que va en un hilo."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(cancel_futures=True))
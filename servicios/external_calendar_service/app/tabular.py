@@ -0,0 +1,185 @@
+import codecs
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from .ical_stream import FeedDemasiadoGrande
+
+# Tamaño máximo de un archivo CSV/NDJSON subido (bytes)
+TABULAR_MAX_BYTES = int(os.getenv("TABULAR_MAX_BYTES", str(200 * 1024 * 1024)))
+# Errores por fila que se devuelven en la respuesta (el contador 'fallidos' los cuenta todos)
+TABULAR_MAX_ERRORS = int(os.getenv("TABULAR_MAX_ERRORS", "1000"))
+
+FORMATOS = ("csv", "ndjson")
+# Campos de un evento que se pueden leer del archivo; el mapeo de columnas dice en qué
+# columna (CSV) o clave (NDJSON) está cada uno y, si no se indica, se busca por su nombre
+CAMPOS = ("titulo", "horaComienzo", "duracionMinutos", "horaFin", "lugar", "rrule")
+DURACION_POR_DEFECTO = 60
+
+
+class ArchivoInvalido(Exception):
+    """El archivo no se puede importar (formato desconocido, cabecera sin columnas obligatorias...)."""
+
+
+async def _lineas(chunks: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[str]:
+    """Líneas del archivo (sin el salto final) según se reciben; acepta CRLF o LF."""
+    # utf-8-sig: quita el BOM que añaden Excel y otros exportadores
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    leidos = 0
+    resto = ""
+    async for chunk in chunks:
+        leidos += len(chunk)
+        if leidos > max_bytes:
+            raise FeedDemasiadoGrande(f"El archivo supera el máximo de {max_bytes} bytes")
+        *lineas, resto = (resto + decoder.decode(chunk)).split("\n")
+        for linea in lineas:
+            yield linea.rstrip("\r")
+    resto += decoder.decode(b"", final=True)
+    if resto:
+        yield resto.rstrip("\r")
+
+
+async def _filas_csv(chunks: AsyncIterator[bytes], separador: str, max_bytes: int) -> AsyncIterator[Tuple[int, List[str]]]:
+    """
+    Registros de un CSV con el número de línea donde empieza cada uno. Un campo entre
+    comillas puede tener saltos de línea: el registro sigue hasta que las comillas cuadran.
+    """
+    numero = 0
+    inicio = 0
+    comillas = 0
+    pendiente: List[str] = []
+    async for linea in _lineas(chunks, max_bytes):
+        numero += 1
+        if not pendiente:
+            inicio = numero
+        pendiente.append(linea)
+        comillas += linea.count('"')
+        if comillas % 2:
+            continue
+        registro, pendiente, comillas = "\n".join(pendiente), [], 0
+        if registro.strip():
+            yield inicio, next(csv.reader([registro], delimiter=separador))
+    if pendiente:
+        yield inicio, next(csv.reader(["\n".join(pendiente)], delimiter=separador))
+
+
+def _texto(valor) -> Optional[str]:
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    return valor or None
+
+
+def _fecha(valor: str, campo: str) -> datetime:
+    try:
+        # fromisoformat de Python 3.9 no acepta la 'Z' de UTC
+        fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"{campo}: fecha no válida '{valor}' (se espera ISO 8601, p. ej. 2025-03-01T10:00)")
+    # Sin zona horaria, como las fechas importadas de iCal
+    return fecha.replace(tzinfo=None)
+
+
+def fila_a_evento(fila: Dict[str, object], columnas: Dict[str, str]) -> dict:
+    """
+    Convierte una fila (columna -> valor) en el cuerpo que espera EventService, sin los
+    campos de la importación (idCalendario, organizador, emailOrganizador). Lanza
+    ValueError con el motivo si la fila no es válida.
+    """
+    valores = {campo: _texto(fila.get(columnas.get(campo, campo))) for campo in CAMPOS}
+
+    titulo = valores["titulo"]
+    if not titulo or len(titulo) < 3:
+        raise ValueError("titulo: obligatorio, de al menos 3 caracteres")
+    if not valores["horaComienzo"]:
+        raise ValueError("horaComienzo: obligatoria")
+    comienzo = _fecha(valores["horaComienzo"], "horaComienzo")
+
+    if valores["duracionMinutos"]:
+        try:
+            duracion = int(float(valores["duracionMinutos"]))
+        except (ValueError, OverflowError):
+            raise ValueError(f"duracionMinutos: no es un número '{valores['duracionMinutos']}'")
+    elif valores["horaFin"]:
+        duracion = int((_fecha(valores["horaFin"], "horaFin") - comienzo) / timedelta(minutes=1))
+    else:
+        duracion = DURACION_POR_DEFECTO
+    if duracion <= 0:
+        raise ValueError("La duración debe ser mayor que cero")
+
+    return {
+        "titulo": titulo[:100],
+        "horaComienzo": comienzo.isoformat(),
+        "duracionMinutos": duracion,
+        "lugar": (valores["lugar"] or "")[:100],
+        "rrule": valores["rrule"],
+        "fechasExcluidas": [],
+    }
+
+
+async def iter_eventos(
+    chunks: AsyncIterator[bytes],
+    formato: str,
+    columnas: Optional[Dict[str, str]] = None,
+    separador: str = ",",
+    max_bytes: int = TABULAR_MAX_BYTES,
+) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Recorre un CSV (con cabecera) o NDJSON (un objeto por línea) según se recibe y
+    devuelve por cada fila (número de línea, evento, None) o (número de línea, None,
+    error): una fila mala no detiene la importación.
+
+    Lanza ArchivoInvalido si el formato no se conoce o a la cabecera del CSV le faltan
+    las columnas obligatorias, y FeedDemasiadoGrande si el archivo supera max_bytes.
+    """
+    columnas = columnas or {}
+    desconocidos = set(columnas) - set(CAMPOS)
+    if desconocidos:
+        raise ArchivoInvalido(f"Campos desconocidos en el mapeo: {', '.join(sorted(desconocidos))}")
+
+    if formato == "csv":
+        cabecera: Optional[List[str]] = None
+        async for numero, valores in _filas_csv(chunks, separador, max_bytes):
+            if cabecera is None:
+                cabecera = [c.strip() for c in valores]
+                faltan = [columnas.get(c, c) for c in ("titulo", "horaComienzo") if columnas.get(c, c) not in cabecera]
+                if faltan:
+                    raise ArchivoInvalido(f"Faltan columnas obligatorias en la cabecera: {', '.join(faltan)}")
+                continue
+            if len(valores) > len(cabecera):
+                yield numero, None, f"La fila tiene {len(valores)} columnas y la cabecera {len(cabecera)}"
+                continue
+            try:
+                evento = fila_a_evento(dict(zip(cabecera, valores)), columnas)
+            except ValueError as e:
+                yield numero, None, str(e)
+                continue
+            yield numero, evento, None
+        if cabecera is None:
+            raise ArchivoInvalido("El CSV está vacío (se espera una cabecera con los nombres de columna)")
+
+    elif formato == "ndjson":
+        numero = 0
+        async for linea in _lineas(chunks, max_bytes):
+            numero += 1
+            if not linea.strip():
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError as e:
+                yield numero, None, f"JSON no válido: {e}"
+                continue
+            if not isinstance(fila, dict):
+                yield numero, None, "Cada línea debe ser un objeto JSON"
+                continue
+            try:
+                evento = fila_a_evento(fila, columnas)
+            except ValueError as e:
+                yield numero, None, str(e)
+                continue
+            yield numero, evento, None
+
+    else:
+        raise ArchivoInvalido(f"Formato no soportado '{formato}' (se admite {', '.join(FORMATOS)})")
@@ -0,0 +1,28 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from servicios.event_service.app.blob_store import LocalBlobStore, AdjuntoDemasiadoGrande
+
+
+def test_put_is_content_addressed_and_deduplicated(tmp_path):
+    store = LocalBlobStore(str(tmp_path), chunk_size=4)
+    primero = store.put(io.BytesIO(b"cartel del concierto"))
+    segundo = store.put(io.BytesIO(b"cartel del concierto"))
+
+    assert primero.digest == hashlib.sha256(b"cartel del concierto").hexdigest()
+    assert primero.nuevo and not segundo.nuevo
+    assert segundo.digest == primero.digest
+    with open(store.path(primero.digest), "rb") as f:
+        assert f.read() == b"cartel del concierto"
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_put_rejects_oversized_files_without_leaving_temporaries(tmp_path):
+    store = LocalBlobStore(str(tmp_path), chunk_size=4)
+    with pytest.raises(AdjuntoDemasiadoGrande):
+        store.put(io.BytesIO(b"x" * 20), max_bytes=10)
+    assert os.listdir(store.tmp_dir) == []
+    assert store.path(hashlib.sha256(b"x" * 20).hexdigest()) is None
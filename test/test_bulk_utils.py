@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import httpx
+
+from servicios.external_calendar_service.app.bulk_utils import EnvioPorLotes
+
+
+def test_batches_are_sent_with_bounded_concurrency_and_counted_per_event():
+    en_vuelo = 0
+    maximo = 0
+    tamanos = []
+
+    async def event_service(request: httpx.Request):
+        nonlocal en_vuelo, maximo
+        lote = json.loads(request.content)
+        tamanos.append(len(lote))
+        en_vuelo += 1
+        maximo = max(maximo, en_vuelo)
+        await asyncio.sleep(0.01)
+        en_vuelo -= 1
+        resultados = [
+            {"indice": i, "error": "titulo: obligatorio"} if not e["titulo"] else {"indice": i, "id": f"id-{e['n']}"}
+            for i, e in enumerate(lote)
+        ]
+        return httpx.Response(200, json={"resultados": resultados})
+
+    async def importar():
+        creados = []
+        async with httpx.AsyncClient(transport=httpx.MockTransport(event_service)) as client:
+            envio = EnvioPorLotes(client, "http://event_service/events/bulk", batch_size=10, concurrency=2)
+            for n in range(95):
+                await envio.add({"n": n, "titulo": "" if n % 10 == 0 else "Festivo"}, creados.append)
+            await envio.close()
+        return envio, creados
+
+    envio, creados = asyncio.run(importar())
+    assert tamanos.count(10) == 9 and tamanos.count(5) == 1
+    assert maximo == 2
+    assert envio.insertados == 85 and envio.fallidos == 10
+    assert len(creados) == 85
+
+
+def test_a_failed_batch_counts_all_its_events_as_failed():
+    async def importar():
+        transporte = httpx.MockTransport(lambda request: httpx.Response(503, text="caído"))
+        async with httpx.AsyncClient(transport=transporte) as client:
+            envio = EnvioPorLotes(client, "http://event_service/events/bulk", batch_size=4, concurrency=2)
+            for n in range(6):
+                await envio.add({"titulo": "Festivo"})
+            await envio.close()
+        return envio
+
+    envio = asyncio.run(importar())
+    assert envio.insertados == 0 and envio.fallidos == 6
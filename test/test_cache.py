@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from servicios.comment_service.app.cache_utils import TTLCache
+
+
+def test_concurrent_loads_of_one_key_cost_a_single_lookup():
+    cache = TTLCache(maxsize=10, ttl=60)
+    llamadas = []
+
+    async def cargar():
+        llamadas.append(1)
+        await asyncio.sleep(0.01)
+        return {"titulo": "Concierto"}
+
+    async def rafaga():
+        return await asyncio.gather(*(cache.get_or_load("evento", cargar) for _ in range(50)))
+
+    resultados = asyncio.run(rafaga())
+    assert len(llamadas) == 1
+    assert all(r == {"titulo": "Concierto"} for r in resultados)
+    assert cache.get("evento") == {"titulo": "Concierto"}
+
+
+def test_failed_loads_are_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    async def falla():
+        raise RuntimeError("caído")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get_or_load("evento", falla))
+    assert cache.get("evento") is None
+
+
+def test_size_bound_evicts_least_recently_used_and_ttl_expires():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    caducada = TTLCache(maxsize=2, ttl=-1)
+    caducada.set("a", 1)
+    assert caducada.get("a") is None
+
+
+def test_invalidate_drops_value():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("ana@kalendas.test", {"notification_pref": "email"})
+    cache.invalidate("ana@kalendas.test")
+    assert cache.get("ana@kalendas.test") is None
@@ -0,0 +1,210 @@
+import asyncio
+from uuid import UUID, uuid4
+
+import httpx
+from pymongo.errors import DuplicateKeyError
+
+from servicios.comment_service.app.model.comment_models import CommentCreate
+from servicios.comment_service.app.outbox import nueva_tarea
+from servicios.comment_service.app.service.commentsService import CommentsService
+
+
+class ColeccionEnMemoria:
+    """
+    Lo que usa CommentsService de una colección de PyMongo: filtros con igualdad, $lt, $in
+    y $or, find().sort().limit(), actualizaciones con $set, $inc, $unset o un pipeline sencillo, y
+    agregaciones con $match, $group (contando) y $facet.
+    """
+
+    def __init__(self, docs=()):
+        self.docs = [dict(d) for d in docs]
+
+    @classmethod
+    def _cumple(cls, doc, filtro):
+        for campo, condicion in filtro.items():
+            if campo == "$or":
+                if not any(cls._cumple(doc, f) for f in condicion):
+                    return False
+                continue
+            valor = doc.get(campo)
+            if isinstance(condicion, dict):
+                if "$lt" in condicion and not (valor is not None and valor < condicion["$lt"]):
+                    return False
+                if "$in" in condicion and valor not in condicion["$in"]:
+                    return False
+            elif valor != condicion:
+                return False
+        return True
+
+    @classmethod
+    def _evaluar(cls, doc, expresion):
+        if isinstance(expresion, str) and expresion.startswith("$"):
+            return doc.get(expresion[1:])
+        if isinstance(expresion, dict):
+            (operador, args), = expresion.items()
+            valores = [cls._evaluar(doc, a) for a in args]
+            if operador == "$ifNull":
+                return valores[0] if valores[0] is not None else valores[1]
+            if operador == "$subtract":
+                return valores[0] - valores[1]
+            if operador == "$max":
+                return max(valores)
+        return expresion
+
+    @classmethod
+    def _aplicar(cls, doc, cambios):
+        if isinstance(cambios, list):
+            for etapa in cambios:
+                doc.update({k: cls._evaluar(doc, v) for k, v in etapa["$set"].items()})
+            return
+        doc.update(cambios.get("$set", {}))
+        for campo, n in cambios.get("$inc", {}).items():
+            doc[campo] = doc.get(campo, 0) + n
+        for campo in cambios.get("$unset", {}):
+            doc.pop(campo, None)
+
+    def insert_one(self, doc):
+        if "_id" in doc and any(d.get("_id") == doc["_id"] for d in self.docs):
+            raise DuplicateKeyError("_id")
+        self.docs.append(dict(doc))
+
+    def find(self, filtro, proyeccion=None):
+        return Cursor([dict(d) for d in self.docs if self._cumple(d, filtro)])
+
+    def find_one(self, filtro, proyeccion=None):
+        return next((dict(d) for d in self.docs if self._cumple(d, filtro)), None)
+
+    def find_one_and_update(self, filtro, cambios, projection=None, upsert=False, return_document=None):
+        doc = next((d for d in self.docs if self._cumple(d, filtro)), None)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = dict(filtro)
+            self.docs.append(doc)
+        self._aplicar(doc, cambios)
+        return dict(doc)
+
+    def aggregate(self, pipeline):
+        return iter(self._etapas([dict(d) for d in self.docs], pipeline))
+
+    @classmethod
+    def _etapas(cls, docs, pipeline):
+        for etapa in pipeline:
+            (operador, args), = etapa.items()
+            if operador == "$match":
+                docs = [d for d in docs if cls._cumple(d, args)]
+            elif operador == "$group":
+                grupos = {}
+                for d in docs:
+                    grupos[d.get(args["_id"][1:])] = grupos.get(d.get(args["_id"][1:]), 0) + 1
+                docs = [{"_id": clave, "total": n} for clave, n in grupos.items()]
+            elif operador == "$facet":
+                docs = [{nombre: cls._etapas(docs, sub) for nombre, sub in args.items()}]
+        return docs
+
+    def update_one(self, filtro, cambios):
+        doc = next((d for d in self.docs if self._cumple(d, filtro)), None)
+        if doc is not None:
+            self._aplicar(doc, cambios)
+
+    def update_many(self, filtro, cambios):
+        afectados = [d for d in self.docs if self._cumple(d, filtro)]
+        for doc in afectados:
+            self._aplicar(doc, cambios)
+        return type("Resultado", (), {"modified_count": len(afectados)})
+
+
+class Cursor(list):
+    def sort(self, claves):
+        for campo, sentido in reversed(claves):
+            super().sort(key=lambda d: d[campo], reverse=sentido < 0)
+        return self
+
+    def limit(self, n):
+        return Cursor(self[:n])
+
+
+def _servicio(**colecciones) -> CommentsService:
+    def event_service(request):
+        return httpx.Response(200, json={"titulo": "Concierto", "emailOrganizador": "org@kalendas.test"})
+
+    db = {nombre: ColeccionEnMemoria() for nombre in ("comentarios", "users", "notificaciones", "outbox", "resumenes")}
+    db.update(colecciones)
+    return CommentsService(db, http_client=httpx.AsyncClient(transport=httpx.MockTransport(event_service)))
+
+
+def test_inbox_counts_pages_and_marks_app_notifications():
+    usuarios = ColeccionEnMemoria([{"email": "org@kalendas.test", "notification_pref": "app"}])
+    service = _servicio(users=usuarios)
+
+    async def escenario():
+        for n in range(5):
+            await service.process_outbox_task(nueva_tarea("nuevo_comentario", {
+                "idEvento": uuid4(), "autor": f"Autor {n}", "contenido": "hola",
+            }))
+        assert await service.get_unread_count("org@kalendas.test") == 5
+
+        # Páginas por cursor de la más reciente a la más antigua, sin repetir ni saltar ninguna
+        vistas, cursor = [], None
+        while True:
+            pagina = await service.get_notifications("org@kalendas.test", limit=2, cursor=cursor)
+            vistas += [n["message"].split(" comentó")[0] for n in pagina["notificaciones"]]
+            cursor = pagina["siguiente"]
+            if cursor is None:
+                break
+        assert sorted(vistas) == [f"Autor {n}" for n in range(5)]
+
+        primera = (await service.get_notifications("org@kalendas.test", limit=2))["notificaciones"]
+        ids = [UUID(n["_id"]) for n in primera]
+        assert await service.mark_notifications_read("org@kalendas.test", ids) == 2
+        # Repetir la marca no vuelve a descontar
+        assert await service.mark_notifications_read("org@kalendas.test", ids) == 0
+        assert await service.get_unread_count("org@kalendas.test") == 3
+
+        assert await service.mark_notifications_read("org@kalendas.test") == 3
+        return await service.get_unread_count("org@kalendas.test")
+
+    assert asyncio.run(escenario()) == 0
+
+
+def test_a_retried_outbox_task_does_not_duplicate_the_notification():
+    usuarios = ColeccionEnMemoria([{"email": "org@kalendas.test", "notification_pref": "app"}])
+    service = _servicio(users=usuarios)
+    tarea = nueva_tarea("nuevo_comentario", {"idEvento": uuid4(), "autor": "Ana", "contenido": "hola"}, uuid4())
+
+    async def escenario():
+        # La primera ejecución guardó la notificación pero la tarea se reintenta (p. ej. perdió la reserva)
+        for _ in range(2):
+            await service.process_outbox_task(tarea)
+        return await service.get_unread_count("org@kalendas.test")
+
+    assert asyncio.run(escenario()) == 1
+    assert [n["_id"] for n in service.notif_collection.docs] == [tarea["_id"]]
+
+
+def test_comment_threads_page_by_cursor_and_counts_cover_every_id():
+    service = _servicio()
+    evento, otro, sin_comentarios, calendario = uuid4(), uuid4(), uuid4(), uuid4()
+
+    async def escenario():
+        for n in range(5):
+            await service.create_comment(CommentCreate(contenido=f"c{n}", idEvento=evento, idCalendario=calendario), "Ana")
+        await service.create_comment(CommentCreate(contenido="otro", idEvento=otro), "Luis")
+
+        vistos, cursor = [], None
+        while True:
+            pagina = await service.list_comments(None, evento, limit=2, cursor=cursor)
+            vistos += [c["contenido"] for c in pagina["comentarios"]]
+            cursor = pagina["siguiente"]
+            if cursor is None:
+                break
+
+        recuentos = await service.count_comments([evento, otro, sin_comentarios], [calendario])
+        return vistos, recuentos
+
+    vistos, recuentos = asyncio.run(escenario())
+    assert sorted(vistos) == [f"c{n}" for n in range(5)]
+    assert recuentos == {
+        "eventos": {str(evento): 5, str(otro): 1, str(sin_comentarios): 0},
+        "calendarios": {str(calendario): 5},
+    }
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import io
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+from servicios.event_service.app.blob_store import LocalBlobStore
+from servicios.event_service.app.crud import event_crud
+from servicios.event_service.app.service import eventService
+from servicios.event_service.app.service.eventService import EventService
+
+
+@pytest.fixture
+def servicio_calendarios(monkeypatch):
+    """Sustituye el servicio de calendarios por un handler local: calendario -> (status, json)."""
+    respuestas = {}
+
+    def handler(request: httpx.Request):
+        status_code, cuerpo = respuestas[request.url.path.rsplit("/", 1)[-1]]
+        return httpx.Response(status_code, json=cuerpo)
+
+    cliente_real = httpx.AsyncClient
+    monkeypatch.setattr(
+        eventService.httpx, "AsyncClient",
+        lambda *args, **kwargs: cliente_real(transport=httpx.MockTransport(handler))
+    )
+    return respuestas
+
+
+def test_calendar_service_errors_become_gateway_errors(servicio_calendarios):
+    caido, raro = uuid4(), uuid4()
+    servicio_calendarios[str(caido)] = (500, {"detail": "boom"})
+    servicio_calendarios[str(raro)] = (401, {"detail": "no"})
+    service = EventService(crud_repository=None, blob_store=object())
+
+    for calendario, esperado in ((caido, 503), (raro, 502)):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(service._get_calendar_ancestry(calendario))
+        assert error.value.status_code == esperado
+
+
+class CrudEnMemoria:
+    """Lo que usa create_events_bulk del CRUD de eventos."""
+
+    def __init__(self):
+        self.docs = []
+        self.secuencia = 0
+
+    @asynccontextmanager
+    async def reserve_sequence(self, n: int = 1):
+        self.secuencia += n
+        yield self.secuencia
+
+    async def create_many(self, docs):
+        self.docs.extend(docs)
+        return {}
+
+
+def test_bulk_reports_calendar_failures_per_item(servicio_calendarios):
+    bueno, caido = uuid4(), uuid4()
+    servicio_calendarios[str(bueno)] = (200, {"ancestros": []})
+    servicio_calendarios[str(caido)] = (500, {"detail": "boom"})
+    crud = CrudEnMemoria()
+    service = EventService(crud_repository=crud, blob_store=object())
+
+    def evento(calendario):
+        return {
+            "idCalendario": str(calendario), "titulo": "Concierto", "horaComienzo": "2025-06-01T21:00:00",
+            "duracionMinutos": 60, "lugar": "Parque", "organizador": "Ayto", "emailOrganizador": "a@b.es",
+        }
+
+    resultado = asyncio.run(service.create_events_bulk([evento(bueno), evento(caido), evento(bueno)]))
+
+    assert (resultado.insertados, resultado.fallidos) == (2, 1)
+    assert resultado.resultados[1].error and "500" in resultado.resultados[1].error
+    assert len(crud.docs) == 2
+
+
+class CrudAdjuntos:
+    """Lo que usa add_attachments del CRUD de eventos."""
+
+    def __init__(self, enlazadas=()):
+        self.adjuntos = {}
+        self.enlazadas = set(enlazadas)
+
+    async def get_by_id(self, event_id):
+        return object()
+
+    async def save_attachment(self, datos, subida=True):
+        adjunto = self.adjuntos.setdefault(datos["_id"], dict(datos))
+        adjunto["subidasEnCurso"] = adjunto.get("subidasEnCurso", 0) + int(subida)
+
+    async def release_attachments(self, digests):
+        for digest in digests:
+            self.adjuntos[digest]["subidasEnCurso"] -= 1
+
+    async def delete_attachment(self, digest):
+        if self.adjuntos.get(digest, {}).get("subidasEnCurso", 1) > 0:
+            return None
+        return self.adjuntos.pop(digest)
+
+    async def attachment_in_use(self, url):
+        return url in self.enlazadas
+
+    async def get_attachment(self, digest):
+        return self.adjuntos.get(digest)
+
+
+def _subida_fallida(tmp_path, monkeypatch, crud):
+    monkeypatch.setattr(eventService, "ATTACHMENT_MAX_BYTES", 10)
+    store = LocalBlobStore(str(tmp_path))
+    service = EventService(crud_repository=crud, blob_store=store)
+    # El segundo fichero no dice su tamaño: se descubre que es demasiado grande al guardarlo
+    primero = UploadFile(io.BytesIO(b"cartel"), filename="cartel.txt")
+    grande = UploadFile(io.BytesIO(b"x" * 20), filename="grande.txt")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.add_attachments(uuid4(), [], [primero, grande]))
+    assert error.value.status_code == 413
+    return store
+
+
+def test_failed_upload_removes_blobs_stored_by_the_same_request(tmp_path, monkeypatch):
+    crud = CrudAdjuntos()
+    store = _subida_fallida(tmp_path, monkeypatch, crud)
+
+    assert crud.adjuntos == {}
+    assert store.path(hashlib.sha256(b"cartel").hexdigest()) is None
+
+
+def test_failed_upload_keeps_content_that_another_event_already_links(tmp_path, monkeypatch):
+    digest = hashlib.sha256(b"cartel").hexdigest()
+    # Otra subida de los mismos bytes lo enlazó a su evento mientras esta seguía en curso
+    crud = CrudAdjuntos(enlazadas={f"{eventService.ATTACHMENTS_URL_PREFIX}/{digest}"})
+    store = _subida_fallida(tmp_path, monkeypatch, crud)
+
+    assert list(crud.adjuntos) == [digest]
+    assert store.path(digest) is not None
+
+
+class ColeccionEnMemoria:
+    """Lo que usa archive_batch de una colección de PyMongo (filtros por igualdad, $in y $lt)."""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+        self.antes_de_borrar = None
+
+    @staticmethod
+    def _cumple(doc, filtro):
+        for campo, condicion in filtro.items():
+            valor = doc.get(campo)
+            if isinstance(condicion, dict):
+                if "$in" in condicion and valor not in condicion["$in"]:
+                    return False
+                if "$lt" in condicion and not (valor is not None and valor < condicion["$lt"]):
+                    return False
+            elif valor != condicion:
+                return False
+        return True
+
+    def find(self, filtro):
+        return Cursor([dict(d) for d in self.docs.values() if self._cumple(d, filtro)])
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            self.docs[op._doc["_id"]] = dict(op._doc)
+
+    def delete_one(self, filtro):
+        if self.antes_de_borrar:
+            self.antes_de_borrar(self, filtro["_id"])
+        doc = next((d for d in self.docs.values() if self._cumple(d, filtro)), None)
+        if doc is not None:
+            del self.docs[doc["_id"]]
+        return type("Resultado", (), {"deleted_count": int(doc is not None)})
+
+    def delete_many(self, filtro):
+        for doc in [d for d in self.docs.values() if self._cumple(d, filtro)]:
+            del self.docs[doc["_id"]]
+
+
+class Cursor(list):
+    def limit(self, n):
+        return Cursor(self[:n])
+
+
+def test_archive_batch_does_not_lose_updates_made_while_archiving(monkeypatch):
+    limite = datetime(2025, 1, 1)
+    viejo = limite - timedelta(days=1)
+    quieto, editado, reabierto = uuid4(), uuid4(), uuid4()
+    eventos = ColeccionEnMemoria([
+        {"_id": quieto, "horaFin": viejo, "secuencia": 1},
+        {"_id": editado, "horaFin": viejo, "secuencia": 2, "titulo": "antes"},
+        {"_id": reabierto, "horaFin": viejo, "secuencia": 3},
+    ])
+    archivo, eliminados = ColeccionEnMemoria(), ColeccionEnMemoria()
+
+    def modificar_al_vuelo(coleccion, event_id):
+        # Otra petición modifica dos eventos entre la copia al archivo y el borrado
+        if event_id == editado and coleccion.docs[editado]["secuencia"] == 2:
+            coleccion.docs[editado].update(secuencia=10, titulo="después")
+        if event_id == reabierto and coleccion.docs[reabierto]["secuencia"] == 3:
+            coleccion.docs[reabierto].update(secuencia=11, horaFin=limite + timedelta(days=30))
+
+    @contextmanager
+    def secuencias_reservadas(coleccion, contador, cantidad):
+        yield 100 + cantidad
+
+    eventos.antes_de_borrar = modificar_al_vuelo
+    for nombre, coleccion in (("EventCollection", eventos), ("ArchiveCollection", archivo), ("TombstoneCollection", eliminados)):
+        monkeypatch.setattr(event_crud, nombre, coleccion)
+    monkeypatch.setattr(event_crud, "secuencias_reservadas", secuencias_reservadas)
+
+    assert event_crud.EventCRUD().archive_batch(limite, 10) == 2
+
+    assert set(eventos.docs) == {reabierto}
+    assert set(archivo.docs) == {quieto, editado}
+    assert archivo.docs[editado]["titulo"] == "después"
+    assert set(eliminados.docs) == {quieto, editado}
+    assert all(marca["archivado"] for marca in eliminados.docs.values())
+    assert sorted(marca["secuencia"] for marca in eliminados.docs.values()) == [101, 102]
@@ -0,0 +1,193 @@
+import asyncio
+import json
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import httpx
+import pytest
+
+from servicios.external_calendar_service.app.feed_sync import sincronizar_feed
+from servicios.external_calendar_service.app.jobs import Progreso
+from servicios.external_calendar_service.app import parse_pool
+from servicios.external_calendar_service.app.parse_pool import CAMPOS_SUSCRIPCION, analizar, huella, normalizar_bloques
+
+
+class MapeoEnMemoria:
+    """Lo mínimo de una colección 'eventos_importados' para el motor de sincronización."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find(self, filtro, proyeccion=None):
+        return [dict(d) for d in self.docs.values() if d["suscripcion"] == filtro["suscripcion"]]
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.docs[doc["clave"]] = dict(doc)
+
+    def update_one(self, filtro, cambios, upsert=False):
+        self.docs.setdefault(filtro["clave"], dict(filtro)).update(cambios["$set"])
+
+    def delete_one(self, filtro):
+        self.docs.pop(filtro["clave"], None)
+
+
+def _feed(*eventos):
+    cuerpo = "".join(
+        f"BEGIN:VEVENT\r\nUID:{uid}\r\nSUMMARY:{titulo}\r\nDTSTART:20250101T100000\r\n{extra}END:VEVENT\r\n"
+        for uid, titulo, extra in eventos
+    )
+    return f"BEGIN:VCALENDAR\r\n{cuerpo}END:VCALENDAR\r\n".encode()
+
+
+def _sincronizar(
+    feed: bytes, mapeo: MapeoEnMemoria, llamadas: list, enviados: list = None, cortar_en: int = None, borrados=()
+) -> Progreso:
+    def event_service(request: httpx.Request):
+        llamadas.append((request.method, request.url.path))
+        if request.url.path.rsplit("/", 1)[-1] in borrados:
+            return httpx.Response(404, json={"detail": "Evento no encontrado"})
+        if request.url.path == "/events/bulk":
+            lote = json.loads(request.content)
+            if enviados is not None:
+                enviados.extend(lote)
+            return httpx.Response(200, json={"resultados": [
+                {"indice": i, "id": f"id-{e['titulo']}"} for i, e in enumerate(lote)
+            ]})
+        return httpx.Response(200 if request.method == "PUT" else 204, json={})
+
+    async def trozos():
+        yield feed
+
+    async def registros():
+        # Con cortar_en, el feed se interrumpe (p. ej. se cae la conexión) tras ese registro
+        n = 0
+        async for registro in analizar(trozos()):
+            yield registro
+            n += 1
+            if n == cortar_en:
+                raise ConnectionError("feed cortado")
+
+    async def calendario():
+        return "cal-1"
+
+    async def ejecutar():
+        progreso = Progreso()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(event_service)) as client:
+            suscripcion = {"_id": "sus-1", "organizador": "Ayto", "email_organizador": "ayto@ejemplo.com"}
+            await sincronizar_feed(client, registros(), suscripcion, calendario, mapeo, progreso)
+        return progreso
+
+    return asyncio.run(ejecutar())
+
+
+def test_resync_applies_only_inserts_updates_and_deletes():
+    mapeo = MapeoEnMemoria()
+    llamadas = []
+    primera = _sincronizar(_feed(("a", "Reyes", ""), ("b", "Carnaval", ""), ("c", "Pascua", "")), mapeo, llamadas)
+    assert primera.importados == 3 and set(mapeo.docs) == {"a", "b", "c"}
+
+    llamadas.clear()
+    igual = _sincronizar(_feed(("a", "Reyes", ""), ("b", "Carnaval", ""), ("c", "Pascua", "")), mapeo, llamadas)
+    assert igual.sin_cambios == 3 and llamadas == []
+
+    llamadas.clear()
+    cambios = _sincronizar(_feed(("a", "Reyes Magos", ""), ("c", "Pascua", ""), ("d", "Fallas", "")), mapeo, llamadas)
+    assert (cambios.importados, cambios.actualizados, cambios.eliminados, cambios.sin_cambios) == (1, 1, 1, 1)
+    assert sorted(llamadas) == [("DELETE", "/events/id-Carnaval"), ("POST", "/events/bulk"), ("PUT", "/events/id-Reyes")]
+    assert set(mapeo.docs) == {"a", "c", "d"}
+
+
+def test_interrupted_sync_keeps_the_mapping_of_what_it_inserted():
+    mapeo = MapeoEnMemoria()
+    feed = _feed(("a", "Reyes", ""), ("b", "Carnaval", ""), ("c", "Pascua", ""))
+
+    with pytest.raises(ConnectionError):
+        _sincronizar(feed, mapeo, [], cortar_en=2)
+    assert {clave: d["idEvento"] for clave, d in mapeo.docs.items()} == {"a": "id-Reyes", "b": "id-Carnaval"}
+
+    llamadas, enviados = [], []
+    reanudada = _sincronizar(feed, mapeo, llamadas, enviados)
+    assert (reanudada.importados, reanudada.sin_cambios) == (1, 2)
+    assert [e["titulo"] for e in enviados] == ["Pascua"]
+
+
+def test_an_update_of_an_event_deleted_in_kalendas_creates_it_again():
+    mapeo = MapeoEnMemoria()
+    _sincronizar(_feed(("a", "Reyes", ""), ("b", "Carnaval", "")), mapeo, [])
+
+    llamadas, enviados = [], []
+    progreso = _sincronizar(
+        _feed(("a", "Reyes Magos", ""), ("b", "Carnaval", "")), mapeo, llamadas, enviados, borrados={"id-Reyes"}
+    )
+    assert ("PUT", "/events/id-Reyes") in llamadas
+    assert [e["titulo"] for e in enviados] == ["Reyes Magos"]
+    assert (progreso.importados, progreso.actualizados, progreso.errores) == (1, 0, [])
+    assert mapeo.docs["a"]["idEvento"] == "id-Reyes Magos"
+
+
+def test_overrides_after_their_series_are_excluded_from_it():
+    mapeo = MapeoEnMemoria()
+    llamadas = []
+    enviados = []
+
+    feed = _feed(
+        ("serie", "Clase semanal", "RRULE:FREQ=WEEKLY;COUNT=5\r\n"),
+        ("serie", "Clase cambiada", "RECURRENCE-ID:20250108T100000\r\n"),
+    )
+
+    _sincronizar(feed, mapeo, llamadas, enviados)
+
+    serie = next(e for e in enviados if e["rrule"])
+    assert serie["fechasExcluidas"] == ["2025-01-08T10:00:00"]
+    assert serie["emailOrganizador"] == "ayto@ejemplo.com"
+    assert set(mapeo.docs) == {"serie", "serie|2025-01-08T10:00:00"}
+
+
+def test_normalizar_bloques_returns_compact_records_and_errors():
+    bloques = [
+        "BEGIN:VEVENT\r\nUID:a\r\nSUMMARY:Reunión\r\nDTSTART:20250101T100000\r\n"
+        "RECURRENCE-ID:20250108T100000\r\nEND:VEVENT",
+        "BEGIN:VEVENT\r\nUID:b\r\nSUMMARY:Sin fecha\r\nEND:VEVENT",
+    ]
+
+    valido, roto = normalizar_bloques(bloques)
+
+    assert valido["clave"] == "a|2025-01-08T10:00:00"
+    assert valido["override"] == "2025-01-08T10:00:00"
+    assert not set(CAMPOS_SUSCRIPCION) & set(valido["payload"])
+    assert valido["huella"] == huella(valido["payload"])
+    assert set(roto) == {"error"}
+
+
+def test_a_broken_parse_pool_is_replaced_and_the_chunk_retried(monkeypatch):
+    pools = []
+
+    class PoolDePrueba(Executor):
+        """El primer pool se rompe (como si el sistema matara un proceso); los siguientes funcionan."""
+
+        def __init__(self, *args, **kwargs):
+            self.roto = not pools
+            pools.append(self)
+
+        def submit(self, fn, *args):
+            futuro = Future()
+            if self.roto:
+                futuro.set_exception(BrokenProcessPool("un proceso ha muerto"))
+            else:
+                futuro.set_result(fn(*args))
+            return futuro
+
+    monkeypatch.setattr(parse_pool, "ProcessPoolExecutor", PoolDePrueba)
+    monkeypatch.setattr(parse_pool, "PARSE_WORKERS", 1)
+    monkeypatch.setattr(parse_pool, "_pool", None)
+
+    async def registros():
+        async def trozos():
+            yield _feed(("a", "Reyes", ""), ("b", "Carnaval", ""))
+        resultado = [r["clave"] async for r in analizar(trozos())]
+        await parse_pool.cerrar_pool()
+        return resultado
+
+    assert asyncio.run(registros()) == ["a", "b"]
+    assert len(pools) == 2 and parse_pool._pool is None
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from servicios.event_service.app.freebusy_utils import (
+    intervalos_ordenados, fusionar_intervalos, huecos_libres
+)
+
+DESDE = datetime(2025, 1, 1, 8, 0)
+HASTA = datetime(2025, 1, 1, 20, 0)
+
+def test_merge_overlapping_and_recurring_intervals():
+    docs = [
+        {"horaComienzo": datetime(2025, 1, 1, 9, 0), "horaFin": datetime(2025, 1, 1, 10, 0)},
+        # Serie diaria de 30 minutos a las 9:45 (una ocurrencia cae en la ventana)
+        {"horaComienzo": datetime(2024, 12, 30, 9, 45), "horaFin": datetime(2025, 1, 10, 10, 15),
+         "duracionMinutos": 30, "rrule": "FREQ=DAILY;COUNT=12"},
+        {"horaComienzo": datetime(2025, 1, 1, 10, 0), "horaFin": datetime(2025, 1, 1, 11, 0)},
+        {"horaComienzo": datetime(2025, 1, 1, 19, 0), "horaFin": datetime(2025, 1, 1, 23, 0)},
+    ]
+    docs.sort(key=lambda doc: doc["horaComienzo"])
+    ocupados = fusionar_intervalos(intervalos_ordenados(docs, DESDE, HASTA), DESDE, HASTA)
+    assert ocupados == [
+        (datetime(2025, 1, 1, 9, 0), datetime(2025, 1, 1, 11, 0)),
+        (datetime(2025, 1, 1, 19, 0), HASTA),
+    ]
+
+def test_free_slots_respect_minimum_duration():
+    ocupados = [
+        (datetime(2025, 1, 1, 8, 30), datetime(2025, 1, 1, 11, 0)),
+        (datetime(2025, 1, 1, 12, 0), datetime(2025, 1, 1, 19, 0)),
+    ]
+    libres = huecos_libres(ocupados, DESDE, HASTA, timedelta(minutes=60))
+    assert libres == [
+        (datetime(2025, 1, 1, 11, 0), datetime(2025, 1, 1, 12, 0)),
+        (datetime(2025, 1, 1, 19, 0), HASTA),
+    ]
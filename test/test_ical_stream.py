@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from icalendar import Event
+
+from servicios.external_calendar_service.app.ical_stream import (
+    FeedDemasiadoGrande, FeedInvalido, iter_lines, iter_vevent_blocks
+)
+
+FEED = (
+    b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+    b"BEGIN:VEVENT\r\nUID:1\r\nSUMMARY:Reuni\xc3\xb3n de\r\n  equipo\r\nDTSTART:20250101T100000\r\n"
+    b"BEGIN:VALARM\r\nACTION:DISPLAY\r\nEND:VALARM\r\nEND:VEVENT\r\n"
+    b"BEGIN:VEVENT\r\nUID:2\r\nBEGIN:VALARM\r\nEND:VEVENT\r\n"
+    b"BEGIN:VEVENT\r\nUID:3\r\nSUMMARY:Festivo\r\nDTSTART;VALUE=DATE:20250106\r\nEND:VEVENT\r\n"
+    b"END:VCALENDAR\r\n"
+)
+
+
+async def _trozos(datos: bytes, tam: int):
+    for i in range(0, len(datos), tam):
+        yield datos[i:i + tam]
+
+
+def _eventos(datos: bytes, tam: int = 7, **kwargs):
+    """Pares (evento, None) o (None, error) de cada VEVENT, como los interpreta parse_pool."""
+    def interpretar(bloque):
+        try:
+            return Event.from_ical(bloque), None
+        except Exception as e:
+            return None, e
+
+    async def recoger():
+        return [interpretar(bloque) async for bloque in iter_vevent_blocks(_trozos(datos, tam), **kwargs)]
+    return asyncio.run(recoger())
+
+
+def test_lines_are_unfolded_across_chunk_boundaries():
+    async def recoger():
+        return [linea async for linea in iter_lines(_trozos(FEED, 3))]
+    lineas = asyncio.run(recoger())
+    assert "SUMMARY:Reunión de equipo" in lineas
+    assert lineas[-1] == "END:VCALENDAR"
+
+
+def test_events_are_yielded_one_by_one_and_bad_ones_are_isolated():
+    eventos = _eventos(FEED)
+    assert len(eventos) == 3
+    primero, error = eventos[0]
+    assert error is None and str(primero.get("summary")) == "Reunión de equipo"
+    assert [c.name for c in primero.subcomponents] == ["VALARM"]
+    assert eventos[1][0] is None and eventos[1][1] is not None
+    assert str(eventos[2][0].get("summary")) == "Festivo"
+
+
+def test_non_calendar_content_is_rejected():
+    with pytest.raises(FeedInvalido):
+        _eventos(b"<html>No encontrado</html>")
+
+
+def test_feeds_over_the_limit_are_cut():
+    with pytest.raises(FeedDemasiadoGrande):
+        _eventos(FEED, max_bytes=100)
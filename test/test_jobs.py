@@ -0,0 +1,144 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from servicios.external_calendar_service.app import jobs
+from servicios.external_calendar_service.app.jobs import (
+    COMPLETADA, EN_CURSO, FALLIDA, ImportWorker, nuevo_trabajo
+)
+
+
+class ColeccionEnMemoria:
+    """Lo que usa ImportWorker de la colección 'importaciones' (igualdad, $lt, $set y $unset)."""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+
+    @staticmethod
+    def _cumple(doc, filtro):
+        for campo, condicion in filtro.items():
+            valor = doc.get(campo)
+            if isinstance(condicion, dict):
+                if "$lt" in condicion and not (valor is not None and valor < condicion["$lt"]):
+                    return False
+            elif valor != condicion:
+                return False
+        return True
+
+    @staticmethod
+    def _aplicar(doc, cambios):
+        doc.update(cambios.get("$set", {}))
+        for campo in cambios.get("$unset", {}):
+            doc.pop(campo, None)
+
+    def find_one_and_update(self, filtro, cambios, sort=None, return_document=None):
+        candidatos = sorted((d for d in self.docs.values() if self._cumple(d, filtro)), key=lambda d: d["creadaEn"])
+        if not candidatos:
+            return None
+        self._aplicar(candidatos[0], cambios)
+        return dict(candidatos[0])
+
+    def update_one(self, filtro, cambios):
+        doc = next((d for d in self.docs.values() if self._cumple(d, filtro)), None)
+        if doc is not None:
+            self._aplicar(doc, cambios)
+        return type("Resultado", (), {"matched_count": int(doc is not None)})
+
+    def update_many(self, filtro, cambios):
+        for doc in self.docs.values():
+            if self._cumple(doc, filtro):
+                self._aplicar(doc, cambios)
+
+
+@pytest.fixture(autouse=True)
+def latidos_rapidos(monkeypatch):
+    monkeypatch.setattr(jobs, "IMPORT_PROGRESS_SECONDS", 0.01)
+    # El aviso de trabajo se liga al primer bucle de eventos que lo usa: uno nuevo por test
+    monkeypatch.setattr(jobs, "_hay_trabajo", asyncio.Event())
+
+
+def _ejecutar(coleccion, handler, hasta, workers=2, timeout=2.0):
+    """Arranca los workers hasta que se cumple la condición (o se agota el tiempo) y los para."""
+    async def ejecutar():
+        worker = ImportWorker(coleccion, handler, workers=workers)
+        worker.start()
+        limite = time.monotonic() + timeout
+        while not hasta() and time.monotonic() < limite:
+            await asyncio.sleep(0.01)
+        await worker.stop()
+    asyncio.run(ejecutar())
+
+
+def test_each_pending_job_is_claimed_once_and_completed():
+    trabajos = [nuevo_trabajo("ical", {"n": n}) for n in range(3)]
+    coleccion = ColeccionEnMemoria(trabajos)
+    ejecutados = []
+
+    async def handler(trabajo, progreso):
+        ejecutados.append(trabajo["solicitud"]["n"])
+        await asyncio.sleep(0.02)
+        progreso.importado(trabajo["solicitud"]["n"] + 1)
+
+    _ejecutar(coleccion, handler, hasta=lambda: all(d["estado"] == COMPLETADA for d in coleccion.docs.values()))
+
+    assert sorted(ejecutados) == [0, 1, 2]
+    for trabajo in trabajos:
+        doc = coleccion.docs[trabajo["_id"]]
+        assert doc["estado"] == COMPLETADA and doc["importados"] == trabajo["solicitud"]["n"] + 1
+        assert "reservadaPor" not in doc and "reservadaHasta" not in doc
+
+
+def test_progress_is_saved_and_the_lease_renewed_while_running():
+    trabajo = nuevo_trabajo("ical", {})
+    coleccion = ColeccionEnMemoria([trabajo])
+    vistos = []
+
+    async def handler(t, progreso):
+        progreso.analizados = 7
+        reserva = coleccion.docs[t["_id"]]["reservadaHasta"]
+        await asyncio.sleep(0.1)
+        vistos.append((coleccion.docs[t["_id"]]["analizados"], coleccion.docs[t["_id"]]["reservadaHasta"] > reserva))
+
+    _ejecutar(coleccion, handler, hasta=lambda: coleccion.docs[trabajo["_id"]]["estado"] == COMPLETADA)
+
+    assert vistos == [(7, True)]
+
+
+def test_failed_and_interrupted_jobs_are_marked_as_failed():
+    roto = nuevo_trabajo("ical", {})
+    interrumpido = dict(nuevo_trabajo("ical", {}), estado=EN_CURSO, reservadaHasta=datetime.utcnow() - timedelta(seconds=1))
+    coleccion = ColeccionEnMemoria([roto, interrumpido])
+
+    async def handler(t, progreso):
+        raise HTTPException(status_code=422, detail="El archivo no es un .ics válido")
+
+    _ejecutar(coleccion, handler, hasta=lambda: all(d["estado"] == FALLIDA for d in coleccion.docs.values()))
+
+    assert coleccion.docs[roto["_id"]]["error"] == "El archivo no es un .ics válido"
+    assert "interrumpida" in coleccion.docs[interrumpido["_id"]]["error"]
+
+
+def test_a_worker_that_lost_its_lease_stops_and_does_not_overwrite_the_job():
+    trabajo = nuevo_trabajo("ical", {})
+    coleccion = ColeccionEnMemoria([trabajo])
+    cancelado = []
+
+    async def handler(t, progreso):
+        # Otra instancia da el trabajo por interrumpido mientras este worker lo ejecuta
+        coleccion.docs[t["_id"]].update(estado=FALLIDA, error="Importación interrumpida")
+        inicio = time.monotonic()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelado.append(time.monotonic() - inicio)
+            raise
+
+    _ejecutar(coleccion, handler, hasta=lambda: cancelado)
+
+    # Lo para el latido al ver que la reserva ya no es suya, no el apagado del worker
+    assert cancelado and cancelado[0] < 1
+    doc = coleccion.docs[trabajo["_id"]]
+    assert doc["estado"] == FALLIDA and doc["error"] == "Importación interrumpida"
@@ -0,0 +1,277 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import httpx
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from servicios.comment_service.app.email_utils import (
+    SendGridTransport, LogTransport, ErrorPermanente, ErrorTransitorio, email_nuevo_comentario, email_resumen
+)
+from servicios.comment_service.app import outbox
+from servicios.comment_service.app.model.comment_models import CommentCreate
+from servicios.comment_service.app.outbox import (
+    HECHA, MUERTA, OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_MAX_ATTEMPTS, PENDIENTE, PROCESANDO, OutboxWorker,
+    calcular_backoff, nueva_tarea,
+)
+from servicios.comment_service.app.service.commentsService import CommentsService
+
+
+def _transporte(status_code: int, recibidas: list) -> SendGridTransport:
+    """SendGrid sustituido por un servidor HTTP local (httpx.MockTransport)."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        recibidas.append(request)
+        return httpx.Response(status_code)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return SendGridTransport(client, api_url="http://sendgrid.local/v3/mail/send")
+
+
+@pytest.fixture(autouse=True)
+def credenciales(monkeypatch):
+    monkeypatch.setenv("SENDGRID_API_KEY", "clave")
+    monkeypatch.setenv("EMAIL_REMITENTE", "noreply@kalendas.test")
+
+
+def test_sendgrid_transport_posts_to_configured_url():
+    recibidas = []
+    email = email_nuevo_comentario("org@kalendas.test", "Ana", "Concierto", "<b>genial</b>")
+    asyncio.run(_transporte(202, recibidas).send(email))
+
+    assert len(recibidas) == 1
+    assert recibidas[0].headers["Authorization"] == "Bearer clave"
+    assert "&lt;b&gt;genial&lt;/b&gt;" in email.html
+
+
+@pytest.mark.parametrize("status_code, error", [(429, ErrorTransitorio), (503, ErrorTransitorio), (400, ErrorPermanente)])
+def test_sendgrid_errors_are_classified_for_retries(status_code, error):
+    email = email_nuevo_comentario("org@kalendas.test", "Ana", "Concierto", "hola")
+    with pytest.raises(error):
+        asyncio.run(_transporte(status_code, []).send(email))
+
+
+def test_log_transport_keeps_sent_emails():
+    transporte = LogTransport()
+    asyncio.run(transporte.send(email_nuevo_comentario("org@kalendas.test", "Ana", "Concierto", "hola")))
+    assert [e.destinatario for e in transporte.enviados] == ["org@kalendas.test"]
+
+
+def test_backoff_grows_and_is_capped():
+    assert calcular_backoff(1) < calcular_backoff(4)
+    assert calcular_backoff(50) <= OUTBOX_BACKOFF_MAX_SECONDS * 1.2
+
+
+def test_digest_groups_comments_by_event():
+    comentarios = [
+        {"idEvento": 1, "tituloEvento": "Concierto", "autor": "Ana", "contenido": "genial"},
+        {"idEvento": 2, "tituloEvento": "Maratón", "autor": "Luis", "contenido": "duro"},
+        {"idEvento": 1, "tituloEvento": "Concierto", "autor": "Eva", "contenido": "repetiría"},
+    ]
+    email = email_resumen("org@kalendas.test", comentarios, total=10)
+
+    assert email.html.count("<h4>") == 2
+    assert "Concierto (2)" in email.html
+    assert "7 comentarios más" in email.html
+    assert "10 comentarios" in email.asunto
+
+
+class ColeccionEnMemoria:
+    """
+    Lo que usan la bandeja de salida y create_comment de una colección de PyMongo. Las
+    operaciones son atómicas (un cerrojo), como en MongoDB, porque los workers las hacen
+    desde hilos.
+    """
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+        self._cerrojo = threading.Lock()
+        self.fallar_inserciones = False
+
+    @classmethod
+    def _cumple(cls, doc, filtro):
+        for campo, condicion in filtro.items():
+            if campo == "$or":
+                if not any(cls._cumple(doc, f) for f in condicion):
+                    return False
+                continue
+            valor = doc.get(campo)
+            if isinstance(condicion, dict):
+                if "$exists" in condicion and (campo in doc) != condicion["$exists"]:
+                    return False
+                if "$lte" in condicion and not (valor is not None and valor <= condicion["$lte"]):
+                    return False
+                if "$lt" in condicion and not (valor is not None and valor < condicion["$lt"]):
+                    return False
+            elif valor != condicion:
+                return False
+        return True
+
+    @staticmethod
+    def _aplicar(doc, cambios):
+        doc.update(cambios.get("$set", {}))
+        for campo, n in cambios.get("$inc", {}).items():
+            doc[campo] = doc.get(campo, 0) + n
+        for campo in cambios.get("$unset", {}):
+            doc.pop(campo, None)
+
+    def insert_one(self, doc):
+        if self.fallar_inserciones:
+            raise ConnectionError("MongoDB no responde")
+        with self._cerrojo:
+            self.docs[doc["_id"]] = dict(doc)
+
+    def find(self, filtro, proyeccion=None):
+        with self._cerrojo:
+            return Cursor([dict(d) for d in self.docs.values() if self._cumple(d, filtro)])
+
+    def find_one_and_update(self, filtro, cambios, sort=None, return_document=None):
+        with self._cerrojo:
+            candidatos = [d for d in self.docs.values() if self._cumple(d, filtro)]
+            if sort:
+                candidatos.sort(key=lambda d: d[sort[0][0]])
+            if not candidatos:
+                return None
+            self._aplicar(candidatos[0], cambios)
+            return dict(candidatos[0])
+
+    def update_one(self, filtro, cambios):
+        with self._cerrojo:
+            doc = next((d for d in self.docs.values() if self._cumple(d, filtro)), None)
+            if doc is not None:
+                self._aplicar(doc, cambios)
+
+
+class Cursor(list):
+    def limit(self, n):
+        return Cursor(self[:n])
+
+
+@pytest.fixture
+def bandeja(monkeypatch):
+    # El aviso de trabajo se liga al primer bucle de eventos que lo usa: uno nuevo por test
+    monkeypatch.setattr(outbox, "_hay_trabajo", asyncio.Event())
+    return ColeccionEnMemoria()
+
+
+def _procesar(coleccion, handler, hasta, workers=2, timeout=2.0):
+    """Arranca los workers hasta que se cumple la condición (o se agota el tiempo) y los para."""
+    async def ejecutar():
+        worker = OutboxWorker(coleccion, handler, workers=workers)
+        worker.start()
+        limite = time.monotonic() + timeout
+        while not hasta() and time.monotonic() < limite:
+            await asyncio.sleep(0.01)
+        await worker.stop()
+    asyncio.run(ejecutar())
+
+
+def test_a_task_is_claimed_by_a_single_worker(bandeja):
+    tarea = nueva_tarea("nuevo_comentario", {})
+    reservada = dict(nueva_tarea("nuevo_comentario", {}), estado=PROCESANDO,
+                     reservadaHasta=datetime.utcnow() + timedelta(minutes=5))
+    bandeja.docs = {tarea["_id"]: tarea, reservada["_id"]: reservada}
+    procesadas = []
+
+    async def handler(t):
+        procesadas.append(t["_id"])
+        await asyncio.sleep(0.05)
+
+    _procesar(bandeja, handler, hasta=lambda: bandeja.docs[tarea["_id"]]["estado"] == HECHA, workers=4)
+
+    assert procesadas == [tarea["_id"]]
+    assert bandeja.docs[reservada["_id"]]["estado"] == PROCESANDO
+
+
+def test_an_expired_lease_is_taken_over(bandeja):
+    abandonada = dict(nueva_tarea("nuevo_comentario", {}), estado=PROCESANDO, intentos=1,
+                      reservadaHasta=datetime.utcnow() - timedelta(seconds=1))
+    bandeja.docs = {abandonada["_id"]: abandonada}
+
+    async def handler(t):
+        pass
+
+    _procesar(bandeja, handler, hasta=lambda: bandeja.docs[abandonada["_id"]]["estado"] == HECHA)
+
+    doc = bandeja.docs[abandonada["_id"]]
+    assert doc["estado"] == HECHA and doc["intentos"] == 2 and "reservadaHasta" not in doc
+
+
+def test_a_failed_task_is_retried_later_with_backoff(bandeja):
+    tarea = nueva_tarea("nuevo_comentario", {})
+    bandeja.docs = {tarea["_id"]: tarea}
+    llamadas = []
+
+    async def handler(t):
+        llamadas.append(t["intentos"])
+        raise ErrorTransitorio("SendGrid no responde")
+
+    _procesar(bandeja, handler, hasta=lambda: bandeja.docs[tarea["_id"]].get("ultimoError"))
+
+    doc = bandeja.docs[tarea["_id"]]
+    assert llamadas == [1]
+    assert doc["estado"] == PENDIENTE and doc["ultimoError"] == "SendGrid no responde"
+    assert doc["proximoIntento"] > datetime.utcnow()
+
+
+def test_tasks_are_dead_lettered_when_attempts_run_out_or_errors_are_permanent(bandeja):
+    agotada = dict(nueva_tarea("nuevo_comentario", {"fallo": "transitorio"}), intentos=OUTBOX_MAX_ATTEMPTS - 1)
+    permanente = nueva_tarea("nuevo_comentario", {"fallo": "permanente"})
+    bandeja.docs = {agotada["_id"]: agotada, permanente["_id"]: permanente}
+
+    async def handler(t):
+        if t["payload"]["fallo"] == "permanente":
+            raise ErrorPermanente("Destinatario no válido")
+        raise ErrorTransitorio("SendGrid no responde")
+
+    _procesar(bandeja, handler, hasta=lambda: all(d["estado"] == MUERTA for d in bandeja.docs.values()))
+
+    assert bandeja.docs[agotada["_id"]]["intentos"] == OUTBOX_MAX_ATTEMPTS
+    assert bandeja.docs[permanente["_id"]]["intentos"] == 1
+    assert all(d["estado"] == MUERTA for d in bandeja.docs.values())
+
+
+def test_a_comment_keeps_its_notification_until_it_reaches_the_outbox(bandeja):
+    comentarios = ColeccionEnMemoria()
+    db = {"comentarios": comentarios, "outbox": bandeja, "users": None, "notificaciones": None, "resumenes": None}
+    service = CommentsService(db, http_client=httpx.AsyncClient())
+    comentario = CommentCreate(contenido="Genial", idEvento=uuid4())
+
+    # Se cae la conexión justo al encolar la notificación: el comentario ya la lleva dentro
+    bandeja.fallar_inserciones = True
+    with pytest.raises(ConnectionError):
+        asyncio.run(service.create_comment(comentario, "Ana"))
+    (guardado,) = comentarios.docs.values()
+    assert guardado["notificacionPendiente"]["payload"]["autor"] == "Ana"
+
+    bandeja.fallar_inserciones = False
+    assert asyncio.run(service.flush_pending_notifications()) == 1
+    assert "notificacionPendiente" not in comentarios.docs[guardado["_id"]]
+    assert bandeja.docs[guardado["_id"]]["payload"]["idComentario"] == guardado["_id"]
+    assert asyncio.run(service.flush_pending_notifications()) == 0
+
+
+def test_a_comment_that_cannot_join_the_digest_is_sent_at_once():
+    class Usuarios:
+        def find_one(self, filtro):
+            return {"email": filtro["email"], "notification_pref": "email", "digest_minutes": 60}
+
+    class ResumenesEnConflicto:
+        def update_one(self, *args, **kwargs):
+            raise DuplicateKeyError("pendiente_por_destinatario")
+
+    def event_service(request):
+        return httpx.Response(200, json={"titulo": "Concierto", "emailOrganizador": "org@kalendas.test"})
+
+    transporte = LogTransport()
+    db = {"comentarios": None, "outbox": None, "users": Usuarios(), "notificaciones": None, "resumenes": ResumenesEnConflicto()}
+    service = CommentsService(
+        db, http_client=httpx.AsyncClient(transport=httpx.MockTransport(event_service)), email_transport=transporte
+    )
+
+    asyncio.run(service.process_outbox_task(nueva_tarea("nuevo_comentario", {
+        "idEvento": uuid4(), "autor": "Ana", "contenido": "genial",
+    })))
+
+    assert [e.destinatario for e in transporte.enviados] == ["org@kalendas.test"]
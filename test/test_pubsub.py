@@ -0,0 +1,91 @@
+import asyncio
+
+from servicios.comment_service.app.pubsub import Broker, formatear, sse_eventos
+
+
+def test_subscribers_receive_messages_of_their_channel_only():
+    async def escenario():
+        broker = Broker()
+        evento = broker.subscribe("evento:1")
+        otro = broker.subscribe("evento:2")
+        broker.publish("evento:1", "comentario", {"contenido": "Hola"})
+        return evento.cola.get_nowait(), otro.cola.empty()
+
+    mensaje, otro_vacio = asyncio.run(escenario())
+    assert mensaje.tipo == "comentario" and mensaje.datos == {"contenido": "Hola"}
+    assert otro_vacio
+    assert formatear(mensaje).startswith(f"id: {mensaje.id}\nevent: comentario\n")
+
+
+def test_last_event_id_replays_only_newer_messages():
+    async def escenario():
+        broker = Broker()
+        primero = broker.publish("usuario:a@b.c", "notificacion", {"n": 1})
+        broker.publish("usuario:a@b.c", "notificacion", {"n": 2})
+        broker.publish("usuario:a@b.c", "notificacion", {"n": 3})
+        suscripcion = broker.subscribe("usuario:a@b.c", last_event_id=primero.id)
+        return [suscripcion.cola.get_nowait().datos["n"] for _ in range(suscripcion.cola.qsize())]
+
+    assert asyncio.run(escenario()) == [2, 3]
+
+
+def test_resume_from_before_the_replay_window_asks_for_a_reload():
+    async def escenario():
+        broker = Broker(replay_size=2)
+        primero = broker.publish("evento:1", "comentario", {})
+        for _ in range(3):
+            broker.publish("evento:1", "comentario", {})
+        suscripcion = broker.subscribe("evento:1", last_event_id=primero.id)
+        return [m.tipo for m in (suscripcion.cola.get_nowait() for _ in range(suscripcion.cola.qsize()))]
+
+    assert asyncio.run(escenario()) == ["reinicio"]
+
+
+def test_slow_subscriber_is_closed_instead_of_blocking_the_publisher():
+    async def escenario():
+        broker = Broker()
+        lenta = broker.subscribe("evento:1")
+        for i in range(lenta.cola.maxsize + 1):
+            broker.publish("evento:1", "comentario", {"i": i})
+        return lenta.cola.get_nowait(), broker._suscriptores
+
+    cierre, suscriptores = asyncio.run(escenario())
+    assert cierre is None
+    assert "evento:1" not in suscriptores
+
+
+def test_idle_channels_without_subscribers_are_forgotten():
+    async def escenario():
+        broker = Broker(canal_ttl=0)
+        viejo = broker.publish("evento:1", "comentario", {})
+        broker.publish("evento:1", "comentario", {})
+        broker.publish("evento:2", "comentario", {})  # la limpieza va con la actividad del broker
+        olvidados = set(broker._historico) | set(broker._descartado)
+        # Quien reanude desde lo olvidado no puede recuperarlo: tiene que recargar
+        reanudada = broker.subscribe("evento:1", last_event_id=viejo.id)
+        return olvidados, reanudada.cola.get_nowait().tipo
+
+    olvidados, tipo = asyncio.run(escenario())
+    assert "evento:1" not in olvidados
+    assert tipo == "reinicio"
+
+
+def test_sse_stream_subscribes_only_while_it_is_being_read():
+    class Peticion:
+        async def is_disconnected(self):
+            return False
+
+    async def escenario():
+        broker = Broker()
+        flujo = sse_eventos(Peticion(), broker, "evento:1")
+        antes = dict(broker._suscriptores)
+        await flujo.__anext__()  # retry
+        broker.publish("evento:1", "comentario", {"contenido": "Hola"})
+        recibido = await flujo.__anext__()
+        durante = len(broker._suscriptores.get("evento:1", ()))
+        await flujo.aclose()
+        return antes, recibido, durante, broker._suscriptores
+
+    antes, recibido, durante, despues = asyncio.run(escenario())
+    assert antes == {} and durante == 1 and despues == {}
+    assert "event: comentario" in recibido
@@ -0,0 +1,68 @@
+from datetime import datetime
+import pytest
+
+from servicios.event_service.app.recurrence_utils import (
+    expandir_ocurrencias, fin_de_serie, validar_regla, FIN_INDEFINIDO, MAX_COUNT
+)
+
+def test_expand_weekly_in_window():
+    # Todos los lunes a las 10:00 desde el 6 de enero de 2025
+    ocurrencias = expandir_ocurrencias(
+        datetime(2025, 1, 6, 10, 0), 60, "FREQ=WEEKLY;BYDAY=MO", [],
+        datetime(2025, 2, 1), datetime(2025, 2, 28, 23, 59)
+    )
+    assert ocurrencias == [
+        datetime(2025, 2, 3, 10, 0), datetime(2025, 2, 10, 10, 0),
+        datetime(2025, 2, 17, 10, 0), datetime(2025, 2, 24, 10, 0),
+    ]
+
+def test_expand_skips_excluded_dates():
+    ocurrencias = expandir_ocurrencias(
+        datetime(2025, 1, 1, 9, 0), 30, "FREQ=DAILY", [datetime(2025, 1, 2, 9, 0)],
+        datetime(2025, 1, 1), datetime(2025, 1, 3, 23, 59)
+    )
+    assert ocurrencias == [datetime(2025, 1, 1, 9, 0), datetime(2025, 1, 3, 9, 0)]
+
+def test_expand_overlap_includes_running_occurrence():
+    # La ocurrencia de las 23:00 (3 horas) sigue en curso a la 01:00 del día siguiente
+    ocurrencias = expandir_ocurrencias(
+        datetime(2025, 1, 1, 23, 0), 180, "FREQ=DAILY;COUNT=3", [],
+        datetime(2025, 1, 2, 1, 0), datetime(2025, 1, 2, 2, 0), solapamiento=True
+    )
+    assert ocurrencias == [datetime(2025, 1, 1, 23, 0)]
+
+def test_series_end():
+    assert fin_de_serie(datetime(2025, 1, 1, 9, 0), 60, "FREQ=DAILY;COUNT=3") == datetime(2025, 1, 3, 10, 0)
+    assert fin_de_serie(datetime(2025, 1, 1, 9, 0), 60, "FREQ=DAILY") == FIN_INDEFINIDO
+
+def test_until_in_utc_is_accepted_and_bounds_the_series():
+    regla = validar_regla("FREQ=WEEKLY;BYDAY=MO;UNTIL=20261231T000000Z")
+    assert regla == "FREQ=WEEKLY;BYDAY=MO;UNTIL=20261231T000000"
+    assert fin_de_serie(datetime(2025, 1, 6, 10, 0), 60, "FREQ=WEEKLY;UNTIL=20261231T000000Z") == datetime(2026, 12, 31, 1, 0)
+    ocurrencias = expandir_ocurrencias(
+        datetime(2026, 12, 21, 10, 0), 60, "FREQ=WEEKLY;UNTIL=20261231T000000Z", [], None, None
+    )
+    assert ocurrencias == [datetime(2026, 12, 21, 10, 0), datetime(2026, 12, 28, 10, 0)]
+
+def test_count_above_the_limit_is_rejected():
+    with pytest.raises(ValueError):
+        validar_regla(f"FREQ=SECONDLY;COUNT={MAX_COUNT + 1}")
+    assert validar_regla(f"FREQ=SECONDLY;COUNT={MAX_COUNT}")
+
+def test_sub_daily_rules_need_count():
+    for regla in ("FREQ=SECONDLY", "FREQ=MINUTELY;UNTIL=20300101T000000Z", "FREQ=DAILY;BYHOUR=9,10,11;BYMINUTE=0,15,30,45;BYSECOND=0,20,40"):
+        with pytest.raises(ValueError):
+            validar_regla(regla)
+    assert validar_regla("FREQ=HOURLY;COUNT=48")
+    assert validar_regla("FREQ=DAILY;BYHOUR=9,17")
+
+def test_old_daily_and_weekly_series_expand_like_the_full_walk():
+    from dateutil.rrule import rrulestr
+    desde, hasta = datetime(2026, 3, 1), datetime(2026, 4, 15)
+    for comienzo, regla in (
+        (datetime(1900, 1, 3, 8, 30), "FREQ=DAILY;INTERVAL=3"),
+        (datetime(1900, 1, 3, 8, 30), "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,FR"),
+        (datetime(1950, 6, 1, 12, 0), "FREQ=DAILY;BYMONTHDAY=1,15;BYHOUR=9,18"),
+    ):
+        completa = list(rrulestr(regla, dtstart=comienzo).between(desde, hasta, inc=True))
+        assert expandir_ocurrencias(comienzo, 60, regla, [], desde, hasta) == completa
@@ -0,0 +1,187 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from servicios.calendar_service.app import sync_utils as sync_calendarios
+from servicios.calendar_service.app.model.calendar_models import CalendarCreate, CalendarInDB
+from servicios.calendar_service.app.service import calendarService
+from servicios.calendar_service.app.service.calendarService import CalendarService
+from servicios.event_service.app import sync_utils as sync_eventos
+from servicios.event_service.app.service.eventService import EventService
+
+
+class ContadorEnMemoria:
+    """
+    La colección 'secuencias': find_one_and_update con un pipeline de $set (las expresiones
+    que usa reservar_secuencias), update_one con $pull por igualdad y find_one.
+    """
+
+    OPERADORES = {
+        "$add": lambda a, b: a + b,
+        "$subtract": lambda a, b: a - b,
+        "$ifNull": lambda a, b: b if a is None else a,
+        "$gt": lambda a, b: a > b,
+        "$concatArrays": lambda *listas: sum(listas, []),
+    }
+
+    def __init__(self):
+        self.docs = {}
+
+    @classmethod
+    def _evaluar(cls, expresion, doc, this=None):
+        if isinstance(expresion, str) and expresion.startswith("$$this."):
+            return this[expresion[len("$$this."):]]
+        if isinstance(expresion, str) and expresion.startswith("$"):
+            return doc.get(expresion[1:])
+        if isinstance(expresion, list):
+            return [cls._evaluar(e, doc, this) for e in expresion]
+        if isinstance(expresion, dict):
+            (operador, args), = expresion.items() if len(expresion) == 1 else ((None, None),)
+            if operador == "$filter":
+                return [x for x in cls._evaluar(args["input"], doc, this) if cls._evaluar(args["cond"], doc, x)]
+            if operador in cls.OPERADORES:
+                return cls.OPERADORES[operador](*cls._evaluar(args, doc, this))
+            return {campo: cls._evaluar(valor, doc, this) for campo, valor in expresion.items()}
+        return expresion
+
+    def find_one_and_update(self, filtro, pipeline, upsert=False, return_document=None):
+        doc = self.docs.setdefault(filtro["_id"], {"_id": filtro["_id"]})
+        for etapa in pipeline:
+            doc.update({campo: self._evaluar(valor, doc) for campo, valor in etapa["$set"].items()})
+        return dict(doc)
+
+    def update_one(self, filtro, cambios):
+        doc = self.docs[filtro["_id"]]
+        for campo, condicion in cambios["$pull"].items():
+            doc[campo] = [x for x in doc[campo] if any(x.get(k) != v for k, v in condicion.items())]
+
+    def find_one(self, filtro):
+        return self.docs.get(filtro["_id"])
+
+
+def _cumple(doc, filtro):
+    for campo, condicion in filtro.items():
+        if campo == "$and":
+            if not all(_cumple(doc, f) for f in condicion):
+                return False
+        elif campo == "$or":
+            if not any(_cumple(doc, f) for f in condicion):
+                return False
+        elif isinstance(condicion, dict):
+            if "$gt" in condicion and not doc[campo] > condicion["$gt"]:
+                return False
+            if "$lt" in condicion and not doc[campo] < condicion["$lt"]:
+                return False
+        elif doc[campo] != condicion:
+            return False
+    return True
+
+
+class CrudCambios:
+    """
+    CRUD en memoria con las secuencias de sync_utils. Las escrituras de los _id en
+    'retenidos' esperan, ya con su secuencia reservada, a que se libere su evento.
+    """
+
+    def __init__(self, sync_utils, contador):
+        self.sync_utils, self.contador = sync_utils, contador
+        self.secuencias = ContadorEnMemoria()
+        self.cambios, self.borrados = [], []
+        self.retenidos = {}
+
+    @asynccontextmanager
+    async def reserve_sequence(self, cantidad: int = 1):
+        with self.sync_utils.secuencias_reservadas(self.secuencias, self.contador, cantidad) as ultima:
+            yield ultima
+
+    async def sequence_limit(self):
+        return self.sync_utils.tope_visible(self.secuencias, self.contador)
+
+    async def _guardar(self, destino, doc):
+        if doc["_id"] in self.retenidos:
+            await self.retenidos[doc["_id"]].wait()
+        destino.append(doc)
+
+    async def create(self, doc):
+        await self._guardar(self.cambios, doc)
+        return CalendarInDB.model_validate(doc)
+
+    async def get_by_id(self, _id):
+        return None
+
+    async def delete(self, _id):
+        return 1
+
+    async def add_tombstone(self, _id, secuencia):
+        await self._guardar(self.borrados, {"_id": _id, "secuencia": secuencia})
+
+    async def list_changes(self, filtro, limit):
+        return sorted((d for d in self.cambios if _cumple(d, filtro)), key=self.sync_utils.orden)[:limit]
+
+    async def list_tombstones(self, filtro, limit):
+        return sorted((d for d in self.borrados if _cumple(d, filtro)), key=self.sync_utils.orden)[:limit]
+
+
+async def _intercalar(crud, a, b, escribir, leer):
+    """
+    El escritor A reserva su secuencia pero guarda después que B, que reserva la siguiente.
+    Devuelve lo que ve un lector mientras A sigue en curso y lo que ve después con su token.
+    """
+    crud.retenidos[a] = asyncio.Event()
+    escritor_a = asyncio.create_task(escribir(a))
+    await asyncio.sleep(0)
+    await escribir(b)
+
+    antes = await leer(None)
+    crud.retenidos[a].set()
+    await escritor_a
+    despues = await leer(antes.token)
+    return antes, despues
+
+
+def test_event_changes_wait_for_a_tombstone_whose_sequence_is_still_in_flight():
+    crud = CrudCambios(sync_eventos, "eventos")
+    service = EventService(crud_repository=crud)
+    a, b = uuid4(), uuid4()
+
+    antes, despues = asyncio.run(_intercalar(crud, a, b, service.delete_event, service.get_changes))
+
+    assert {d["_id"]: d["secuencia"] for d in crud.borrados} == {a: 1, b: 2}
+    assert antes.eliminados == []
+    assert despues.eliminados == [a, b]
+
+
+def test_calendar_changes_wait_for_a_write_whose_sequence_is_still_in_flight(monkeypatch):
+    crud = CrudCambios(sync_calendarios, "calendarios")
+    service = CalendarService(crud)
+    a, b = uuid4(), uuid4()
+    # El servicio asigna el _id: A y B, en el orden en que empiezan a escribir
+    monkeypatch.setattr(calendarService, "uuid4", iter([a, b]).__next__)
+
+    async def crear(_id):
+        return await service.create_calendar(CalendarCreate(titulo="Fiestas", organizador="Ayto"))
+
+    antes, despues = asyncio.run(_intercalar(crud, a, b, crear, service.get_changes))
+
+    assert antes.cambios == []
+    assert [(c.id, c.secuencia) for c in despues.cambios] == [(a, 1), (b, 2)]
+
+
+def test_expired_reservations_stop_holding_readers_back():
+    contador = ContadorEnMemoria()
+    assert sync_eventos.tope_visible(contador, "eventos") is None
+
+    # Un proceso que murió con su reserva en curso la retiene hasta que caduca
+    colgada = sync_eventos.reservar_secuencias(contador, "eventos")
+    assert sync_eventos.tope_visible(contador, "eventos") == colgada
+    contador.docs["eventos"]["enCurso"][0]["caducaEn"] = datetime.utcnow() - timedelta(seconds=1)
+    assert sync_eventos.tope_visible(contador, "eventos") == colgada + 1
+
+    with sync_eventos.secuencias_reservadas(contador, "eventos", 3) as ultima:
+        assert ultima == colgada + 3
+        # La caducada se descarta al reservar
+        assert [(r["desde"], r["hasta"]) for r in contador.docs["eventos"]["enCurso"]] == [(colgada + 1, ultima)]
+        assert sync_eventos.tope_visible(contador, "eventos") == colgada + 1
+    assert contador.docs["eventos"]["enCurso"] == []
+    assert sync_eventos.tope_visible(contador, "eventos") == ultima + 1
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from servicios.external_calendar_service.app.tabular import iter_eventos
+
+
+def _leer(contenido: bytes, formato: str, columnas=None, tam_trozo: int = 7):
+    async def trozos():
+        # Trozos pequeños para partir filas, comillas y caracteres UTF-8 entre lecturas
+        for i in range(0, len(contenido), tam_trozo):
+            yield contenido[i:i + tam_trozo]
+
+    async def ejecutar():
+        return [fila async for fila in iter_eventos(trozos(), formato, columnas)]
+
+    return asyncio.run(ejecutar())
+
+
+def test_csv_with_column_mapping_reports_bad_rows_by_line():
+    csv = (
+        "﻿Asunto,Inicio,Fin,Sala\r\n"
+        "Clase de química,2025-03-01T10:00,2025-03-01T11:30,Aula 2\r\n"
+        "\"Reunión, con coma\",2025-03-02 09:00:00Z,,\"Sala\nnorte\"\r\n"
+        "Sin fecha,,,\r\n"
+        "Excursión,2025-03-03T08:00,2025-03-03T07:00,\r\n"
+    ).encode()
+
+    filas = _leer(csv, "csv", {"titulo": "Asunto", "horaComienzo": "Inicio", "horaFin": "Fin", "lugar": "Sala"})
+
+    (n1, clase, _), (n2, reunion, _), (n3, _, error3), (n4, _, error4) = filas
+    assert (n1, clase["duracionMinutos"], clase["lugar"]) == (2, 90, "Aula 2")
+    assert (n2, reunion["titulo"], reunion["horaComienzo"]) == (3, "Reunión, con coma", "2025-03-02T09:00:00")
+    assert reunion["duracionMinutos"] == 60 and reunion["lugar"] == "Sala\nnorte"
+    assert n3 == 5 and "horaComienzo" in error3
+    assert n4 == 6 and "duración" in error4
+
+
+def test_ndjson_bad_lines_do_not_stop_the_import():
+    lineas = [
+        json.dumps({"titulo": "Concierto", "horaComienzo": "2025-06-01T21:00", "duracionMinutos": 120}),
+        "{no es json",
+        json.dumps(["lista"]),
+        json.dumps({"titulo": "Teatro", "horaComienzo": "2025-06-02T20:00"}),
+    ]
+
+    filas = _leer("\n".join(lineas).encode(), "ndjson")
+
+    assert [(n, e is not None) for n, e, _ in filas] == [(1, True), (2, False), (3, False), (4, True)]
+    assert filas[0][1]["duracionMinutos"] == 120